@@ -0,0 +1,139 @@
+## Convergence-driven runs: every species runs until its summary statistics are precise enough
+# Scenarios are run through the streaming models one batch at a time, from the same seeded
+# per-block streams as a fixed-size run. After each batch the Monte Carlo standard error of every
+# reported statistic (mean, 5th, 50th and 95th percentile; see SummaryAccumulator.summary_errors)
+# is checked for every stage and model of a species, and a species whose errors are all within
+# max(tolerance, relative_tolerance*|value|) stops: its later batches are not simulated at all.
+# A species stops with the stages that share its scenarios (its sentience, Birch, welfare range
+# and adjusted welfare range results), so a species that stopped after N scenarios has the draws,
+# and the results, of a fixed run of N scenarios (the means up to rounding). The summary CSVs
+# and results file carry the achieved errors and scenario counts next to the values.
+import os
+import time
+import pickle
+import argparse
+
+import numpy as np
+
+import random_streams
+import instrumentation
+import results_store
+import sent_engine
+import streaming
+import pipeline
+
+TOLERANCE = 0.005
+RELATIVE_TOLERANCE = 0.01
+
+BATCH_SIZE = random_streams.STREAM_BLOCK
+MIN_SCENARIOS = 2 * random_streams.STREAM_BLOCK
+MAX_SCENARIOS = 100 * random_streams.STREAM_BLOCK
+
+
+# Whether every statistic of `accumulator` has a standard error within the tolerance
+def converged(accumulator, tolerance=TOLERANCE, relative_tolerance=RELATIVE_TOLERANCE):
+    values = np.abs(accumulator.summary())
+    errors = np.array(accumulator.summary_errors())
+    return bool(np.all(errors <= np.maximum(tolerance, relative_tolerance*values)))
+
+
+# Runs batches of `batch_size` scenarios until every species has converged or reached
+# `max_scenarios`. Returns the {(stage, model, species): SummaryAccumulator} of the run and
+# {species: (scenarios, converged)}. The sometimes-operates scores and the priors are drawn for
+# every batch that still has a species running.
+def run_adaptive(s_params, wr_params, s_unknowns, wr_unknowns, tolerance=TOLERANCE, relative_tolerance=RELATIVE_TOLERANCE, \
+        batch_size=BATCH_SIZE, min_scenarios=MIN_SCENARIOS, max_scenarios=MAX_SCENARIOS, \
+        sent_species=pipeline.SENT_SPECIES, wr_species=pipeline.WR_SPECIES, inputs=None, models=None, verbose=True, \
+        metrics=None):
+    if metrics is None:
+        metrics = instrumentation.default_metrics(verbose)
+    if batch_size % random_streams.STREAM_BLOCK != 0:
+        raise ValueError('batch_size must be a multiple of {}'.format(random_streams.STREAM_BLOCK))
+    missing = [species for species in wr_species if species in pipeline.SENT_SPECIES and species not in sent_species]
+    if missing:
+        raise ValueError('welfare ranges of {} need their sentience scores in the same run'.format(missing))
+    s_params, wr_params = dict(s_params), dict(wr_params)
+    for params in [s_params, wr_params]:
+        if params.get('SEED') is None:
+            params['SEED'] = random_streams.new_root_seed()
+
+    config = {'s_params': s_params, 'wr_params': wr_params, 's_unknowns': s_unknowns, 'wr_unknowns': wr_unknowns, \
+        'inputs': inputs if inputs is not None else pipeline.load_inputs(), \
+        'models': models if models is not None else streaming.load_models()}
+    running = [species for species in sent_species if species != sent_engine.SOMETIMES_OPERATES]
+    running += [species for species in wr_species if species not in running]
+    accumulators, timings, stopped = {}, {}, {}
+    first_scenario = 0
+    start_time = time.time()
+
+    while running and first_scenario < max_scenarios:
+        n_scenarios = min(batch_size, max_scenarios - first_scenario)
+        batch = {}
+        streaming._run_chunk(first_scenario, n_scenarios, dict(config, \
+            sent_species=[species for species in sent_species if species in running], \
+            wr_species=[species for species in wr_species if species in running]), batch, timings)
+        first_scenario += n_scenarios
+        streaming.merge_accumulators(accumulators, {key: accumulator for key, accumulator in batch.items() \
+            if key[2] in running})
+
+        if first_scenario >= min_scenarios:
+            for species in list(running):
+                if all(converged(accumulator, tolerance, relative_tolerance) \
+                        for key, accumulator in accumulators.items() if key[2] == species):
+                    running.remove(species)
+                    stopped[species] = (first_scenario, True)
+                    metrics.emit('converged', '... {} converged after {} scenarios'.format(species, first_scenario), \
+                        species=species, scenarios=first_scenario)
+        seconds = time.time() - start_time
+        metrics.progress('adaptive', first_scenario, max_scenarios, '... Completed {} scenarios, {} species still running ' \
+            '({:.1f}s)'.format(first_scenario, len(running), seconds), running=len(running), seconds=seconds)
+
+    for species in running:
+        stopped[species] = (first_scenario, False)
+        metrics.emit('converged', '... {} did not converge in {} scenarios'.format(species, first_scenario), \
+            species=species, scenarios=first_scenario, converged=False)
+    for (stage, species), seconds in sorted(timings.items()):
+        metrics.stage_done(stage, seconds, species=species)
+    metrics.stage_done('adaptive', time.time() - start_time, first_scenario)
+    return accumulators, stopped
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run every species until the Monte Carlo errors of its summary statistics are within a tolerance')
+    parser.add_argument('--tolerance', type=float, help='Standard error every statistic has to reach', default=TOLERANCE)
+    parser.add_argument('--relative_tolerance', type=float, help='Or this fraction of the statistic, if that is larger', default=RELATIVE_TOLERANCE)
+    parser.add_argument('--batch_size', type=int, help='Scenarios run between convergence checks', default=BATCH_SIZE)
+    parser.add_argument('--min_scenarios', type=int, help='Scenarios every species runs before it can stop', default=MIN_SCENARIOS)
+    parser.add_argument('--max_scenarios', type=int, help='Scenarios after which every species stops', default=MAX_SCENARIOS)
+    parser.add_argument('--output_root', type=str, help='Directory to write the results file and *_estimates folders into', default='')
+    parser.add_argument('--no_csv', action='store_true', help='Only write the results file, not the per-model summary CSVs')
+    parser.add_argument('--metrics', type=str, help='JSON lines file for progress and timing events; defaults to metrics.jsonl in the output root', default=None)
+    args = parser.parse_args()
+
+    s_params = pickle.load(open(os.path.join('input_data', 'Sentience Parameters.p'), 'rb'))
+    wr_params = pickle.load(open(os.path.join('input_data', 'Welfare Range Parameters.p'), 'rb'))
+    s_unknowns = pickle.load(open(os.path.join('input_data', 'Sentience Unknown Probabilities.p'), 'rb'))
+    wr_unknowns = pickle.load(open(os.path.join('input_data', 'Welfare Range Unknown Probabilities.p'), 'rb'))
+
+    if args.output_root:
+        os.makedirs(args.output_root, exist_ok=True)
+    metrics_path = args.metrics if args.metrics is not None else os.path.join(args.output_root, instrumentation.METRICS_FILE)
+    with instrumentation.default_metrics(path=metrics_path) as metrics:
+        accumulators, stopped = run_adaptive(s_params, wr_params, s_unknowns, wr_unknowns, args.tolerance, \
+            args.relative_tolerance, args.batch_size, args.min_scenarios, args.max_scenarios, metrics=metrics)
+        with metrics.stage('write') as extra:
+            paths = [streaming.write_results(accumulators, os.path.join(args.output_root, results_store.RESULTS_FILE), \
+                errors=True)]
+            print('... Wrote {}'.format(paths[0]))
+            if not args.no_csv:
+                summary_paths = streaming.write_summaries(accumulators, args.output_root, errors=True)
+                print('... Wrote {} summary files'.format(len(summary_paths)))
+                paths += summary_paths
+            extra['bytes_written'] = instrumentation.bytes_written(paths)
+    unconverged = sorted(species for species, (scenarios, done) in stopped.items() if not done)
+    if unconverged:
+        print('... Not converged within {} scenarios: {}'.format(args.max_scenarios, ', '.join(unconverged)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+## Run many model configurations without the interactive prompts
+# A job file lists named configurations, each with the answers run.py asks for. Every
+# configuration is streamed through all the models (see streaming.py) on a process pool, with the
+# input tables parsed once, and its results file and summary CSVs are written under
+# <output_root>/<name>/.
+#
+# Job file (JSON); "defaults" apply to every configuration and a configuration's own values win:
+# {"defaults": {"N_SCENARIOS": 10000,
+#               "sentience": {"WEIGHT_NOS": "Yes", "HC_WEIGHT": 5},
+#               "welfare ranges": {"WEIGHT_NOS": "Yes", "HC_WEIGHT": 5}},
+#  "configs": [{"name": "baseline"},
+#              {"name": "unknowns_half", "SEED": 2024,
+#               "sentience": {"UNKNOWNS": 0.5},
+#               "welfare ranges": {"UNKNOWNS": {"shrimp": 0.5, "crabs": 0.25}}}]}
+# UNKNOWNS is one probability for every species or {species: probability} (others stay 0). A
+# configuration without a SEED gets a new root seed, which is saved with its results.
+import os
+import re
+import sys
+import copy
+import json
+import time
+import argparse
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import results_store
+import random_streams
+import pipeline
+import streaming
+
+STAGES = {pipeline.SENTIENCE: pipeline.SENT_SPECIES, pipeline.WELFARE_RANGES: pipeline.WR_SPECIES}
+
+CONFIG_FILE = 'config.json'
+REPORT_FILE = 'batch_report.csv'
+
+_WORKER_STATE = None
+
+
+def _merge(defaults, overrides):
+    merged = copy.deepcopy(defaults)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict) and key != 'UNKNOWNS':
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+
+def unknown_probs(species_list, unknowns):
+    if unknowns is None:
+        unknowns = 0
+    if isinstance(unknowns, dict):
+        extra = set(unknowns) - set(species_list)
+        if extra:
+            raise ValueError('{} are not in the species list {}'.format(sorted(extra), species_list))
+        probs = {species: float(unknowns.get(species, 0)) for species in species_list}
+    else:
+        probs = {species: float(unknowns) for species in species_list}
+    for species, prob in probs.items():
+        if prob < 0 or prob > 1:
+            raise ValueError('Unknown probability of {} must be in [0,1], got {}'.format(species, prob))
+    return probs
+
+
+# The (params, unknowns) run.py would build for one stage from the answers in `stage_config`
+def stage_params(stage, stage_config, n_scenarios, seed):
+    weight_nos = stage_config.get('WEIGHT_NOS', 'Yes')
+    if weight_nos not in ['Yes', 'No']:
+        raise ValueError('{} WEIGHT_NOS must be "Yes" or "No", got {!r}'.format(stage, weight_nos))
+    hc_weight = float(stage_config.get('HC_WEIGHT', 1))
+    if hc_weight < 1:
+        raise ValueError('{} HC_WEIGHT must be >= 1, got {}'.format(stage, hc_weight))
+    params = {'N_SCENARIOS': int(n_scenarios), 'WEIGHT_NOS': weight_nos, 'HC_WEIGHT': hc_weight, \
+        'SEED': stage_config.get('SEED', seed)}
+    return params, unknown_probs(STAGES[stage], stage_config.get('UNKNOWNS'))
+
+
+# Reads a job file into a list of fully specified configurations, validated before anything runs
+def load_jobs(job_file):
+    with open(job_file) as f:
+        jobs = json.load(f)
+    defaults = jobs.get('defaults', {})
+    configs, names = [], set()
+    for ii, overrides in enumerate(jobs['configs']):
+        config = _merge(defaults, overrides)
+        name = config.get('name')
+        if not name or not re.fullmatch(r'[\w.-]+', name):
+            raise ValueError('Configuration {} needs a name made of letters, digits, "_", "-" or "."'.format(ii))
+        if name in names:
+            raise ValueError('Configuration name {} is used twice'.format(name))
+        names.add(name)
+        if 'N_SCENARIOS' not in config:
+            raise ValueError('Configuration {} has no N_SCENARIOS'.format(name))
+        seed = config.get('SEED')
+        if seed is None:
+            seed = random_streams.new_root_seed()
+        config['stages'] = {stage: stage_params(stage, config.get(stage, {}), config['N_SCENARIOS'], seed) \
+            for stage in STAGES}
+        configs.append(config)
+    return configs
+
+
+def _init_worker(inputs, models):
+    global _WORKER_STATE
+    _WORKER_STATE = (inputs, models)
+
+
+# Streams one configuration and writes its summaries and resolved parameters under its namespace
+def run_config(config, output_root, inputs=None, models=None):
+    if inputs is None:
+        inputs, models = _WORKER_STATE
+    start = time.time()
+    (s_params, s_unknowns), (wr_params, wr_unknowns) = config['stages'][pipeline.SENTIENCE], \
+        config['stages'][pipeline.WELFARE_RANGES]
+    accumulators = streaming.run_streaming(s_params, wr_params, s_unknowns, wr_unknowns, inputs=inputs, models=models, \
+        verbose=False)
+    output_dir = os.path.join(output_root, config['name'])
+    os.makedirs(output_dir, exist_ok=True)
+    streaming.write_results(accumulators, os.path.join(output_dir, results_store.RESULTS_FILE))
+    streaming.write_summaries(accumulators, output_dir)
+    with open(os.path.join(output_dir, CONFIG_FILE), 'w') as f:
+        json.dump({'name': config['name'], 'N_SCENARIOS': s_params['N_SCENARIOS'], \
+            pipeline.SENTIENCE: dict(s_params, UNKNOWNS=s_unknowns), \
+            pipeline.WELFARE_RANGES: dict(wr_params, UNKNOWNS=wr_unknowns)}, f, indent=1)
+    return time.time() - start
+
+
+def _run_config_safely(config, output_root, inputs=None, models=None):
+    try:
+        return {'status': 'ok', 'seconds': run_config(config, output_root, inputs, models), 'error': None}
+    except Exception:
+        return {'status': 'failed', 'seconds': None, 'error': traceback.format_exc()}
+
+
+# Runs every configuration, `workers` at a time, and returns a {name: result} report. A failing
+# configuration is reported and does not stop the others.
+def run_batch(configs, output_root='batch_output', workers=None, verbose=True):
+    inputs, models = pipeline.load_inputs(), streaming.load_models()
+    os.makedirs(output_root, exist_ok=True)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    report = {}
+
+    def record(config, result):
+        report[config['name']] = dict(result, scenarios=config['N_SCENARIOS'])
+        if verbose:
+            if result['status'] == 'ok':
+                print('... {} done in {:.2f}s'.format(config['name'], result['seconds']))
+            else:
+                print('... {} FAILED'.format(config['name']))
+
+    if workers <= 1:
+        for config in configs:
+            record(config, _run_config_safely(config, output_root, inputs, models))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(inputs, models)) as pool:
+            futures = {pool.submit(_run_config_safely, config, output_root): config for config in configs}
+            for future in as_completed(futures):
+                record(futures[future], future.result())
+    return {config['name']: report[config['name']] for config in configs}
+
+
+def failed_configs(report):
+    return [name for name, result in report.items() if result['status'] != 'ok']
+
+
+def write_report(report, output_root):
+    path = os.path.join(output_root, REPORT_FILE)
+    report_df = pd.DataFrame([{'name': name, 'status': result['status'], 'scenarios': result['scenarios'], \
+        'seconds': result['seconds'], 'error': result['error']} for name, result in report.items()])
+    report_df.to_csv(path, index=False)
+    return path
+
+
+def print_report(report):
+    for name in failed_configs(report):
+        print('### {} FAILED ###'.format(name))
+        print(report[name]['error'])
+    n_ok = len(report) - len(failed_configs(report))
+    print('{}/{} configurations completed'.format(n_ok, len(report)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run every configuration of a job file and write their summary statistics')
+    parser.add_argument('job_file', type=str, help='JSON file listing the named configurations to run')
+    parser.add_argument('--output_root', type=str, help='Directory to write one folder per configuration into', default='batch_output')
+    parser.add_argument('--workers', type=int, help='How many configurations to run at once? Defaults to the number of cores', default=None)
+    args = parser.parse_args()
+
+    configs = load_jobs(args.job_file)
+    print('... Running {} configurations'.format(len(configs)))
+    report = run_batch(configs, args.output_root, args.workers)
+    print_report(report)
+    print('... Wrote {}'.format(write_report(report, args.output_root)))
+    if failed_configs(report):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
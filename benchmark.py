@@ -0,0 +1,321 @@
+## Benchmarks of every stage at increasing scenario counts
+# Each stage runs on the real input_data tables for one species (all species for the priors and
+# the Mixture model) and records its wall time, scenarios per second and peak memory (the peak
+# of traced allocations while the stage runs). Inputs a stage needs (e.g. the scores the models
+# evaluate) are built outside the timed region. Counts above `chunk_size` are run a chunk at a
+# time, as streaming.py runs them, so 10^7 scenarios fit in memory; the score store round trip
+# needs the whole matrix at once and is skipped when it would not fit.
+#
+# The results are compared against a stored baseline: a stage regresses when its throughput
+# falls, or its peak memory grows, by more than `threshold` (timings under MIN_SECONDS are too
+# noisy to compare). "--save_baseline" stores the current results as the new baseline.
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import score_store
+import random_streams
+import sent_simulate
+import wr_simulate
+import sent_engine
+import wr_engine
+import pipeline
+import streaming
+
+SIZES = [10**3, 10**4, 10**5, 10**6, 10**7]
+
+BASELINE_FILE = 'benchmark_baseline.json'
+RESULTS_FILE = 'benchmark_results.csv'
+
+THRESHOLD = 0.25
+MIN_SECONDS = 0.1
+
+BENCHMARK_SEED = 2023  # fixed, so every run times the same draws
+
+CHUNK_SIZE = streaming.CHUNK_SIZE
+
+MIXTURE_BOUNDS_SCENARIOS = random_streams.STREAM_BLOCK
+
+
+# Parameters, parsed inputs and models shared by every stage
+def load_context(species='pigs'):
+    if species not in pipeline.SENT_SPECIES or species not in pipeline.WR_SPECIES:
+        raise ValueError('Benchmarks need a species with sentience and welfare range judgments, got {}'.format(species))
+    s_params = pickle.load(open(os.path.join('input_data', 'Sentience Parameters.p'), 'rb'))
+    wr_params = pickle.load(open(os.path.join('input_data', 'Welfare Range Parameters.p'), 'rb'))
+    s_unknowns = pickle.load(open(os.path.join('input_data', 'Sentience Unknown Probabilities.p'), 'rb'))
+    wr_unknowns = pickle.load(open(os.path.join('input_data', 'Welfare Range Unknown Probabilities.p'), 'rb'))
+    s_params = dict(s_params, SEED=BENCHMARK_SEED)
+    wr_params = dict(wr_params, SEED=BENCHMARK_SEED)
+    inputs, models = pipeline.load_inputs(), streaming.load_models()
+
+    # The Mixture model is fitted to the 5th/95th percentiles of every model's welfare ranges
+    accumulators = streaming.run_streaming(s_params, wr_params, s_unknowns, wr_unknowns, \
+        n_scenarios=MIXTURE_BOUNDS_SCENARIOS, inputs=inputs, models=models, verbose=False, mixtures=False)
+    model_stats = {model_name: streaming.summary_frame(accumulators, 'wr', model_name, pipeline.WR_SPECIES, sort=False) \
+        for model_name in wr_engine.WR_MODELS}
+    lowers, uppers = wr_engine.mixture_bounds(model_stats, wr_engine.WR_MODELS, pipeline.WR_SPECIES)
+
+    return {'species': species, 's_params': s_params, 'wr_params': wr_params, 's_unknowns': s_unknowns, \
+        'wr_unknowns': wr_unknowns, 'inputs': inputs, 'models': models, 'mixture_bounds': (lowers, uppers)}
+
+
+def _simulate_sentience(context, species, first_scenario, n_scenarios):
+    params = context['s_params']
+    return sent_simulate.simulate_species(context['inputs']['sent_judgments'], species, context['s_unknowns'][species], \
+        params['WEIGHT_NOS'], params['HC_WEIGHT'], n_scenarios, hc_proxies=context['inputs']['sent_hc_proxies'], \
+        seed=params['SEED'], first_scenario=first_scenario)
+
+
+def _simulate_wr(context, first_scenario, n_scenarios, sent_scores):
+    params, inputs, species = context['wr_params'], context['inputs'], context['species']
+    return wr_simulate.simulate_species(inputs['wr_judgments'], species, context['wr_unknowns'][species], \
+        params['WEIGHT_NOS'], params['HC_WEIGHT'], n_scenarios, sent_scores=sent_scores, \
+        hc_proxies=inputs['wr_hc_proxies'], sent_hc_proxies=inputs['sent_hc_proxies'], \
+        overlap_dict=inputs['overlap_dict'], seed=params['SEED'], first_scenario=first_scenario)
+
+
+# Every stage is (prepare, run): prepare(context, first_scenario, n_scenarios) builds the stage's
+# inputs untimed and run(context, inputs) is the timed work
+def _prepare_chunk(context, first_scenario, n_scenarios):
+    return first_scenario, n_scenarios
+
+
+def _run_sent_simulate(context, chunk):
+    return _simulate_sentience(context, context['species'], *chunk)
+
+
+def _prepare_wr_simulate(context, first_scenario, n_scenarios):
+    proxies, scores = _simulate_sentience(context, context['species'], first_scenario, n_scenarios)
+    return first_scenario, n_scenarios, score_store.ScoreStore(scores, proxies)
+
+
+def _run_wr_simulate(context, chunk):
+    return _simulate_wr(context, *chunk)
+
+
+def _run_priors(context, chunk):
+    return streaming.sample_priors(context['s_params']['SEED'], *chunk)
+
+
+def _prepare_sentience_models(context, first_scenario, n_scenarios):
+    proxies, scores = _simulate_sentience(context, context['species'], first_scenario, n_scenarios)
+    so_proxies, so_scores = _simulate_sentience(context, sent_engine.SOMETIMES_OPERATES, first_scenario, n_scenarios)
+    prior = streaming.sample_priors(context['s_params']['SEED'], first_scenario, n_scenarios)[context['species']]
+    return scores, proxies, prior, so_scores, so_proxies
+
+
+# Every sentience model and the Birch model, as one_species_ps_sentience_priors_based and
+# one_species_birch_est evaluate them
+def _run_sentience_models(context, chunk):
+    return sent_engine.posteriors(*chunk, context['models']['sentience'])
+
+
+def _prepare_welfare_ranges(context, first_scenario, n_scenarios):
+    return _simulate_wr(context, *_prepare_wr_simulate(context, first_scenario, n_scenarios))
+
+
+# Every welfare range model of one species, as wr_models.ipynb evaluates them
+def _run_welfare_ranges(context, chunk):
+    proxies, scores = chunk
+    return wr_engine.welfare_ranges(scores, proxies, context['models']['wr'], context['wr_params']['HC_WEIGHT'], \
+        wr_engine.WR_FFF[context['species']])
+
+
+# The Mixture model with neuron counts for every species (mixture_one_species)
+def _run_mixture(context, chunk):
+    first_scenario, n_scenarios = chunk
+    lowers, uppers = context['mixture_bounds']
+    rng = random_streams.stage_generator(context['wr_params']['SEED'], 'mixture', 'benchmark {}'.format(first_scenario))
+    return wr_engine.sample_fitted_mixture(lowers, uppers, wr_engine.WR_MODELS, [1]*(len(wr_engine.WR_MODELS) + 1), \
+        n_scenarios, rng, constants=[wr_engine.NEURON_COUNTS[species] for species in pipeline.WR_SPECIES])
+
+
+def _prepare_store(context, first_scenario, n_scenarios):
+    return _simulate_sentience(context, context['species'], first_scenario, n_scenarios)
+
+
+# Writes the species' sentience scores to a score store and reads every column back
+def _run_store(context, chunk):
+    proxies, scores = chunk
+    directory = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(directory, 'sent_{}_'.format(context['species']))
+        score_store.write_scores(prefix, proxies, scores)
+        return np.asarray(score_store.load_scores(prefix).matrix, dtype=float).sum()
+    finally:
+        shutil.rmtree(directory)
+
+
+STAGES = {'sent_simulate': (_prepare_chunk, _run_sent_simulate),
+            'wr_simulate': (_prepare_wr_simulate, _run_wr_simulate),
+            'priors': (_prepare_chunk, _run_priors),
+            'sentience models': (_prepare_sentience_models, _run_sentience_models),
+            'welfare ranges': (_prepare_welfare_ranges, _run_welfare_ranges),
+            'mixture': (_prepare_chunk, _run_mixture),
+            'score store': (_prepare_store, _run_store)}
+
+# Stages that need all scenarios at once, with the bytes they hold per scenario
+UNCHUNKED = {'score store': lambda context: 4*8*len(context['inputs']['sent_judgments'].proxies)}
+
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+# {stage, scenarios, seconds, scenarios_per_s, peak_mb, status} of one stage at `n_scenarios`,
+# the best of `repeats` runs
+def benchmark_stage(context, stage, n_scenarios, repeats=1, chunk_size=CHUNK_SIZE, memory_limit=None):
+    result = {'stage': stage, 'scenarios': n_scenarios, 'seconds': None, 'scenarios_per_s': None, 'peak_mb': None, \
+        'status': 'ok'}
+    if stage in UNCHUNKED:
+        if memory_limit is not None and UNCHUNKED[stage](context)*n_scenarios > memory_limit:
+            result['status'] = 'skipped (memory)'
+            return result
+        chunks = [(0, n_scenarios)]
+    else:
+        chunks = [(start, min(chunk_size, n_scenarios - start)) for start in range(0, n_scenarios, chunk_size)]
+
+    prepare, run = STAGES[stage]
+    best, peak = None, 0
+    tracemalloc.start()
+    try:
+        for repeat in range(repeats):
+            seconds = 0
+            for first_scenario, n_chunk in chunks:
+                stage_inputs = prepare(context, first_scenario, n_chunk)
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                start = time.perf_counter()
+                run(context, stage_inputs)
+                seconds += time.perf_counter() - start
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+                del stage_inputs
+            best = seconds if best is None else min(best, seconds)
+    finally:
+        tracemalloc.stop()
+
+    result.update({'seconds': best, 'scenarios_per_s': n_scenarios/best if best > 0 else float('inf'), \
+        'peak_mb': peak/2**20})
+    return result
+
+
+def run_benchmarks(context, stages=list(STAGES), sizes=SIZES, repeats=1, chunk_size=CHUNK_SIZE, memory_limit=None, \
+        verbose=True):
+    if chunk_size % random_streams.STREAM_BLOCK != 0:
+        raise ValueError('chunk_size must be a multiple of {}'.format(random_streams.STREAM_BLOCK))
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError('Unknown stages {}; choose from {}'.format(unknown, list(STAGES)))
+
+    results = []
+    for n_scenarios in sizes:
+        for stage in stages:
+            result = benchmark_stage(context, stage, n_scenarios, repeats, chunk_size, memory_limit)
+            results.append(result)
+            if verbose:
+                if result['status'] == 'ok':
+                    print('... {} x {}: {:.3f}s, {:,.0f} scenarios/s, {:.1f} MB peak'.format(stage, n_scenarios, \
+                        result['seconds'], result['scenarios_per_s'], result['peak_mb']))
+                else:
+                    print('... {} x {}: {}'.format(stage, n_scenarios, result['status']))
+    return results
+
+
+def _key(result):
+    return '{}|{}'.format(result['stage'], result['scenarios'])
+
+
+def load_baseline(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Results whose key is already in the baseline replace it, others are added
+def save_baseline(results, path=BASELINE_FILE):
+    baseline = load_baseline(path)
+    baseline.update({_key(result): {'seconds': result['seconds'], 'scenarios_per_s': result['scenarios_per_s'], \
+        'peak_mb': result['peak_mb']} for result in results if result['status'] == 'ok'})
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+    return path
+
+
+# [{stage, scenarios, metric, baseline, current, change}] of every result slower or larger than
+# its baseline by more than `threshold`
+def regressions(results, baseline, threshold=THRESHOLD):
+    found = []
+    for result in results:
+        reference = baseline.get(_key(result))
+        if result['status'] != 'ok' or reference is None:
+            continue
+        if max(result['seconds'], reference['seconds']) >= MIN_SECONDS and \
+                result['scenarios_per_s'] < reference['scenarios_per_s']*(1 - threshold):
+            found.append({'stage': result['stage'], 'scenarios': result['scenarios'], 'metric': 'scenarios_per_s', \
+                'baseline': reference['scenarios_per_s'], 'current': result['scenarios_per_s'], \
+                'change': result['scenarios_per_s']/reference['scenarios_per_s'] - 1})
+        if reference['peak_mb'] > 0 and result['peak_mb'] > reference['peak_mb']*(1 + threshold):
+            found.append({'stage': result['stage'], 'scenarios': result['scenarios'], 'metric': 'peak_mb', \
+                'baseline': reference['peak_mb'], 'current': result['peak_mb'], \
+                'change': result['peak_mb']/reference['peak_mb'] - 1})
+    return found
+
+
+def print_regressions(found):
+    if not found:
+        print('No regressions against the baseline')
+        return
+    for regression in found:
+        print('### {} x {}: {} {:.4g} -> {:.4g} ({:+.0%}) ###'.format(regression['stage'], regression['scenarios'], \
+            regression['metric'], regression['baseline'], regression['current'], regression['change']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every stage at increasing scenario counts and compare against a baseline')
+    parser.add_argument('--sizes', type=int, nargs='+', help='Scenario counts to run', default=SIZES)
+    parser.add_argument('--stages', type=str, nargs='+', help='Stages to run: {}'.format(', '.join(STAGES)), default=list(STAGES))
+    parser.add_argument('--species', type=str, help='Species whose scores are simulated and evaluated', default='pigs')
+    parser.add_argument('--repeats', type=int, help='Runs per stage and size; the fastest counts', default=1)
+    parser.add_argument('--chunk_size', type=int, help='Scenarios run at once', default=CHUNK_SIZE)
+    parser.add_argument('--baseline', type=str, help='Baseline file to compare against', default=BASELINE_FILE)
+    parser.add_argument('--threshold', type=float, help='Relative slowdown or memory growth that counts as a regression', default=THRESHOLD)
+    parser.add_argument('--save_baseline', action='store_true', help='Store these results as the baseline instead of comparing')
+    parser.add_argument('--output', type=str, help='CSV file to write the results to', default=RESULTS_FILE)
+    args = parser.parse_args()
+
+    memory = physical_memory()
+    context = load_context(args.species)
+    results = run_benchmarks(context, args.stages, args.sizes, args.repeats, args.chunk_size, \
+        memory_limit=memory//2 if memory is not None else None)
+    pd.DataFrame(results).to_csv(args.output, index=False)
+    print('... Wrote {}'.format(args.output))
+
+    if args.save_baseline:
+        print('... Stored the baseline in {}'.format(save_baseline(results, args.baseline)))
+        return
+    baseline = load_baseline(args.baseline)
+    if not baseline:
+        print('No baseline in {}; run with --save_baseline to store one'.format(args.baseline))
+        return
+    found = regressions(results, baseline, args.threshold)
+    print_regressions(found)
+    if found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
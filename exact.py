@@ -0,0 +1,168 @@
+## Exact distributions of the additive welfare range models
+# Every proxy is present independently in a scenario, with a probability drawn uniformly from its
+# judgment's range (or fixed), so its marginal chance of being present is (lower + upper)/2. The
+# score sums of the single-sum models (Qualitative, High-Confidence (Simple Scoring), Cubic,
+# High-Confidence (Cubic), Qualitative Minus Social and Pleasure-and-pain-centric) are therefore
+# sums of independent weighted Bernoullis (a weighted Poisson binomial), including the overlap
+# proxies, which are fixed combinations of the species' independent sentience proxies. The exact
+# distribution of every sum is built by convolving one proxy at a time over its distinct values,
+# then pushed through the model's transform (the exponent, the human sum and the FFF adjustment),
+# which gives the means and percentiles a simulation converges to, with no sampling noise.
+# Higher-Lower Pleasures and Undiluted Experience combine two sums that share proxies, so they
+# are left to the simulations.
+import os
+import pickle
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import results_store
+import sent_simulate
+import wr_simulate
+import wr_engine
+import pipeline
+import streaming
+
+EXACT_STAGE = 'wr exact'
+
+DECIMALS = 10  # sums that agree to this many decimals are one value
+
+
+def presence_probabilities(codes, judgment_prob_map):
+    lower, upper = sent_simulate.judgment_bounds(codes, judgment_prob_map)
+    return (lower + upper)/2
+
+
+# (values, probabilities) of the sum of coefficients[i] * Bernoulli(probabilities[i]), the
+# Bernoullis independent; values are sorted and distinct
+def weighted_bernoulli_sum(coefficients, probabilities, decimals=DECIMALS):
+    values, probs = np.zeros(1), np.ones(1)
+    for coefficient, probability in zip(coefficients, probabilities):
+        if coefficient == 0 or probability == 0:
+            continue
+        if probability == 1:
+            values = values + coefficient
+            continue
+        values, inverse = np.unique(np.round(np.concatenate([values, values + coefficient]), decimals), return_inverse=True)
+        probs = np.bincount(inverse, weights=np.concatenate([probs*(1 - probability), probs*probability]))
+    return values, probs
+
+
+# (coefficients, probabilities) of every independent Bernoulli behind one species' welfare range
+# scores: a row per model term of `masks` (proxies x terms), a column per drawn welfare range
+# proxy followed by one per sentience proxy the overlap proxies average
+def species_bernoullis(inputs, species, masks, wr_params, wr_unknown, s_params=None, s_unknown=0):
+    judgments = inputs['wr_judgments']
+    proxies = judgments.proxies
+    hc_weight = wr_params['HC_WEIGHT']
+    has_sent_scores = species in wr_simulate.SENT_SPECIES
+    is_overlap = np.array([has_sent_scores and proxy in inputs['overlap_dict'] for proxy in proxies])
+    drawn_idx = np.flatnonzero(~is_overlap)
+    overlap_idx = np.flatnonzero(is_overlap)
+
+    codes = judgments.species_codes(species)[drawn_idx]
+    probabilities = presence_probabilities(codes, wr_simulate.get_judgment_prob_map(wr_params['WEIGHT_NOS'], wr_unknown))
+    drawn_proxies = [proxies[ii] for ii in drawn_idx]
+    coefficients = masks[drawn_idx].T*sent_simulate.proxy_weights(drawn_proxies, inputs['wr_hc_proxies'], hc_weight)
+
+    if len(overlap_idx) > 0:
+        if s_params is None:
+            raise ValueError('{} has overlap proxies, which need the sentience parameters'.format(species))
+        overlap_proxies = [proxies[ii] for ii in overlap_idx]
+        sent_proxies, overlap_weights = wr_simulate.overlap_weight_matrix(overlap_proxies, inputs['overlap_dict'], \
+            inputs['wr_hc_proxies'], inputs['sent_hc_proxies'], hc_weight)
+        sent_judgments = inputs['sent_judgments']
+        sent_codes = sent_judgments.species_codes(species)[[sent_judgments.proxies.index(proxy) for proxy in sent_proxies]]
+        sent_probabilities = presence_probabilities(sent_codes, \
+            sent_simulate.get_judgment_prob_map(s_params['WEIGHT_NOS'], s_unknown))
+        sent_weights = sent_simulate.proxy_weights(sent_proxies, inputs['sent_hc_proxies'], s_params['HC_WEIGHT'])
+        sent_coefficients = (overlap_weights.T @ masks[overlap_idx]).T*sent_weights
+        coefficients = np.column_stack([coefficients, sent_coefficients])
+        probabilities = np.concatenate([probabilities, sent_probabilities])
+    return coefficients, probabilities
+
+
+# {model: (welfare range values, probabilities)} of the single-sum models for one species
+def exact_welfare_ranges(inputs, models, species, wr_params, wr_unknown, s_params=None, s_unknown=0):
+    terms, masks, human_sums, divisors = wr_engine.model_terms(inputs['wr_judgments'].proxies, models, wr_params['HC_WEIGHT'])
+    simple = [ii for ii, term in enumerate(terms) if term in wr_engine.WR_SIMPLE_MODELS]
+    coefficients, probabilities = species_bernoullis(inputs, species, masks[:, simple], wr_params, wr_unknown, \
+        s_params, s_unknown)
+
+    results = {}
+    for row, ii in enumerate(simple):
+        model_name = terms[ii]
+        exponent = wr_engine.WR_SIMPLE_MODELS[model_name][1]
+        sums, probs = weighted_bernoulli_sum(coefficients[row], probabilities)
+        welfare_range = wr_engine.simple_welfare_range(lambda x: x**exponent, sums/divisors[ii], human_sums[ii], \
+            wr_engine.WR_FFF.get(species))
+        order = np.argsort(welfare_range, kind='stable')
+        results[model_name] = (welfare_range[order], probs[order])
+    return results
+
+
+# results_store.STATISTICS of a discrete distribution: its mean, standard deviation and the
+# smallest value whose cumulative probability reaches each percentile
+def exact_statistics(values, probs):
+    mean = np.dot(values, probs)
+    sd = np.sqrt(max(np.dot((values - mean)**2, probs), 0))
+    cumulative = np.cumsum(probs)/probs.sum()
+    levels = np.array(results_store.SCENARIO_RANGES)/100
+    idx = np.searchsorted(cumulative, levels - 1e-12, side='left')
+    return [mean, sd] + list(values[np.minimum(idx, len(values) - 1)])
+
+
+# {model: {species: statistics}} of every single-sum model and species in `wr_species`
+def run_exact(wr_params, wr_unknowns, s_params=None, s_unknowns=None, wr_species=pipeline.WR_SPECIES, inputs=None, \
+        models=None):
+    if inputs is None:
+        inputs = pipeline.load_inputs()
+    if models is None:
+        models = streaming.load_models()['wr']
+    statistics = {}
+    for species in wr_species:
+        s_unknown = s_unknowns.get(species, 0) if s_unknowns is not None else 0
+        for model_name, (values, probs) in exact_welfare_ranges(inputs, models, species, wr_params, wr_unknowns[species], \
+                s_params, s_unknown).items():
+            statistics.setdefault(model_name, {})[species] = exact_statistics(values, probs)
+    return statistics
+
+
+# Writes the statistics to the results file (stage EXACT_STAGE) and one summary CSV per model in
+# the layout of the simulated ones
+def write_exact(statistics, output_root=''):
+    wr_dir = os.path.join(output_root, 'welfare_range_estimates')
+    os.makedirs(wr_dir, exist_ok=True)
+    paths = [os.path.join(output_root, results_store.RESULTS_FILE)]
+    with results_store.ResultsFile(paths[0]) as results:
+        for model_name, species_statistics in statistics.items():
+            for species, values in species_statistics.items():
+                results.add(EXACT_STAGE, model_name, species, values)
+    for model_name, species_statistics in statistics.items():
+        summary = results_store.summary_values(np.array(list(species_statistics.values())))
+        stats_df = pd.DataFrame(summary.round(3), columns=list(results_store.SUMMARY_COLUMNS), index=list(species_statistics))
+        stats_df = stats_df.sort_values("50th-pct", ascending=False)
+        path = os.path.join(wr_dir, "WR {} Exact Summary Statistics.csv".format(model_name))
+        stats_df.to_csv(path, index_label="Species")
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute the exact welfare range distributions of the single-sum models')
+    parser.add_argument('--output_root', type=str, help='Directory to write the results file and summary CSVs into', default='')
+    args = parser.parse_args()
+
+    s_params = pickle.load(open(os.path.join('input_data', 'Sentience Parameters.p'), 'rb'))
+    wr_params = pickle.load(open(os.path.join('input_data', 'Welfare Range Parameters.p'), 'rb'))
+    s_unknowns = pickle.load(open(os.path.join('input_data', 'Sentience Unknown Probabilities.p'), 'rb'))
+    wr_unknowns = pickle.load(open(os.path.join('input_data', 'Welfare Range Unknown Probabilities.p'), 'rb'))
+
+    statistics = run_exact(wr_params, wr_unknowns, s_params, s_unknowns)
+    paths = write_exact(statistics, args.output_root)
+    print('... Wrote {} and {} summary files'.format(paths[0], len(paths) - 1))
+
+
+if __name__ == '__main__':
+    main()
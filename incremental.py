@@ -0,0 +1,170 @@
+## Incremental recomputation of the simulated scores
+# Every score column is fingerprinted by everything its values depend on: the root seed and
+# sampler, the number of scenarios, the stage, species and proxy (which pick its random stream), its
+# probability bounds and its weight. An overlap-linked welfare range column is fingerprinted by
+# its overlap rule and the fingerprints of the sentience columns it averages. The fingerprints
+# are stored in the score store's header, so a re-run only simulates the columns whose
+# fingerprint changed and copies the others from the previous store.
+import os
+import json
+import hashlib
+
+import numpy as np
+
+import score_store
+import sampling
+import sent_simulate
+import wr_simulate
+import sent_engine
+import wr_engine
+
+MODEL_MANIFEST = 'model_fingerprints.json'
+
+
+def fingerprint(*parts):
+    return hashlib.sha1(json.dumps(parts, default=float).encode('utf-8')).hexdigest()[:16]
+
+
+# The random streams a column is drawn from: the seed alone for the random sampler, so columns
+# stored before samplers existed keep their fingerprints
+def _streams(seed, sampler):
+    return seed if sampler == sampling.RANDOM else [seed, sampler]
+
+
+# {proxy: fingerprint} of one species' sentience columns; None without a seed (nothing reusable)
+def sentience_fingerprints(judgments, species, unknown_prob, weight_no, hc_weight, n_scenarios, hc_proxies, seed, \
+        sampler=sampling.RANDOM):
+    if seed is None:
+        return None
+    proxies = judgments.proxies
+    lower, upper = sent_simulate.judgment_bounds(judgments.species_codes(species), \
+        sent_simulate.get_judgment_prob_map(weight_no, unknown_prob))
+    weights = sent_simulate.proxy_weights(proxies, hc_proxies, hc_weight)
+    return {proxy: fingerprint('sentience', _streams(seed, sampler), n_scenarios, species, proxy, lower[ii], upper[ii], weights[ii]) \
+        for ii, proxy in enumerate(proxies)}
+
+
+# {proxy: fingerprint} of one species' welfare range columns. Overlap columns (when the species
+# has sentience scores) depend on their sentience sources' fingerprints, so a changed sentience
+# judgment invalidates every welfare range proxy linked to it in Proxy Overlap.csv.
+def wr_fingerprints(judgments, species, unknown_prob, weight_no, hc_weight, n_scenarios, hc_proxies, \
+        sent_hc_proxies, overlap_dict, seed, sent_fingerprints=None, has_sent_scores=False, sampler=sampling.RANDOM):
+    if seed is None:
+        return None
+    proxies = judgments.proxies
+    lower, upper = sent_simulate.judgment_bounds(judgments.species_codes(species), \
+        wr_simulate.get_judgment_prob_map(weight_no, unknown_prob))
+    weights = sent_simulate.proxy_weights(proxies, hc_proxies, hc_weight)
+
+    fingerprints = {}
+    for ii, proxy in enumerate(proxies):
+        if has_sent_scores and proxy in overlap_dict:
+            sources = [(sent_proxy, sent_proxy in sent_hc_proxies, (sent_fingerprints or {}).get(sent_proxy)) \
+                for sent_proxy in overlap_dict[proxy]]
+            if any(source_fingerprint is None for sent_proxy, is_hc, source_fingerprint in sources):
+                fingerprints[proxy] = None
+            else:
+                fingerprints[proxy] = fingerprint('overlap', n_scenarios, species, proxy, proxy in hc_proxies, \
+                    hc_weight, sources)
+        else:
+            fingerprints[proxy] = fingerprint('welfare ranges', _streams(seed, sampler), n_scenarios, species, proxy, lower[ii], \
+                upper[ii], weights[ii])
+    return fingerprints
+
+
+def stored_fingerprints(species_scores):
+    if isinstance(species_scores, score_store.ScoreStore):
+        return species_scores.header.get('fingerprints')
+    return None
+
+
+# Writes the store at `prefix` for `proxies`, copying every column whose fingerprint matches the
+# previous store and calling simulate(stale proxies) -> (proxies, scores) for the rest. Returns
+# the simulated proxies; a store that is already up to date is left untouched.
+def update_store(prefix, proxies, fingerprints, n_scenarios, simulate, **metadata):
+    reused = []
+    old_scores = None
+    if fingerprints is not None and score_store.has_scores(prefix):
+        old = score_store.load_scores(prefix)
+        old_fingerprints = old.header.get('fingerprints') or {}
+        if old.n_scenarios == n_scenarios:
+            reused = [proxy for proxy in proxies if proxy in old.columns and fingerprints[proxy] is not None \
+                and old_fingerprints.get(proxy) == fingerprints[proxy]]
+        if len(reused) == len(proxies) and old.proxies == list(proxies):
+            return []
+        old_scores = np.array(old.select(reused), dtype=float)
+        del old
+
+    stale = [proxy for proxy in proxies if proxy not in set(reused)]
+    columns = {proxy: ii for ii, proxy in enumerate(proxies)}
+    scores = np.empty((n_scenarios, len(proxies)), order='F')
+    if reused:
+        scores[:, [columns[proxy] for proxy in reused]] = old_scores
+    if stale:
+        simulated_proxies, simulated_scores = simulate(stale)
+        scores[:, [columns[proxy] for proxy in simulated_proxies]] = simulated_scores
+
+    score_store.write_scores(prefix, proxies, scores, fingerprints=fingerprints, **metadata)
+    return stale
+
+
+# {(stage, model, species): fingerprint} of every downstream model output, from the column
+# fingerprints in the stores of `output_dir`: a model output changes only when one of the
+# columns in its proxy list, its proxy list itself or (for welfare ranges) HC_WEIGHT changes.
+# Sentience models also depend on the sometimes_operates reference, adjusted welfare ranges on
+# the species' '#1_high value proxies' P(sentience).
+def model_fingerprints(output_dir, models, sent_species, wr_species, wr_hc_weight, scores_prefix):
+    def column_fingerprints(stage, species):
+        prefix = scores_prefix(output_dir, stage, species)
+        if not score_store.has_scores(prefix):
+            return None
+        return stored_fingerprints(score_store.load_scores(prefix)) or None
+
+    def subset(fingerprints, model_proxies):
+        if fingerprints is None:
+            return None
+        return sorted((proxy, fingerprints[proxy]) for proxy in model_proxies if proxy in fingerprints)
+
+    results = {}
+    so_fingerprints = column_fingerprints('sentience', sent_engine.SOMETIMES_OPERATES)
+    sent_models = [('sentience', model_name, model_proxies) for model_name, model_proxies in models['sentience']['models'].items()]
+    sent_models += [('birch', criterion, criterion_proxies) for criterion, criterion_proxies in models['sentience']['birch'].items()]
+    for species in sent_species:
+        if species == sent_engine.SOMETIMES_OPERATES:
+            continue
+        fingerprints = column_fingerprints('sentience', species)
+        for stage, model_name, model_proxies in sent_models:
+            results[(stage, model_name, species)] = fingerprint(sorted(model_proxies), \
+                subset(fingerprints, model_proxies), subset(so_fingerprints, model_proxies))
+
+    wr_models = {model_name: [model_proxies] for model_name, model_proxies in models['wr']['simple'].items()}
+    wr_models.update({model_name: [cog_proxies, hed_proxies] \
+        for model_name, (cog_proxies, hed_proxies) in models['wr']['two_term'].items()})
+    hc_proxies = sorted(models['wr']['hc_proxies'])
+    for species in wr_species:
+        fingerprints = column_fingerprints('welfare ranges', species)
+        for model_name, proxy_sets in wr_models.items():
+            model_key = fingerprint([sorted(proxy_set) for proxy_set in proxy_sets], hc_proxies, wr_hc_weight, \
+                wr_engine.WR_FFF.get(species), subset(fingerprints, set().union(*proxy_sets)))
+            results[('wr', model_name, species)] = model_key
+            results[('adjusted', model_name, species)] = fingerprint(model_key, \
+                results.get(('sentience', sent_engine.HV1_MODEL, species)))
+    return results
+
+
+def load_model_manifest(output_dir):
+    path = os.path.join(output_dir, MODEL_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {tuple(key.split('|')): value for key, value in json.load(f).items()}
+
+
+def write_model_manifest(output_dir, fingerprints):
+    with open(os.path.join(output_dir, MODEL_MANIFEST), 'w') as f:
+        json.dump({'|'.join(key): value for key, value in sorted(fingerprints.items())}, f, indent=1)
+
+
+# The (stage, model, species) outputs whose fingerprint differs from the stored manifest
+def changed_models(previous, current):
+    return sorted(key for key, value in current.items() if previous.get(key) != value)
@@ -0,0 +1,129 @@
+## Structured progress and performance metrics
+# The simulators, the pipeline and the streaming run report what they do as events (dicts with
+# an 'event' name, a timestamp and fields such as stage, species, seconds, scenarios,
+# scenarios_per_s, peak_rss_mb and bytes_written) sent to a Metrics object. What happens to an
+# event is up to its reporters: print_reporter prints its human-readable message (the progress
+# lines the scripts always printed), JsonLinesReporter appends it to a JSON lines file for
+# schedulers, and any callable reporter(record, message) can be plugged in.
+import os
+import sys
+import json
+import time
+
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+METRICS_FILE = 'metrics.jsonl'
+
+
+# Peak resident set size of this process so far, in MB (None where it cannot be read)
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak/2**20 if sys.platform == 'darwin' else peak/2**10
+
+
+def bytes_written(paths):
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def throughput(scenarios, seconds):
+    if scenarios is None or not seconds:
+        return None
+    return scenarios/seconds
+
+
+def print_reporter(record, message):
+    if message is not None:
+        print(message)
+
+
+class JsonLinesReporter:
+    def __init__(self, path, mode='w'):
+        self.path = path
+        self.file = open(path, mode)
+
+    def __call__(self, record, message):
+        self.file.write(json.dumps(record, default=str) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Metrics:
+    # `labels` (e.g. run='nightly') are added to every event
+    def __init__(self, reporters=(), **labels):
+        self.reporters = list(reporters)
+        self.labels = labels
+
+    def emit(self, event, message=None, **fields):
+        record = dict(self.labels, event=event, time=round(time.time(), 3))
+        record.update(fields)
+        for reporter in self.reporters:
+            reporter(record, message)
+        return record
+
+    # A 'stage' event with the throughput and this process' peak RSS filled in
+    def stage_done(self, stage, seconds, scenarios=None, message=None, **fields):
+        fields.setdefault('peak_rss_mb', peak_rss_mb())
+        return self.emit('stage', message, stage=stage, seconds=seconds, scenarios=scenarios, \
+            scenarios_per_s=throughput(scenarios, seconds), **fields)
+
+    # Times the enclosed block and emits it as a stage; the block can add fields (e.g.
+    # bytes_written) to the dict it is given. `message` may use {seconds}.
+    @contextmanager
+    def stage(self, stage, scenarios=None, message=None, **fields):
+        extra = {}
+        start = time.perf_counter()
+        try:
+            yield extra
+        except Exception:
+            self.stage_done(stage, time.perf_counter() - start, scenarios, status='failed', **dict(fields, **extra))
+            raise
+        seconds = time.perf_counter() - start
+        self.stage_done(stage, seconds, scenarios, None if message is None else message.format(seconds=seconds), \
+            status='ok', **dict(fields, **extra))
+
+    def progress(self, stage, done, total, message=None, **fields):
+        return self.emit('progress', message, stage=stage, done=done, total=total, **fields)
+
+    # A progress(start, n_scenarios) callback for the simulators
+    def progress_callback(self, stage, message='... Completed {done}/{total}', **fields):
+        def progress(start, n_scenarios):
+            self.progress(stage, start, n_scenarios, message.format(done=start + 1, total=n_scenarios), **fields)
+        return progress
+
+    def close(self):
+        for reporter in self.reporters:
+            if hasattr(reporter, 'close'):
+                reporter.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+# Metrics that print their messages when `verbose` and write every event to `path` if given
+def default_metrics(verbose=True, path=None, **labels):
+    reporters = [print_reporter] if verbose else []
+    if path is not None:
+        reporters.append(JsonLinesReporter(path))
+    return Metrics(reporters, **labels)
+
+
+# Adds the time spent in the enclosed block to timings[key]
+@contextmanager
+def timed(timings, key):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[key] = timings.get(key, 0) + time.perf_counter() - start
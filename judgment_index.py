@@ -0,0 +1,216 @@
+## Compiled index of the judgment tables
+# The judgments, high-confidence lists, model proxy lists and overlap rules of input_data are
+# compiled once into one binary file (input_data/judgment_index.npz): per stage, a proxies x
+# species matrix of integer judgment codes and a proxies x terms membership mask (high-confidence,
+# every model column, every Birch criterion), plus the overlap pairs. The file records the SHA-1
+# of every source CSV and is recompiled when one changes, so the simulators, the tests and the
+# notebooks load it with numpy alone instead of parsing the CSVs with pandas each time.
+import os
+import csv
+import json
+import hashlib
+
+import numpy as np
+
+INPUT_DIR = 'input_data'
+INDEX_FILE = 'judgment_index.npz'
+INDEX_VERSION = 1
+
+SOURCES = ['Sentience Judgments.csv', 'WR Judgments.csv', 'Sentience High-Confidence Proxies.csv', \
+            'WR High-Confidence Proxies.csv', 'Proxy Overlap.csv', 'Sentience Model Proxies.csv', \
+            'Birch Model Proxies.csv', 'WR Model Proxies.csv']
+
+# Judgment codes are positions in this list
+JUDGMENTS = ['likely no', 'lean no', 'lean yes', 'likely yes', 'unknown', 'yes', 'na']
+JUDGMENT_CODES = {judgment: code for code, judgment in enumerate(JUDGMENTS)}
+
+SENTIENCE = 'sentience'
+WELFARE_RANGES = 'wr'
+
+HC = 'hc'
+MODEL_PREFIX = 'model:'
+BIRCH_PREFIX = 'birch:'
+
+_LOADED = {}
+
+
+def model_term(column):
+    return MODEL_PREFIX + column
+
+
+def birch_term(criterion):
+    return BIRCH_PREFIX + criterion
+
+
+def source_hashes(input_dir=INPUT_DIR):
+    hashes = {}
+    for name in SOURCES:
+        with open(os.path.join(input_dir, name), 'rb') as f:
+            hashes[name] = hashlib.sha1(f.read()).hexdigest()
+    return hashes
+
+
+def encode(judgments, proxies, species):
+    codes = np.empty(len(judgments), dtype=np.int8)
+    for ii, judgment in enumerate(judgments):
+        code = JUDGMENT_CODES.get(str(judgment).lower())
+        if code is None:
+            raise ValueError('Unknown judgment {!r} for proxy {!r} of {}'.format(judgment, proxies[ii], species))
+        codes[ii] = code
+    return codes
+
+
+# Rows of the first column of a high-confidence proxies CSV (header=True skips a header row)
+def _read_hc(path, header):
+    with open(path, newline='') as f:
+        rows = list(csv.reader(f))
+    return [row[0] for row in rows[1 if header else 0:]]
+
+
+# [(WR proxy, sentience proxy)] of the overlap rules, like wr_simulate.load_overlap_dict
+def _read_overlap(path):
+    pairs = []
+    with open(path) as f:
+        for idx, rec in enumerate(csv.reader(f, delimiter=',')):
+            if idx > 0 and rec[1].strip() == "y":
+                pairs.append((rec[2].strip(), rec[0].strip()))
+    return pairs
+
+
+# {column: proxies} of a model proxies table, read the way the engines read it
+def _read_columns(path, drop_none=False):
+    import pandas as pd
+    df = pd.read_csv(path)
+    return {column: [proxy for proxy in df[column].dropna().values.tolist() if not drop_none or proxy.lower() != "none"] \
+        for column in df.columns}
+
+
+# Arrays of one stage: judged proxies first, then the proxies only a model or HC list names
+def _compile_stage(stage, judgments_path, terms):
+    import pandas as pd
+    df = pd.read_csv(judgments_path)
+    proxies = df['proxies'].to_list()
+    species = [column for column in df.columns if column != 'proxies']
+    codes = np.column_stack([encode(df[name].to_list(), proxies, name) for name in species]) if species else \
+        np.empty((len(proxies), 0), dtype=np.int8)
+
+    all_proxies = list(proxies)
+    for term_proxies in terms.values():
+        for proxy in term_proxies:
+            if proxy not in all_proxies:
+                all_proxies.append(proxy)
+    position = {proxy: ii for ii, proxy in enumerate(all_proxies)}
+    members = np.zeros((len(all_proxies), len(terms)), dtype=bool)
+    for jj, term_proxies in enumerate(terms.values()):
+        members[[position[proxy] for proxy in term_proxies], jj] = True
+
+    return {'{}_proxies'.format(stage): np.array(all_proxies, dtype=str),
+            '{}_judged'.format(stage): np.array(len(proxies)),
+            '{}_species'.format(stage): np.array(species, dtype=str),
+            '{}_codes'.format(stage): codes,
+            '{}_terms'.format(stage): np.array(list(terms), dtype=str),
+            '{}_members'.format(stage): members}
+
+
+def compile_index(input_dir=INPUT_DIR):
+    sent_terms = {HC: _read_hc(os.path.join(input_dir, 'Sentience High-Confidence Proxies.csv'), header=False)}
+    for column, proxies in _read_columns(os.path.join(input_dir, 'Sentience Model Proxies.csv')).items():
+        sent_terms[model_term(column)] = proxies
+    for criterion, proxies in _read_columns(os.path.join(input_dir, 'Birch Model Proxies.csv')).items():
+        sent_terms[birch_term(criterion)] = proxies
+
+    wr_terms = {HC: _read_hc(os.path.join(input_dir, 'WR High-Confidence Proxies.csv'), header=True)}
+    for column, proxies in _read_columns(os.path.join(input_dir, 'WR Model Proxies.csv'), drop_none=True).items():
+        wr_terms[model_term(column)] = proxies
+
+    overlap = _read_overlap(os.path.join(input_dir, 'Proxy Overlap.csv'))
+    arrays = _compile_stage(SENTIENCE, os.path.join(input_dir, 'Sentience Judgments.csv'), sent_terms)
+    arrays.update(_compile_stage(WELFARE_RANGES, os.path.join(input_dir, 'WR Judgments.csv'), wr_terms))
+    arrays['overlap'] = np.array(overlap, dtype=str).reshape(len(overlap), 2)
+    return arrays
+
+
+def write_index(path, arrays, hashes):
+    tmp = '{}.tmp.npz'.format(path[:-len('.npz')])
+    np.savez(tmp, sources=np.array(json.dumps({'version': INDEX_VERSION, 'hashes': hashes})), **arrays)
+    os.replace(tmp, path)
+
+
+# The arrays of `path` if it was compiled from sources with `hashes`, else None
+def _read_index(path, hashes):
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            sources = json.loads(str(data['sources']))
+            if sources != {'version': INDEX_VERSION, 'hashes': hashes}:
+                return None
+            return {key: data[key] for key in data.files if key != 'sources'}
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+class StageIndex:
+    # The compiled judgments of one stage: proxies and species in table order, their judgment
+    # codes and the membership mask of every term (HC, model:<column>, birch:<criterion>)
+    def __init__(self, arrays, stage):
+        self.all_proxies = arrays['{}_proxies'.format(stage)].tolist()
+        self.proxies = self.all_proxies[:int(arrays['{}_judged'.format(stage)])]
+        self.species = arrays['{}_species'.format(stage)].tolist()
+        self.codes = arrays['{}_codes'.format(stage)]
+        self.terms = arrays['{}_terms'.format(stage)].tolist()
+        self.members = arrays['{}_members'.format(stage)]
+        self._species_columns = {species: ii for ii, species in enumerate(self.species)}
+        self._term_columns = {term: ii for ii, term in enumerate(self.terms)}
+
+    def species_codes(self, species):
+        return self.codes[:, self._species_columns[species]]
+
+    def species_judgments(self, species):
+        return [JUDGMENTS[code] for code in self.species_codes(species)]
+
+    def member_list(self, term):
+        return [self.all_proxies[ii] for ii in np.flatnonzero(self.members[:, self._term_columns[term]])]
+
+    def member_set(self, term):
+        return set(self.member_list(term))
+
+    # {criterion: proxies} of the Birch criteria, in table order
+    def birch_criteria(self):
+        return {term[len(BIRCH_PREFIX):]: self.member_list(term) for term in self.terms if term.startswith(BIRCH_PREFIX)}
+
+    # Float mask of `term` over `proxies` (e.g. the columns of a score matrix)
+    def mask(self, proxies, term):
+        members = self.member_set(term)
+        return np.array([proxy in members for proxy in proxies], dtype=float)
+
+
+class JudgmentIndex:
+    def __init__(self, arrays, hashes):
+        self.hashes = hashes
+        self.sentience = StageIndex(arrays, SENTIENCE)
+        self.wr = StageIndex(arrays, WELFARE_RANGES)
+        self.overlap_dict = {}
+        for wr_proxy, sent_proxy in arrays['overlap'].tolist():
+            self.overlap_dict.setdefault(wr_proxy, []).append(sent_proxy)
+
+
+# The index of `input_dir`, compiled (and written next to the sources) when it is missing or
+# any source changed. Within a process the loaded index is reused while the hashes match.
+def load_index(input_dir=INPUT_DIR, rebuild=False):
+    hashes = source_hashes(input_dir)
+    loaded = _LOADED.get(input_dir)
+    if not rebuild and loaded is not None and loaded.hashes == hashes:
+        return loaded
+
+    path = os.path.join(input_dir, INDEX_FILE)
+    arrays = None if rebuild else _read_index(path, hashes)
+    if arrays is None:
+        arrays = compile_index(input_dir)
+        try:
+            write_index(path, arrays, hashes)
+        except OSError:  # a read-only input folder: compile on every start instead
+            pass
+    index = JudgmentIndex(arrays, hashes)
+    _LOADED[input_dir] = index
+    return index
@@ -0,0 +1,322 @@
+## Runs the sentience and welfare range simulations in one process tree
+# The sentience -> welfare range dependency is modelled as a DAG: every WR species whose
+# overlap proxies come from a sentience simulation waits for that species' sentience run only,
+# and everything else runs as soon as a worker is free.
+import os
+import sys
+import time
+import pickle
+import argparse
+import json
+import traceback
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import score_store
+import instrumentation
+import random_streams
+import judgment_index
+import sampling
+import sent_simulate
+import wr_simulate
+import incremental
+import sent_engine
+import wr_engine
+import validation
+
+SENTIENCE = 'sentience'
+WELFARE_RANGES = 'welfare ranges'
+
+SENT_SPECIES = sent_simulate.SENT_SPECIES
+WR_SPECIES = wr_simulate.WR_SPECIES
+
+VALIDATION_REPORT = 'validation_report.json'
+
+
+# Parses every input table once so workers never re-read the CSVs
+def load_inputs():
+    index = judgment_index.load_index()
+    return {'sent_judgments': index.sentience,
+            'wr_judgments': index.wr,
+            'sent_hc_proxies': index.sentience.member_set(judgment_index.HC),
+            'wr_hc_proxies': index.wr.member_set(judgment_index.HC),
+            'overlap_dict': index.overlap_dict}
+
+
+def scores_prefix(output_dir, stage, species):
+    prefix = 'sent' if stage == SENTIENCE else 'wr'
+    return os.path.join(output_dir, '{}_{}_'.format(prefix, species))
+
+
+# Maps every task (stage, species) to the tasks it has to wait for. A WR species whose overlap
+# proxies come from its sentience scores always brings its sentience task along, even when that
+# species is not in `sent_species`, so it never reads a store left by a run with another seed or
+# size (an up-to-date store is reused as is).
+def build_tasks(sent_species=SENT_SPECIES, wr_species=WR_SPECIES):
+    tasks = {}
+    for species in sent_species:
+        tasks[(SENTIENCE, species)] = []
+    for species in wr_species:
+        if species in wr_simulate.SENT_SPECIES:
+            dependency = (SENTIENCE, species)
+            tasks.setdefault(dependency, [])
+            tasks[(WELFARE_RANGES, species)] = [dependency]
+        else:
+            tasks[(WELFARE_RANGES, species)] = []
+    return tasks
+
+
+_WORKER_INPUTS = None
+
+
+def _init_worker(inputs):
+    global _WORKER_INPUTS
+    _WORKER_INPUTS = inputs
+
+
+# Simulates one (stage, species) store. With `reuse`, only the columns whose fingerprint differs
+# from the existing store are simulated and the rest are copied over.
+def run_task(task, params, unknowns, output_dir, inputs=None, reuse=True):
+    if inputs is None:
+        inputs = _WORKER_INPUTS
+    stage, species = task
+    start = time.time()
+    seed = params.get('SEED')
+    sampler = sampling.sampler_of(params)
+
+    if stage == SENTIENCE:
+        fingerprints = incremental.sentience_fingerprints(inputs['sent_judgments'], species, unknowns[species], \
+            params['WEIGHT_NOS'], params['HC_WEIGHT'], params['N_SCENARIOS'], inputs['sent_hc_proxies'], seed, \
+            sampler=sampler)
+
+        def simulate(proxy_subset=None):
+            return sent_simulate.simulate_species(inputs['sent_judgments'], species, unknowns[species], \
+                params['WEIGHT_NOS'], params['HC_WEIGHT'], params['N_SCENARIOS'], hc_proxies=inputs['sent_hc_proxies'], \
+                seed=seed, proxy_subset=proxy_subset, sampler=sampler)
+        proxies = inputs['sent_judgments'].proxies
+    else:
+        sent_scores = None
+        if species in wr_simulate.SENT_SPECIES:
+            sent_scores = score_store.load_simulated_scores(scores_prefix(output_dir, SENTIENCE, species))
+        fingerprints = incremental.wr_fingerprints(inputs['wr_judgments'], species, unknowns[species], \
+            params['WEIGHT_NOS'], params['HC_WEIGHT'], params['N_SCENARIOS'], inputs['wr_hc_proxies'], \
+            inputs['sent_hc_proxies'], inputs['overlap_dict'], seed, \
+            sent_fingerprints=incremental.stored_fingerprints(sent_scores), has_sent_scores=sent_scores is not None, \
+            sampler=sampler)
+
+        def simulate(proxy_subset=None):
+            return wr_simulate.simulate_species(inputs['wr_judgments'], species, unknowns[species], \
+                params['WEIGHT_NOS'], params['HC_WEIGHT'], params['N_SCENARIOS'], sent_scores=sent_scores, \
+                hc_proxies=inputs['wr_hc_proxies'], sent_hc_proxies=inputs['sent_hc_proxies'], \
+                overlap_dict=inputs['overlap_dict'], seed=seed, proxy_subset=proxy_subset, sampler=sampler)
+        proxies = inputs['wr_judgments'].proxies
+
+    prefix = scores_prefix(output_dir, stage, species)
+    metadata = {'stage': stage, 'species': species}
+    if sampler != sampling.RANDOM:
+        metadata['sampler'] = sampler
+    if reuse:
+        simulated = incremental.update_store(prefix, proxies, fingerprints, params['N_SCENARIOS'], simulate, **metadata)
+    else:
+        proxies, scores = simulate()
+        score_store.write_scores(prefix, proxies, scores, fingerprints=fingerprints, **metadata)
+        simulated = proxies
+    written = instrumentation.bytes_written([score_store.scores_file(prefix), score_store.header_file(prefix)]) if simulated else 0
+    return score_store.scores_file(prefix), time.time() - start, len(simulated), len(proxies), written
+
+
+def _run_task_safely(task, params, unknowns, output_dir, inputs=None, reuse=True):
+    try:
+        path, seconds, n_simulated, n_columns, written = run_task(task, params, unknowns, output_dir, inputs, reuse)
+        return {'status': 'ok', 'path': path, 'seconds': seconds, 'simulated': n_simulated, 'columns': n_columns, \
+            'scenarios': params['N_SCENARIOS'], 'bytes_written': written, 'peak_rss_mb': instrumentation.peak_rss_mb()}
+    except Exception:
+        return {'status': 'failed', 'error': traceback.format_exc()}
+
+
+# Runs every task in the DAG and returns a {task: result} report. Tasks whose dependency
+# failed are reported as skipped rather than run against stale outputs. With `reuse`, score
+# columns whose inputs are unchanged since the previous run in `output_dir` are not re-simulated.
+# Every finished task is reported to `metrics` as a stage (printed when `verbose` by default).
+def run_pipeline(s_params, wr_params, s_unknowns, wr_unknowns, sent_species=SENT_SPECIES, wr_species=WR_SPECIES, \
+        output_dir='output_data', workers=None, inputs=None, verbose=True, reuse=True, metrics=None):
+    if metrics is None:
+        metrics = instrumentation.default_metrics(verbose)
+    if inputs is None:
+        inputs = load_inputs()
+    if workers is None:
+        workers = os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+
+    tasks = build_tasks(sent_species, wr_species)
+    stage_args = {SENTIENCE: (s_params, s_unknowns), WELFARE_RANGES: (wr_params, wr_unknowns)}
+    report = {}
+
+    def record(task, result):
+        report[task] = result
+        stage, species = task
+        if result['status'] == 'ok':
+            metrics.stage_done(stage, result['seconds'], result['scenarios'], \
+                '... {} {} done in {:.2f}s ({}/{} columns simulated)'.format(stage, species, result['seconds'], \
+                result['simulated'], result['columns']), species=species, status='ok', simulated=result['simulated'], \
+                columns=result['columns'], bytes_written=result['bytes_written'], peak_rss_mb=result['peak_rss_mb'])
+        else:
+            metrics.emit('stage', '... {} {} {}'.format(stage, species, result['status'].upper()), stage=stage, \
+                species=species, status=result['status'])
+        metrics.progress('pipeline', len(report), len(tasks))
+
+    def ready():
+        return [task for task, deps in tasks.items() if task not in report and task not in running \
+            and all(dep in report for dep in deps)]
+
+    def dispatch(task, submit):
+        failed_deps = [dep for dep in tasks[task] if report[dep]['status'] != 'ok']
+        if failed_deps:
+            record(task, {'status': 'skipped', 'error': 'dependency failed: {}'.format(failed_deps)})
+            return None
+        params, unknowns = stage_args[task[0]]
+        return submit(task, params, unknowns, output_dir)
+
+    running = {}
+    if workers <= 1:
+        while len(report) < len(tasks):
+            for task in ready():
+                result = dispatch(task, lambda *args: _run_task_safely(*args, inputs=inputs, reuse=reuse))
+                if result is not None:
+                    record(task, result)
+        return report
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(inputs,)) as pool:
+        while len(report) < len(tasks):
+            for task in ready():
+                future = dispatch(task, lambda *args: pool.submit(_run_task_safely, *args, reuse=reuse))
+                if future is not None:
+                    running[task] = future
+            if not running:
+                continue
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for task in [task for task, future in running.items() if future in done]:
+                record(task, running.pop(task).result())
+
+    return report
+
+
+def failed_tasks(report):
+    return [task for task, result in report.items() if result['status'] != 'ok']
+
+
+def print_report(report):
+    for task in failed_tasks(report):
+        stage, species = task
+        print('### {} {} {} ###'.format(stage.upper(), species, report[task]['status'].upper()))
+        print(report[task]['error'])
+    n_ok = len(report) - len(failed_tasks(report))
+    print('{}/{} simulations completed'.format(n_ok, len(report)))
+
+
+# Refreshes the model fingerprint manifest of `output_dir` and returns the (stage, model, species)
+# outputs whose inputs changed since it was last written, i.e. the results the notebooks will change
+def update_model_manifest(output_dir, wr_params, sent_species=SENT_SPECIES, wr_species=WR_SPECIES):
+    models = {'sentience': sent_engine.load_models(), 'wr': wr_engine.load_models()}
+    current = incremental.model_fingerprints(output_dir, models, sent_species, wr_species, wr_params['HC_WEIGHT'], scores_prefix)
+    changed = incremental.changed_models(incremental.load_model_manifest(output_dir), current)
+    incremental.write_model_manifest(output_dir, current)
+    return changed
+
+
+def print_changed_models(changed):
+    if not changed:
+        print('No model outputs changed')
+        return
+    print('{} model outputs changed:'.format(len(changed)))
+    for stage, model_name, species in changed:
+        print('... {} {} {}'.format(stage, model_name, species))
+
+
+# Checks every store of `output_dir` against its judgments and the overlap rules (see
+# validation.py) and returns {stage: report}
+def validate_outputs(output_dir, s_params, wr_params, s_unknowns, wr_unknowns, sent_species=SENT_SPECIES, \
+        wr_species=WR_SPECIES, inputs=None):
+    if inputs is None:
+        inputs = load_inputs()
+    sent_data = {species: score_store.load_simulated_scores(scores_prefix(output_dir, SENTIENCE, species)) \
+        for species in sent_species}
+    wr_data = {species: {'Scores': score_store.load_simulated_scores(scores_prefix(output_dir, WELFARE_RANGES, species)), \
+        'Unknown Prob': wr_unknowns[species]} for species in wr_species}
+    return {SENTIENCE: validation.validate_sentience_scores({species: {'Scores': scores, \
+                'Unknown Prob': s_unknowns[species]} for species, scores in sent_data.items()}, s_params['HC_WEIGHT'], \
+                sent_species, weight_nos=s_params['WEIGHT_NOS']),
+            WELFARE_RANGES: validation.validate_wr_scores(wr_data, inputs['overlap_dict'], wr_params['HC_WEIGHT'], \
+                s_params['HC_WEIGHT'], wr_species, weight_nos=wr_params['WEIGHT_NOS'], \
+                sent_data={species: scores for species, scores in sent_data.items() if species in wr_simulate.SENT_SPECIES})}
+
+
+def write_validation_report(reports, output_dir):
+    path = os.path.join(output_dir, VALIDATION_REPORT)
+    with open(path, 'w') as f:
+        json.dump(reports, f, indent=1)
+    return path
+
+
+def print_validation(reports):
+    for stage, report in reports.items():
+        print('... {} validation {} ({} exact, {} overlap failures; {}/{} proxies outside their 95% CI, p = {:.3f})'.format(\
+            stage, 'passed' if report['passed'] else 'FAILED', len(report['exact_failures']), \
+            len(report['overlap_failures']), len(report['outside_ci']), report['uncertain_proxies'], report['p_value']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run all sentience and welfare range simulations with the stored parameters')
+    parser.add_argument('--workers', type=int, help='How many worker processes to use? Defaults to the number of cores', default=None)
+    parser.add_argument('--output_dir', type=str, help='Where to write the simulated scores', default='output_data')
+    parser.add_argument('--scenarios', type=int, help='Override the stored number of Monte Carlo simulations', default=None)
+    parser.add_argument('--sampler', type=str, choices=sampling.SAMPLERS, help='Override the stored sampler (SAMPLER) of the uniforms behind every draw', default=None)
+    parser.add_argument('--full', action='store_true', help='Re-simulate every column instead of reusing unchanged ones')
+    parser.add_argument('--skip_validation', action='store_true', help='Do not check the simulated scores after the run')
+    parser.add_argument('--metrics', type=str, help='JSON lines file for progress and timing events; defaults to metrics.jsonl in the output directory', default=None)
+    args = parser.parse_args()
+
+    s_params = pickle.load(open(os.path.join('input_data', 'Sentience Parameters.p'), 'rb'))
+    wr_params = pickle.load(open(os.path.join('input_data', 'Welfare Range Parameters.p'), 'rb'))
+    s_unknowns = pickle.load(open(os.path.join('input_data', 'Sentience Unknown Probabilities.p'), 'rb'))
+    wr_unknowns = pickle.load(open(os.path.join('input_data', 'Welfare Range Unknown Probabilities.p'), 'rb'))
+
+    # Runs from parameters stored before seeding existed get a root seed, saved so they can be
+    # reproduced. Only the seed is stored: the command line overrides below are for this run only.
+    for params, params_file in [(s_params, 'Sentience Parameters.p'), (wr_params, 'Welfare Range Parameters.p')]:
+        if params.get('SEED') is None:
+            params['SEED'] = random_streams.new_root_seed()
+            print('... Storing new root seed {} in {}'.format(params['SEED'], params_file))
+            stored = pickle.load(open(os.path.join('input_data', params_file), 'rb'))
+            stored['SEED'] = params['SEED']
+            pickle.dump(stored, open(os.path.join('input_data', params_file), 'wb'))
+
+    s_params, wr_params = dict(s_params), dict(wr_params)
+    if args.scenarios is not None:
+        s_params['N_SCENARIOS'] = args.scenarios
+        wr_params['N_SCENARIOS'] = args.scenarios
+    if args.sampler is not None:
+        s_params['SAMPLER'] = args.sampler
+        wr_params['SAMPLER'] = args.sampler
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    metrics_path = args.metrics if args.metrics is not None else os.path.join(args.output_dir, instrumentation.METRICS_FILE)
+    with instrumentation.default_metrics(path=metrics_path) as metrics:
+        with metrics.stage('run', s_params['N_SCENARIOS'], workers=args.workers):
+            report = run_pipeline(s_params, wr_params, s_unknowns, wr_unknowns, output_dir=args.output_dir, \
+                workers=args.workers, reuse=not args.full, metrics=metrics)
+        print_report(report)
+        if failed_tasks(report):
+            sys.exit(1)
+        print_changed_models(update_model_manifest(args.output_dir, wr_params))
+        if not args.skip_validation:
+            with metrics.stage('validation', s_params['N_SCENARIOS']):
+                reports = validate_outputs(args.output_dir, s_params, wr_params, s_unknowns, wr_unknowns)
+            print_validation(reports)
+            print('... Wrote {}'.format(write_validation_report(reports, args.output_dir)))
+            if not all(report['passed'] for report in reports.values()):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
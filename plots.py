@@ -0,0 +1,108 @@
+## Deferred plot rendering
+# The notebooks queue their figures as jobs (renderer, output path, data arrays, options) while
+# they compute, instead of drawing them inline. render_plots draws a queue afterwards on a process
+# pool with the non-interactive Agg backend. Every rendered figure is also kept in plot_cache/
+# under the hash of its data and options, so a figure whose inputs did not change is copied back
+# into place (the notebooks clear their output folders on every run) instead of being redrawn.
+import os
+import json
+import shutil
+import hashlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+PLOT_CACHE = 'plot_cache'
+PLOT_MANIFEST = 'plot_hashes.json'
+
+DPI = 300
+
+
+# A horizontal seaborn box plot with one box per array of `data`, labelled by `labels`
+def box_plot(path, data, labels, title, showfliers=True):
+    return {'renderer': 'box_plot', 'path': path, 'data': [np.asarray(values, dtype=float).ravel() for values in data], \
+        'options': {'labels': list(labels), 'title': title, 'showfliers': showfliers}}
+
+
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _render_box_plot(path, data, labels, title, showfliers):
+    plt = _pyplot()
+    import seaborn as sns
+    sns.set_style(style='white')
+    fig, ax = plt.subplots(figsize=(10, 6))
+    sns.boxplot(data=data, orient='h', ax=ax, showfliers=showfliers)
+    ax.set_yticks([i for i in range(len(labels))])
+    ax.set_yticklabels(labels)
+    ax.set_title(title)
+    fig.savefig(path, dpi=DPI, bbox_inches='tight')
+    plt.close(fig)
+
+
+RENDERERS = {'box_plot': _render_box_plot}
+
+
+def plot_hash(job):
+    digest = hashlib.sha1(json.dumps([job['renderer'], job['options'], DPI]).encode('utf-8'))
+    for values in job['data']:
+        digest.update(str(values.shape).encode('utf-8'))
+        digest.update(np.ascontiguousarray(values).tobytes())
+    return digest.hexdigest()
+
+
+def _render(job):
+    RENDERERS[job['renderer']](job['path'], job['data'], **job['options'])
+    return job['path']
+
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, '{}.png'.format(digest))
+
+
+def _load_manifest(cache_dir):
+    path = os.path.join(cache_dir, PLOT_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+# Renders the jobs whose hash has no cached figure, copies the cached figure of every other job
+# to its path and returns {'rendered': paths, 'skipped': paths}. A path queued twice keeps its
+# last job, like a second savefig to the same file would. The manifest maps each output path to
+# the hash last written there; cached figures no path refers to any more are removed.
+def render_plots(jobs, workers=None, force=False, cache_dir=PLOT_CACHE):
+    jobs = list({job['path']: job for job in jobs}.values())
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = _load_manifest(cache_dir)
+
+    hashes = {job['path']: plot_hash(job) for job in jobs}
+    stale = [job for job in jobs if force or not os.path.exists(_cache_path(cache_dir, hashes[job['path']]))]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(stale) <= 1:
+        rendered = [_render(job) for job in stale]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rendered = list(pool.map(_render, stale))
+
+    for path in rendered:
+        shutil.copyfile(path, _cache_path(cache_dir, hashes[path]))
+    skipped = [job['path'] for job in jobs if job['path'] not in set(rendered)]
+    for path in skipped:
+        shutil.copyfile(_cache_path(cache_dir, hashes[path]), path)
+
+    manifest.update(hashes)
+    for name in os.listdir(cache_dir):
+        if name.endswith('.png') and name[:-len('.png')] not in set(manifest.values()):
+            os.remove(os.path.join(cache_dir, name))
+    with open(os.path.join(cache_dir, PLOT_MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return {'rendered': rendered, 'skipped': skipped}
@@ -0,0 +1,60 @@
+## Reproducible random streams for the simulators
+# A run is defined by one root seed (stored as 'SEED' in the parameter pickles). Every
+# (stage, species, proxy, block of STREAM_BLOCK scenarios) gets its own generator spawned from
+# it, so a scenario's draws never depend on how the run is split across workers or chunks, and
+# a proxy's draws never depend on which other proxies are simulated alongside it.
+import zlib
+
+import numpy as np
+
+STREAM_BLOCK = 10000  # scenarios per independent stream
+
+STAGE_KEYS = {'sentience': 0, 'welfare ranges': 1, 'priors': 2, 'mixture': 3}
+
+
+def new_root_seed():
+    return np.random.SeedSequence().entropy
+
+
+# Stable across processes and Python versions, unlike hash()
+def name_key(name):
+    return zlib.crc32(name.encode('utf-8'))
+
+
+def proxy_generator(root_seed, stage, species, proxy, block):
+    seed_seq = np.random.SeedSequence(root_seed, spawn_key=(STAGE_KEYS[stage], name_key(species), block, name_key(proxy)))
+    return np.random.default_rng(seed_seq)
+
+
+# One generator for an output drawn for all species at once (e.g. a mixture model's samples)
+def stage_generator(root_seed, stage, name):
+    seed_seq = np.random.SeedSequence(root_seed, spawn_key=(STAGE_KEYS[stage], name_key(name)))
+    return np.random.default_rng(seed_seq)
+
+
+# Integer seed for the same stream, for libraries that keep their own global generator (squigglepy)
+def block_seed(root_seed, stage, species, block):
+    seed_seq = np.random.SeedSequence(root_seed, spawn_key=(STAGE_KEYS[stage], name_key(species), block))
+    return int(seed_seq.generate_state(1)[0])
+
+
+# Yields (block, start, stop) for every stream block covering scenarios
+# [first_scenario, first_scenario + n_scenarios). Positions are relative to `first_scenario`,
+# which has to sit on a block boundary so a partial run draws the same values as a full one.
+def stream_blocks(n_scenarios, first_scenario=0):
+    if first_scenario % STREAM_BLOCK != 0:
+        raise ValueError('first_scenario must be a multiple of {}'.format(STREAM_BLOCK))
+    for start in range(0, n_scenarios, STREAM_BLOCK):
+        yield (first_scenario + start) // STREAM_BLOCK, start, min(start + STREAM_BLOCK, n_scenarios)
+
+
+# (first_scenario, n_scenarios) of shard `shard` (from 0) of `shards`: a run of whole stream
+# blocks, spread as evenly as the blocks allow, so the shards together draw exactly the scenarios
+# of an unsharded run. With more shards than blocks, some shards are empty.
+def shard_range(n_scenarios, shard, shards):
+    if shards < 1 or not 0 <= shard < shards:
+        raise ValueError('shard must be between 0 and {}, got {}'.format(shards - 1, shard))
+    n_blocks = -(-n_scenarios // STREAM_BLOCK)
+    first = shard*n_blocks//shards*STREAM_BLOCK
+    stop = min((shard + 1)*n_blocks//shards*STREAM_BLOCK, n_scenarios)
+    return first, stop - first
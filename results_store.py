@@ -0,0 +1,110 @@
+## One indexed results file for every summary statistic
+# Each (stage, model, species) array is reduced to its mean, standard deviation and every
+# SCENARIO_RANGES percentile with a single selection pass, and stored as one row per statistic in
+# a sqlite table keyed by (stage, model, species, statistic), so readers can select any slice
+# without opening the per-model files. The summary CSVs are a view of it (see summary_frame).
+import sqlite3
+
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+RESULTS_FILE = 'results.sqlite'
+
+SCENARIO_RANGES = [1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99]
+
+STATISTICS = ['mean', 'sd'] + ['p{}'.format(q) for q in SCENARIO_RANGES]
+
+# {column of the summary CSVs: statistic}
+SUMMARY_COLUMNS = {'Mean': 'mean', '5th-pct': 'p5', '50th-pct': 'p50', '95th-pct': 'p95'}
+
+# Monte Carlo standard errors of the summary statistics and the scenarios behind them, stored by
+# convergence-driven runs (adaptive.py)
+ERROR_STATISTICS = ['{}_se'.format(name) for name in SUMMARY_COLUMNS.values()] + ['scenarios']
+
+_SCHEMA = '''CREATE TABLE IF NOT EXISTS results (
+    stage TEXT NOT NULL, model TEXT NOT NULL, species TEXT NOT NULL, statistic TEXT NOT NULL, value REAL,
+    PRIMARY KEY (stage, model, species, statistic)) WITHOUT ROWID'''
+
+_KEYS = ['stage', 'model', 'species', 'statistic']
+
+
+# (..., STATISTICS) for a (..., scenarios) array: every percentile comes out of one partition
+def compute_statistics(values):
+    values = np.asarray(values, dtype=float)
+    percentiles = np.percentile(values, SCENARIO_RANGES, axis=-1)
+    return np.concatenate([np.mean(values, axis=-1)[..., None], np.std(values, axis=-1)[..., None], \
+        np.moveaxis(percentiles, 0, -1)], axis=-1)
+
+
+# (..., 4) [mean, 5th, 50th, 95th percentile] columns of compute_statistics, as in the summary CSVs
+def summary_values(statistics):
+    return np.asarray(statistics)[..., [STATISTICS.index(name) for name in SUMMARY_COLUMNS.values()]]
+
+
+# Stages without models (e.g. the priors) are stored under the model ''
+def _model_key(model_name):
+    return '' if model_name is None else model_name
+
+
+class ResultsFile:
+    # Rows are replaced by key, so re-running a stage overwrites only its own results
+    def __init__(self, path=RESULTS_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(_SCHEMA)
+
+    def add(self, stage, model_name, species, statistics, names=STATISTICS):
+        self.connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)', \
+            [(stage, _model_key(model_name), species, name, float(value)) for name, value in zip(names, statistics)])
+
+    # Stores and returns the statistics of a (species, scenarios) array of one model
+    def add_arrays(self, stage, model_name, species_list, values):
+        species_statistics = compute_statistics(values)
+        for species, statistics in zip(species_list, species_statistics):
+            self.add(stage, model_name, species, statistics)
+        return species_statistics
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.connection.rollback()
+        self.close()
+
+
+# Rows of the results file as a DataFrame; every key takes one value or a list of values
+def read_results(path=RESULTS_FILE, stage=None, model=None, species=None, statistic=None):
+    conditions, parameters = [], []
+    for key, value in zip(_KEYS, [stage, model, species, statistic]):
+        if value is None:
+            continue
+        values = [value] if isinstance(value, str) else list(value)
+        conditions.append('{} IN ({})'.format(key, ', '.join('?'*len(values))))
+        parameters += values
+    query = 'SELECT stage, model, species, statistic, value FROM results'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    with closing(sqlite3.connect(path)) as connection:
+        return pd.read_sql_query(query, connection, params=parameters)
+
+
+# The summary CSV of one model: species x (Mean, 5th-pct, 50th-pct, 95th-pct), rounded like the
+# notebooks round them
+def summary_frame(results, stage, model_name, species_list=None, sort=True):
+    rows = results[(results['stage'] == stage) & (results['model'] == _model_key(model_name))]
+    stats_df = rows.pivot(index='species', columns='statistic', values='value')
+    stats_df = stats_df[list(SUMMARY_COLUMNS.values())].round(3)
+    stats_df.columns = list(SUMMARY_COLUMNS)
+    stats_df.index.name = None
+    if species_list is not None:
+        stats_df = stats_df.reindex(species_list)
+    if sort:
+        stats_df = stats_df.sort_values("50th-pct", ascending=False)
+    return stats_df
@@ -0,0 +1,99 @@
+## Estimator variance of each sampler against the random one
+# Runs the streaming models `replicates` times per sampler, each replicate with its own root
+# seed, and measures how much the summary statistics (mean, 5th, 50th and 95th percentile) of
+# every (stage, model, species) move between replicates. The variance ratio random/sampler is the
+# factor by which that sampler cuts the scenarios needed for the same precision: a ratio of 5
+# means 1/5 of the scenarios give the statistic the spread the random sampler has at the full count.
+import os
+import pickle
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import sampling
+import pipeline
+import streaming
+
+REPORT_FILE = 'sampler_report.csv'
+
+REPLICATES = 20
+N_SCENARIOS = 10000
+REPORT_SEED = 2023  # replicate r runs with root seed REPORT_SEED + r
+
+SENT_SPECIES = ['sometimes_operates', 'pigs', 'chickens', 'carp', 'bees']
+WR_SPECIES = ['pigs', 'chickens', 'carp', 'bees', 'shrimp']
+
+STATISTICS = ['Mean', '5th-pct', '50th-pct', '95th-pct']
+
+
+# {(stage, model, species): [summary of every replicate]} of one sampler
+def replicate_summaries(sampler, s_params, wr_params, s_unknowns, wr_unknowns, replicates=REPLICATES, \
+        n_scenarios=N_SCENARIOS, sent_species=SENT_SPECIES, wr_species=WR_SPECIES, inputs=None, models=None):
+    summaries = {}
+    for replicate in range(replicates):
+        seed = REPORT_SEED + replicate
+        accumulators = streaming.run_streaming(dict(s_params, SEED=seed, SAMPLER=sampler), \
+            dict(wr_params, SEED=seed, SAMPLER=sampler), s_unknowns, wr_unknowns, n_scenarios=n_scenarios, \
+            sent_species=sent_species, wr_species=wr_species, inputs=inputs, models=models, verbose=False, \
+            mixtures=False)
+        for key, accumulator in accumulators.items():
+            summaries.setdefault(key, []).append(accumulator.summary())
+    return summaries
+
+
+# One row per (stage, model, species, statistic, sampler) with the replicates' mean and variance
+# and the random sampler's variance over this sampler's
+def variance_report(summaries):
+    rows = []
+    for sampler, sampler_summaries in summaries.items():
+        for (stage, model_name, species), values in sorted(sampler_summaries.items(), key=lambda item: str(item[0])):
+            values = np.array(values, dtype=float)
+            baseline = np.array(summaries[sampling.RANDOM][(stage, model_name, species)], dtype=float)
+            for jj, statistic in enumerate(STATISTICS):
+                variance = np.var(values[:, jj], ddof=1)
+                random_variance = np.var(baseline[:, jj], ddof=1)
+                ratio = random_variance/variance if variance > 0 else np.nan
+                rows.append([stage, model_name, species, statistic, sampler, np.mean(values[:, jj]), variance, ratio])
+    return pd.DataFrame(rows, columns=['stage', 'model', 'species', 'statistic', 'sampler', 'mean', 'variance', \
+        'variance_ratio'])
+
+
+# Median variance ratio of every sampler and statistic, over the (stage, model, species) whose
+# statistic varies at all
+def print_report(report):
+    medians = report[report['sampler'] != sampling.RANDOM].pivot_table(index='sampler', columns='statistic', \
+        values='variance_ratio', aggfunc='median')
+    print('Median variance ratio (random/sampler), i.e. the scenario savings factor:')
+    print(medians[STATISTICS].round(2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the estimator variance of every sampler against the random sampler')
+    parser.add_argument('--samplers', type=str, nargs='+', choices=sampling.SAMPLERS, help='Samplers to compare', default=sampling.SAMPLERS)
+    parser.add_argument('--replicates', type=int, help='Independently seeded runs per sampler', default=REPLICATES)
+    parser.add_argument('--scenarios', type=int, help='Scenarios per run', default=N_SCENARIOS)
+    parser.add_argument('--output', type=str, help='CSV file to write the report to', default=REPORT_FILE)
+    args = parser.parse_args()
+
+    s_params = pickle.load(open(os.path.join('input_data', 'Sentience Parameters.p'), 'rb'))
+    wr_params = pickle.load(open(os.path.join('input_data', 'Welfare Range Parameters.p'), 'rb'))
+    s_unknowns = pickle.load(open(os.path.join('input_data', 'Sentience Unknown Probabilities.p'), 'rb'))
+    wr_unknowns = pickle.load(open(os.path.join('input_data', 'Welfare Range Unknown Probabilities.p'), 'rb'))
+    inputs, models = pipeline.load_inputs(), streaming.load_models()
+
+    samplers = [sampling.RANDOM] + [sampler for sampler in args.samplers if sampler != sampling.RANDOM]
+    summaries = {}
+    for sampler in samplers:
+        print('... Running {} replicates of {} scenarios with the {} sampler'.format(args.replicates, args.scenarios, sampler))
+        summaries[sampler] = replicate_summaries(sampler, s_params, wr_params, s_unknowns, wr_unknowns, args.replicates, \
+            args.scenarios, inputs=inputs, models=models)
+
+    report = variance_report(summaries)
+    report.to_csv(args.output, index=False)
+    print('... Wrote {}'.format(args.output))
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
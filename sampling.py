@@ -0,0 +1,53 @@
+## Variance-reduced uniforms for the simulations
+# Every random draw of the simulations starts from uniforms: two per proxy and scenario (where
+# the proxy's probability falls in its judgment's range, and its Bernoulli draw) and two per
+# prior or Mixture sample (which component, and the quantile within it). A sampler turns a
+# block's generator into those uniforms:
+#   random      independent pseudo-random uniforms, the draws the simulations always made
+#   antithetic  the second half of the block mirrors the first (u -> 1 - u) row for row
+#   lhs         Latin hypercube: every column has one uniform in each of n equal strata
+#   sobol       scrambled Sobol points, rows shuffled so separate proxies are not aligned
+# Each stream block is stratified on its own, so chunks, workers and shards still draw the same
+# values. The sampler is a run parameter like SEED ('SAMPLER', 'random' when it is not set).
+import numpy as np
+
+RANDOM = 'random'
+SAMPLERS = [RANDOM, 'antithetic', 'lhs', 'sobol']
+
+_BELOW_ONE = np.nextafter(1.0, 0.0)
+
+
+def sampler_of(params):
+    sampler = params.get('SAMPLER') or RANDOM
+    if sampler not in SAMPLERS:
+        raise ValueError('SAMPLER must be one of {}, got {!r}'.format(SAMPLERS, sampler))
+    return sampler
+
+
+# (n, d) uniforms in [0, 1) from `rng`
+def uniforms(rng, n, d, sampler=RANDOM):
+    if sampler == RANDOM:
+        return rng.random((d, n)).T
+    if sampler == 'antithetic':
+        half = rng.random(((n + 1)//2, d))
+        return np.concatenate([half, _BELOW_ONE - half])[:n]
+    if sampler == 'lhs':
+        strata = np.column_stack([rng.permutation(n) for _ in range(d)])
+        return np.minimum((strata + rng.random((n, d)))/n, _BELOW_ONE)
+    if sampler == 'sobol':
+        from scipy.stats import qmc
+        m = max(int(np.ceil(np.log2(max(n, 1)))), 0)
+        points = qmc.Sobol(d, scramble=True, seed=rng).random_base2(m)[:n]
+        return np.minimum(points[rng.permutation(n)], _BELOW_ONE)
+    raise ValueError('sampler must be one of {}, got {!r}'.format(SAMPLERS, sampler))
+
+
+# Index of the component each of `u` picks, for mixture weights `weights`
+def pick_components(weights, u):
+    cumulative = np.cumsum(np.asarray(weights, dtype=float))
+    return np.searchsorted(cumulative[:-1]/cumulative[-1], u, side='left')
+
+
+def standard_normal(u):
+    from scipy.special import ndtri
+    return ndtri(u)
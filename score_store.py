@@ -0,0 +1,192 @@
+## On-disk store for simulated proxy scores
+# Each species and stage is one contiguous scenarios x proxies .npy array, stored column-major
+# so every proxy's scores are a contiguous run, plus a small .json header mapping proxy names
+# to column indices. Loading memory-maps the array, so nothing is read until a column is used.
+import os
+import json
+import pickle
+
+from collections.abc import Mapping
+
+import numpy as np
+
+# Smallest first; a store uses the first dtype that holds every score exactly
+SCORE_DTYPES = [np.float32, np.float64]
+
+
+def scores_file(prefix):
+    return '{}simulated_scores.npy'.format(prefix)
+
+
+def header_file(prefix):
+    return '{}simulated_scores.json'.format(prefix)
+
+
+def legacy_scores_file(prefix):
+    return '{}simulated_scores.p'.format(prefix)
+
+
+def fit_dtype(scores):
+    for dtype in SCORE_DTYPES[:-1]:
+        if all(np.array_equal(scores[:, ii].astype(dtype), scores[:, ii]) for ii in range(scores.shape[1])):
+            return np.dtype(dtype)
+    return np.dtype(SCORE_DTYPES[-1])
+
+
+class ScoreStore(Mapping):
+    # Read-only {proxy: scores} view over a memory-mapped scenarios x proxies matrix, so it can
+    # stand in for the dicts of lists the pickles used to hold.
+    def __init__(self, matrix, proxies, header=None):
+        self.matrix = matrix
+        self.proxies = list(proxies)
+        self.columns = {proxy: ii for ii, proxy in enumerate(self.proxies)}
+        self.header = header if header is not None else {}
+
+    def __getitem__(self, proxy):
+        return self.matrix[:, self.columns[proxy]]
+
+    def __iter__(self):
+        return iter(self.proxies)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    @property
+    def n_scenarios(self):
+        return self.matrix.shape[0]
+
+    def select(self, proxies):
+        return self.matrix[:, [self.columns[proxy] for proxy in proxies]]
+
+
+# (proxies, scenarios x proxies matrix) from a ScoreStore or a {proxy: scores} dict
+def score_matrix(species_scores, proxies=None):
+    if isinstance(species_scores, ScoreStore):
+        if proxies is None or list(proxies) == species_scores.proxies:
+            return species_scores.proxies, np.asarray(species_scores.matrix, dtype=float)
+        return list(proxies), np.asarray(species_scores.select(proxies), dtype=float)
+    if proxies is None:
+        proxies = list(species_scores)
+    return list(proxies), np.column_stack([np.asarray(species_scores[proxy], dtype=float) for proxy in proxies])
+
+
+def _write_header(prefix, proxies, n_scenarios, dtype, metadata):
+    header = dict(metadata)
+    header.update({'proxies': list(proxies), 'n_scenarios': n_scenarios, 'dtype': dtype.name})
+    with open(header_file(prefix), 'w') as f:
+        json.dump(header, f, indent=1)
+
+
+def write_scores(prefix, proxies, scores, **metadata):
+    dtype = fit_dtype(scores)
+    matrix = np.lib.format.open_memmap(scores_file(prefix), mode='w+', dtype=dtype, shape=scores.shape, fortran_order=True)
+    matrix[:] = scores
+    matrix.flush()
+    del matrix
+
+    _write_header(prefix, proxies, scores.shape[0], dtype, metadata)
+    return scores_file(prefix)
+
+
+def load_scores(prefix, mmap_mode='r'):
+    with open(header_file(prefix)) as f:
+        header = json.load(f)
+    matrix = np.load(scores_file(prefix), mmap_mode=mmap_mode)
+    return ScoreStore(matrix, header['proxies'], header)
+
+
+def has_scores(prefix):
+    return os.path.exists(scores_file(prefix)) and os.path.exists(header_file(prefix))
+
+
+# Loads the store when there is one and falls back to a `{PATH}simulated_scores.p` pickle
+# written before the store existed.
+def load_simulated_scores(prefix):
+    if has_scores(prefix):
+        return load_scores(prefix)
+    return pickle.load(open(legacy_scores_file(prefix), 'rb'))
+
+
+# Sharded stores: a run split over the scenario axis (see random_streams.shard_range) writes one partial store
+# per shard next to the full store's prefix. Each partial's header records the shard, the
+# scenarios it covers and the root seed, so merge_shards can check the partials belong together
+# before concatenating them into the store an unsharded run would have written.
+SHARD_KEYS = ['shard', 'shards', 'first_scenario', 'total_scenarios', 'seed']
+
+
+def shard_prefix(prefix, shard, shards):
+    return '{}shard{}of{}_'.format(prefix, shard, shards)
+
+
+def shard_metadata(shard, shards, first_scenario, total_scenarios, seed):
+    return {'shard': shard, 'shards': shards, 'first_scenario': first_scenario, 'total_scenarios': total_scenarios, \
+        'seed': seed}
+
+
+# The partial stores of `shards` shards, checked to cover one run's scenarios in order
+def load_shards(prefix, shards):
+    parts = []
+    for shard in range(shards):
+        part_prefix = shard_prefix(prefix, shard, shards)
+        if not has_scores(part_prefix):
+            raise FileNotFoundError('Shard {} of {} is missing: no {}'.format(shard, shards, header_file(part_prefix)))
+        parts.append(load_scores(part_prefix))
+
+    first = parts[0].header
+    next_scenario = 0
+    for shard, part in enumerate(parts):
+        header = part.header
+        if header.get('shard') != shard or header.get('shards') != shards:
+            raise ValueError('{} is not shard {} of {}'.format(header_file(shard_prefix(prefix, shard, shards)), shard, shards))
+        for key in ['total_scenarios', 'seed', 'sampler', 'stage', 'species', 'proxies']:
+            if header.get(key) != first.get(key):
+                raise ValueError('Shards 0 and {} differ in {}: {!r} and {!r}'.format(shard, key, first.get(key), header.get(key)))
+        if header['first_scenario'] != next_scenario:
+            raise ValueError('Shard {} starts at scenario {}, expected {}'.format(shard, header['first_scenario'], next_scenario))
+        next_scenario += part.n_scenarios
+    if next_scenario != first['total_scenarios']:
+        raise ValueError('The shards cover {} of {} scenarios'.format(next_scenario, first['total_scenarios']))
+    return parts
+
+
+# Concatenates the partial stores of `shards` shards into the store at `prefix`, one shard at a
+# time. The dtype is the widest of the partials', which is what fit_dtype picks for the whole.
+def merge_shards(prefix, shards, remove=False):
+    parts = load_shards(prefix, shards)
+    proxies = parts[0].proxies
+    dtype = np.result_type(*[part.matrix.dtype for part in parts])
+    n_scenarios = parts[0].header['total_scenarios']
+    matrix = np.lib.format.open_memmap(scores_file(prefix), mode='w+', dtype=dtype, shape=(n_scenarios, len(proxies)), \
+        fortran_order=True)
+    start = 0
+    for part in parts:
+        matrix[start:start + part.n_scenarios] = part.matrix
+        start += part.n_scenarios
+    matrix.flush()
+    del matrix
+
+    metadata = {key: value for key, value in parts[0].header.items() \
+        if key not in SHARD_KEYS + ['proxies', 'n_scenarios', 'dtype']}
+    _write_header(prefix, proxies, n_scenarios, dtype, metadata)
+    if remove:
+        for shard in range(shards):
+            for path in [scores_file(shard_prefix(prefix, shard, shards)), header_file(shard_prefix(prefix, shard, shards))]:
+                os.remove(path)
+    return scores_file(prefix)
+
+
+# Scenarios [first_scenario, first_scenario + n_scenarios) of the store at `prefix`: the partial
+# store of that shard if there is one, else a slice of the full store
+def load_shard_scores(prefix, shard, shards, first_scenario, n_scenarios):
+    part_prefix = shard_prefix(prefix, shard, shards)
+    if has_scores(part_prefix):
+        part = load_scores(part_prefix)
+        if part.header.get('first_scenario') != first_scenario or part.n_scenarios != n_scenarios:
+            raise ValueError('{} does not cover scenarios {} to {}'.format(header_file(part_prefix), first_scenario, \
+                first_scenario + n_scenarios))
+        return part
+    store = load_scores(prefix)
+    if store.n_scenarios < first_scenario + n_scenarios:
+        raise ValueError('{} has {} scenarios, shard {} of {} needs {}'.format(header_file(prefix), store.n_scenarios, \
+            shard, shards, first_scenario + n_scenarios))
+    return ScoreStore(store.matrix[first_scenario:first_scenario + n_scenarios], store.proxies, store.header)
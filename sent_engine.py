@@ -0,0 +1,104 @@
+## Vectorized probability-of-sentience models
+# The priors-based models and the Birch criteria of sentience_models.ipynb as array operations:
+# every model's proxy list and every Birch criterion becomes a column of one proxies x terms
+# mask, so all sums for all species and the sometimes_operates reference are one matrix product.
+import numpy as np
+
+import judgment_index
+from score_store import score_matrix
+
+# {model name: column of Sentience Model Proxies.csv}
+SENT_MODELS = {'simple scoring': 'simple scoring',
+            '#1_high value proxies': '#1_high value proxies',
+            "Martina's High-Value Proxies": 'high value proxies_martina',
+            "Anna's High-Value Proxies": 'high value proxies_anna'}
+HV1_MODEL = '#1_high value proxies'  # the P(sentience) used to adjust welfare ranges
+
+SOMETIMES_OPERATES = 'sometimes_operates'
+
+BIRCH_OVERALL = 'overall'
+
+
+# Proxy lists of every model, from the compiled judgment index
+def load_models(input_dir='input_data'):
+    index = judgment_index.load_index(input_dir).sentience
+    return {'models': {model_name: index.member_set(judgment_index.model_term(column)) \
+                for model_name, column in SENT_MODELS.items()},
+            'birch': index.birch_criteria()}
+
+
+def proxy_mask(proxies, model_proxies):
+    return np.array([proxy in model_proxies for proxy in proxies], dtype=float)
+
+
+def posterior(prior, species_sum, so_sum):
+    return np.maximum(np.minimum(prior*(species_sum/so_sum)**0.25, 0.99), 0)
+
+
+# One proxies x terms mask holding the models first and the Birch criteria after them
+def model_terms(proxies, models):
+    terms = [('models', model_name) for model_name in models['models']] + \
+        [('birch', criterion) for criterion in models['birch']]
+    masks = [proxy_mask(proxies, models['models'][model_name]) for model_name in models['models']] + \
+        [proxy_mask(proxies, criterion_proxies) for criterion_proxies in models['birch'].values()]
+    return terms, np.column_stack(masks)
+
+
+# ({model: sum}, {criterion: sum}) for a (..., scenarios, proxies) score array
+def sentience_sums(scores, proxies, models):
+    terms, masks = model_terms(proxies, models)
+    return split_sums(terms, scores @ masks)
+
+
+# ({model: sum}, {criterion: sum}) from the (..., scenarios, terms) masked sums of model_terms
+def split_sums(terms, sums):
+    model_sums, birch_sums = {}, {}
+    for ii, (kind, name) in enumerate(terms):
+        (model_sums if kind == 'models' else birch_sums)[name] = sums[..., ii]
+    return model_sums, birch_sums
+
+
+# {criterion: sum} for a (..., scenarios, proxies) score array
+def birch_sums(scores, proxies, criteria):
+    sums = scores @ np.column_stack([proxy_mask(proxies, criterion_proxies) for criterion_proxies in criteria.values()])
+    return {criterion: sums[..., ii] for ii, criterion in enumerate(criteria)}
+
+
+def birch_overall(birch_sums):
+    return sum(birch_sums.values())
+
+
+# ({model: P(sentience)}, {criterion or 'overall': values}) for a (..., scenarios, proxies) score
+# array, against the sums of the sometimes_operates reference. Criteria keep their raw sums and
+# 'overall' is the posterior of the summed criteria.
+def posteriors(scores, proxies, priors, so_scores, so_proxies, models):
+    model_sums, birch_sums = sentience_sums(scores, proxies, models)
+    so_model_sums, so_birch_sums = sentience_sums(so_scores, so_proxies, models)
+    p_sentience = {model_name: posterior(priors, species_sum, so_model_sums[model_name]) \
+        for model_name, species_sum in model_sums.items()}
+    birch = {BIRCH_OVERALL: posterior(priors, birch_overall(birch_sums), birch_overall(so_birch_sums))}
+    birch.update(birch_sums)
+    return p_sentience, birch
+
+
+# ({model: {species: P(sentience)}}, {criterion or 'overall': {species: values}}) for every
+# species at once; `priors` is {species: prior samples}
+def all_species_posteriors(species_scores, priors, models, species_list, so_scores=None):
+    if so_scores is None:
+        so_scores = species_scores[SOMETIMES_OPERATES]
+    proxies = None
+    matrices = []
+    for species in species_list:
+        proxies, matrix = score_matrix(species_scores[species], proxies)
+        matrices.append(matrix)
+    so_proxies, so_matrix = score_matrix(so_scores, proxies)
+    n_scenarios = min([len(matrix) for matrix in matrices] + [len(so_matrix)] + \
+        [len(priors[species]) for species in species_list])
+    scores = np.stack([matrix[:n_scenarios] for matrix in matrices])
+    prior_matrix = np.stack([np.asarray(priors[species], dtype=float)[:n_scenarios] for species in species_list])
+
+    p_sentience, birch = posteriors(scores, proxies, prior_matrix, so_matrix[:n_scenarios], so_proxies, models)
+    return {model_name: {species: values[k] for k, species in enumerate(species_list)} \
+                for model_name, values in p_sentience.items()}, \
+        {criterion: {species: values[k] for k, species in enumerate(species_list)} \
+                for criterion, values in birch.items()}
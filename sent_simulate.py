@@ -1,126 +1,236 @@
 ## Generates the simulated data for each species' sentience proxies
-import os
-import pickle
-import random
 import argparse
-import csv
 
 import numpy as np
-import pandas as pd
-import squigglepy as sq
-
-from datetime import date
-from email.policy import default
-from scipy import stats
-from pprint import pprint
-from functools import partial
-from collections import defaultdict
-
-parser = argparse.ArgumentParser(description='Generate probability of sentience ranges')
-parser.add_argument('--species', type=str, help="What species do you want to simulate the probability of sentience of?")
-parser.add_argument('--unknown_prob', type=float, help="What probability do you assign Unknown judgements for this species?", default=0)
-parser.add_argument('--weight_no', type=str, help="Do you want to give non-zero probability to lean no and likely no?")
-parser.add_argument('--hc_weight', type=float, help="What weight do high-confidence proxies get relative to other proxies?")
-parser.add_argument('--scenarios', type=int, help='How many Monte Carlo simulations to run?', default=10000)
-parser.add_argument('--csv', type=str, help='Define the relative path to the CSV with the species scores information')
-parser.add_argument('--path', type=str, help='Define a custom path for the saved model outputs', default='')
-parser.add_argument('--save', type=bool, help='Set to False to not save (overwrite) model outputs', default=True)
-parser.add_argument('--update_every', type=int, help='How many steps to run before updating?', default=1000)
-parser.add_argument('--verbose', type=bool, help='Set to True to get scenario-specific output', default=False)
-args = parser.parse_args()
-
-SPECIES = args.species
-UNKNOWN_PROB = args.unknown_prob
-WEIGHT_NO = args.weight_no
-HC_WEIGHT = args.hc_weight
-N_SCENARIOS = args.scenarios
-VERBOSE = args.verbose
-CSV = args.csv
-SAVE = args.save
-PATH = args.path
-update_every = args.update_every
 
-SCENARIO_RANGES = [1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99]  # Generate printed output for these percentiles
-
-judgments = pd.read_csv(os.path.join('input_data', 'Sentience Judgments.csv'))
-
-hc_csv = os.path.join('input_data', 'Sentience High-Confidence Proxies.csv')
-hc_proxies = set()
-with open(hc_csv, newline='') as f:
-    reader = csv.reader(f)
-    hc_proxies_lists = list(reader)
-for item in hc_proxies_lists:
-    hc_proxies.add(item[0])
-
-if WEIGHT_NO == "Yes":
-    judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0.25},
-                    'lean no': {'lower': 0.25, 'upper': 0.50},
-                    'lean yes': {'lower': 0.50, 'upper': 0.75},
-                    'likely yes': {'lower': 0.75, 'upper': 1.00},
-                    'unknown': UNKNOWN_PROB, 'yes': 1, 'na': 0}
-else:
-    judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0},
-                    'lean no': {'lower': 0, 'upper': 0},
-                    'lean yes': {'lower': 0.50, 'upper': 0.75},
-                    'likely yes': {'lower': 0.75, 'upper': 1.00},
-                    'unknown': UNKNOWN_PROB, 'yes': 1, 'na': 0}
-
-species_scores = judgments[["proxies", SPECIES]]
-
-simulated_probs = {}
-simulated_scores = {}
-
-for proxy in species_scores["proxies"].to_list():
-    simulated_probs[proxy] = []
-    simulated_scores[proxy] = []
-
-for s in range(N_SCENARIOS):
-    if s % update_every == 0:
-        if VERBOSE:
-            print('-')
-            print('### SCENARIO {} ###'.format(s + 1))
-        else:
-            print('... Completed {}/{}'.format(s + 1, N_SCENARIOS))
+import score_store
+import instrumentation
+import random_streams
+import judgment_index
+import sampling
+import packed_scores
 
-    #Set up for iteration over proxies                
-    bern_probs = []
-    proxies_arr = []
-    num_proxies = len(species_scores)
-    judgements = species_scores[SPECIES]
-    
-    for ii in range(0,num_proxies):
-        proxy = species_scores.proxies[ii]
-
-        judgment = judgements[ii]
-        judgment = judgment.lower()
+SENT_SPECIES = ['bees', 'cockroaches', 'fruit_flies', 'ants', \
+            'c_elegans', 'crabs', 'crayfish', 'earthworms', \
+            'sea_hares',  'spiders', 'octopuses', 'chickens', \
+            'cows', 'sometimes_operates', 'bsf', \
+            'carp', 'salmon', 'silkworms', 'pigs']
 
+SCENARIO_RANGES = [1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99]  # Generate printed output for these percentiles
 
-        if judgment in {'unknown', 'yes', 'na'}:
-            proxy_prob = judgment_prob_map[judgment]
-        else:
-            lower_prob = judgment_prob_map[judgment]['lower']
-            upper_prob = judgment_prob_map[judgment]['upper']
-            proxy_prob = random.uniform(lower_prob, upper_prob)
-            
-        bern_probs.append(proxy_prob)
-        proxies_arr.append(proxy)
-
-    #Obtain bernoulli draws         
-    draws = stats.bernoulli.rvs(bern_probs,size=len(bern_probs))
-    
-    #Store bernoulli draw results        
-    for ii in range(0,num_proxies):
-        proxy = proxies_arr[ii]  
-        has_proxy = draws[ii]
-        if proxy in hc_proxies:
-            score = HC_WEIGHT*has_proxy
+FIXED_JUDGMENTS = {'unknown', 'yes', 'na'}
+
+
+def get_judgment_prob_map(weight_no, unknown_prob):
+    if weight_no == "Yes":
+        judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0.25},
+                        'lean no': {'lower': 0.25, 'upper': 0.50},
+                        'lean yes': {'lower': 0.50, 'upper': 0.75},
+                        'likely yes': {'lower': 0.75, 'upper': 1.00},
+                        'unknown': unknown_prob, 'yes': 1, 'na': 0}
+    else:
+        judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0},
+                        'lean no': {'lower': 0, 'upper': 0},
+                        'lean yes': {'lower': 0.50, 'upper': 0.75},
+                        'likely yes': {'lower': 0.75, 'upper': 1.00},
+                        'unknown': unknown_prob, 'yes': 1, 'na': 0}
+    return judgment_prob_map
+
+
+# The compiled sentience judgments (a judgment_index.StageIndex); the CSVs are only parsed
+# again when they changed
+def load_judgments():
+    return judgment_index.load_index().sentience
+
+
+# Lower/upper probability bounds of every judgment code (NaN for judgments the map lacks).
+# Judgments with a fixed probability ('unknown', 'yes', 'na') get lower == upper, so the uniform
+# draw collapses to that value.
+def bound_table(judgment_prob_map):
+    lower = np.full(len(judgment_index.JUDGMENTS), np.nan)
+    upper = np.full(len(judgment_index.JUDGMENTS), np.nan)
+    for code, judgment in enumerate(judgment_index.JUDGMENTS):
+        if judgment not in judgment_prob_map:
+            continue
+        if judgment in FIXED_JUDGMENTS:
+            lower[code] = upper[code] = judgment_prob_map[judgment]
         else:
-            score = has_proxy
-            
-        simulated_probs[proxy].append(proxy_prob)
-        simulated_scores[proxy].append(score)
-            
-
-if SAVE:
-    print('... Saving 1/1')
-    pickle.dump(simulated_scores, open('{}simulated_scores.p'.format(PATH), 'wb'))
\ No newline at end of file
+            lower[code] = judgment_prob_map[judgment]['lower']
+            upper[code] = judgment_prob_map[judgment]['upper']
+    return lower, upper
+
+
+# Lower/upper probability bounds for every proxy from its judgment codes
+def judgment_bounds(codes, judgment_prob_map):
+    codes = np.asarray(codes)
+    lower_table, upper_table = bound_table(judgment_prob_map)
+    lower, upper = lower_table[codes], upper_table[codes]
+    if np.isnan(lower).any():
+        missing = sorted({judgment_index.JUDGMENTS[code] for code in codes[np.isnan(lower)]})
+        raise KeyError('No probability for judgments {}'.format(missing))
+    return lower, upper
+
+
+def proxy_weights(proxies, hc_proxies, hc_weight):
+    return np.array([hc_weight if proxy in hc_proxies else 1 for proxy in proxies], dtype=float)
+
+
+# Two uniforms per scenario from `rng`: one for the proxy's probability, one for its Bernoulli draw
+def draw_uniforms(shape, rng, sampler=sampling.RANDOM):
+    if sampler == sampling.RANDOM:
+        return rng.random(shape), rng.random(shape)
+    u = sampling.uniforms(rng, shape, 2, sampler)
+    return u[:, 0], u[:, 1]
+
+
+# Presence given the uniforms: the probability is uniform in [lower, upper), as rng.uniform
+# draws it, followed by a Bernoulli draw, like the per-proxy random.uniform + bernoulli.rvs
+def presence_from_uniforms(lower, upper, u_prob, u_draw):
+    return u_draw < lower + (upper - lower)*u_prob
+
+
+# (probability, Bernoulli) uniforms of `proxies` for one block, each proxy from its own stream
+def proxy_uniforms(seed, stage, species, proxies, block, n_scenarios, sampler=sampling.RANDOM):
+    u_prob = np.empty((n_scenarios, len(proxies)), order='F')
+    u_draw = np.empty((n_scenarios, len(proxies)), order='F')
+    for jj, proxy in enumerate(proxies):
+        rng = random_streams.proxy_generator(seed, stage, species, proxy, block)
+        u_prob[:, jj], u_draw[:, jj] = draw_uniforms(n_scenarios, rng, sampler)
+    return u_prob, u_draw
+
+
+# Draws the presence of `proxies` for a block of scenarios; `lower`/`upper` hold their bounds
+def draw_presence(lower, upper, proxies, n_scenarios, seed, stage, species, block, sampler=sampling.RANDOM):
+    return presence_from_uniforms(lower, upper, *proxy_uniforms(seed, stage, species, proxies, block, n_scenarios, \
+        sampler))
+
+
+def select_proxies(proxies, proxy_subset):
+    if proxy_subset is None:
+        return proxies
+    proxy_subset = set(proxy_subset)
+    return [proxy for proxy in proxies if proxy in proxy_subset]
+
+
+# Simulates the species x scenarios x proxies tensor of scores for all `species_list` at once.
+# Draws come from the (species, proxy, block) streams of `seed`, so a seeded run is
+# bit-identical however it is split; seed=None draws a fresh root seed. `first_scenario` starts
+# the run part-way through the streams (on a block boundary) and `proxy_subset` simulates only
+# those proxies' columns, with the same values they have in a full run. `sampler` is one of
+# sampling.SAMPLERS.
+def simulate_all_species(judgments, species_list, unknown_probs, weight_no, hc_weight, n_scenarios, \
+        hc_proxies=None, seed=None, first_scenario=0, progress=None, proxy_subset=None, sampler=sampling.RANDOM):
+    if hc_proxies is None:
+        hc_proxies = judgment_index.load_index().sentience.member_set(judgment_index.HC)
+    if seed is None:
+        seed = random_streams.new_root_seed()
+
+    all_proxies = judgments.proxies
+    proxies = select_proxies(all_proxies, proxy_subset)
+    idx = [all_proxies.index(proxy) for proxy in proxies]
+    weights = proxy_weights(proxies, hc_proxies, hc_weight)
+
+    lower = np.empty((len(species_list), len(proxies)))
+    upper = np.empty((len(species_list), len(proxies)))
+    for k, species in enumerate(species_list):
+        judgment_prob_map = get_judgment_prob_map(weight_no, unknown_probs.get(species, 0))
+        lower[k], upper[k] = judgment_bounds(judgments.species_codes(species)[idx], judgment_prob_map)
+
+    scores = np.empty((len(species_list), n_scenarios, len(proxies)))
+    for block, start, stop in random_streams.stream_blocks(n_scenarios, first_scenario):
+        if progress is not None:
+            progress(start, n_scenarios)
+        for k, species in enumerate(species_list):
+            scores[k, start:stop] = draw_presence(lower[k], upper[k], proxies, stop - start, seed, 'sentience', \
+                species, block, sampler) * weights
+
+    return proxies, scores
+
+
+def simulate_species(judgments, species, unknown_prob, weight_no, hc_weight, n_scenarios, \
+        hc_proxies=None, seed=None, first_scenario=0, progress=None, proxy_subset=None, sampler=sampling.RANDOM):
+    proxies, scores = simulate_all_species(judgments, [species], {species: unknown_prob}, weight_no, hc_weight, \
+        n_scenarios, hc_proxies=hc_proxies, seed=seed, first_scenario=first_scenario, progress=progress, \
+        proxy_subset=proxy_subset, sampler=sampler)
+    return proxies, scores[0]
+
+
+# The draws of simulate_species with the scores kept as presence bits (a
+# packed_scores.PackedScores), so all scenarios of every species can stay in memory at once
+def simulate_packed_species(judgments, species, unknown_prob, weight_no, hc_weight, n_scenarios, \
+        hc_proxies=None, seed=None, first_scenario=0, progress=None, sampler=sampling.RANDOM):
+    if hc_proxies is None:
+        hc_proxies = judgment_index.load_index().sentience.member_set(judgment_index.HC)
+    if seed is None:
+        seed = random_streams.new_root_seed()
+
+    proxies = judgments.proxies
+    lower, upper = judgment_bounds(judgments.species_codes(species), get_judgment_prob_map(weight_no, unknown_prob))
+    bits = np.empty((n_scenarios, packed_scores.n_words(len(proxies))), dtype=np.uint64)
+    for block, start, stop in random_streams.stream_blocks(n_scenarios, first_scenario):
+        if progress is not None:
+            progress(start, n_scenarios)
+        bits[start:stop] = packed_scores.pack_rows(draw_presence(lower, upper, proxies, stop - start, seed, 'sentience', \
+            species, block, sampler))
+    weights = proxy_weights(proxies, hc_proxies, hc_weight)
+    return proxies, packed_scores.PackedScores([(bits, np.diag(weights))], proxies, n_scenarios)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate probability of sentience ranges')
+    parser.add_argument('--species', type=str, help="What species do you want to simulate the probability of sentience of?")
+    parser.add_argument('--unknown_prob', type=float, help="What probability do you assign Unknown judgements for this species?", default=0)
+    parser.add_argument('--weight_no', type=str, help="Do you want to give non-zero probability to lean no and likely no?")
+    parser.add_argument('--hc_weight', type=float, help="What weight do high-confidence proxies get relative to other proxies?")
+    parser.add_argument('--scenarios', type=int, help='How many Monte Carlo simulations to run?', default=10000)
+    parser.add_argument('--csv', type=str, help='Define the relative path to the CSV with the species scores information')
+    parser.add_argument('--path', type=str, help='Define a custom path for the saved model outputs', default='')
+    parser.add_argument('--save', type=bool, help='Set to False to not save (overwrite) model outputs', default=True)
+    parser.add_argument('--update_every', type=int, help='How many steps to run before updating? Progress is reported at most once per random stream block', default=1000)
+    parser.add_argument('--seed', type=int, help='Root seed of the random streams; a fresh one is drawn if not set', default=None)
+    parser.add_argument('--verbose', type=bool, help='Set to True to get scenario-specific output', default=False)
+    parser.add_argument('--metrics', type=str, help='JSON lines file to write progress and timing events to', default=None)
+    parser.add_argument('--shard', type=int, help='Which shard (from 0) of the scenarios to simulate', default=0)
+    parser.add_argument('--shards', type=int, help='Split the scenarios into this many shards, each saved as a partial store', default=1)
+    parser.add_argument('--merge', action='store_true', help='Merge the partial stores of --shards shards at --path instead of simulating')
+    parser.add_argument('--sampler', type=str, choices=sampling.SAMPLERS, help='How to draw the uniforms behind every judgment', default=sampling.RANDOM)
+    args = parser.parse_args()
+
+    SPECIES = args.species
+    N_SCENARIOS = args.scenarios
+    VERBOSE = args.verbose
+    SAVE = args.save
+    PATH = args.path
+
+    if VERBOSE:
+        message = '-\n### SCENARIO {done} ###'
+    else:
+        message = '... Completed {done}/{total}'
+
+    if args.merge:
+        path = score_store.merge_shards(PATH, args.shards)
+        print('... Merged {} shards into {}'.format(args.shards, path))
+        return
+    if args.shards > 1 and args.seed is None:
+        parser.error('--shards needs --seed, so every shard draws from the same random streams')
+    first_scenario, n_shard = random_streams.shard_range(N_SCENARIOS, args.shard, args.shards)
+
+    with instrumentation.default_metrics(path=args.metrics) as metrics:
+        with metrics.stage('sentience simulate', n_shard, species=SPECIES):
+            proxies, scores = simulate_species(load_judgments(), SPECIES, args.unknown_prob, args.weight_no, args.hc_weight, \
+                n_shard, seed=args.seed, first_scenario=first_scenario, sampler=args.sampler, \
+                progress=metrics.progress_callback('sentience simulate', message, species=SPECIES))
+
+        if SAVE:
+            metadata = {} if args.sampler == sampling.RANDOM else {'sampler': args.sampler}
+            if args.shards > 1:
+                PATH = score_store.shard_prefix(PATH, args.shard, args.shards)
+                metadata.update(score_store.shard_metadata(args.shard, args.shards, first_scenario, N_SCENARIOS, args.seed))
+            metrics.progress('sentience save', 0, 1, '... Saving 1/1', species=SPECIES)
+            with metrics.stage('sentience save', n_shard, species=SPECIES) as extra:
+                path = score_store.write_scores(PATH, proxies, scores, stage='sentience', species=SPECIES, **metadata)
+                extra['bytes_written'] = instrumentation.bytes_written([path, score_store.header_file(PATH)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+## Priors on the probability of sentience, reconstructed from three sets of expert judgments
+import numpy as np
+import squigglepy as sq
+
+import random_streams
+import sampling
+
+species_lst = ['bees', 'cockroaches', 'fruit_flies', 'ants', 'c_elegans', 'crabs', 'crayfish', \
+        'earthworms', 'sea_hares', 'spiders', 'octopuses', 'chickens', 'cows', 'bsf', \
+        'carp', 'salmon', 'silkworms', 'pigs']
+
+species_caps = ["Bees", "Cockroaches", "Fruit Flies", "Ants", \
+                "C. elegans", "Crabs", "Crayfish", "Earthworms", \
+                    "Sea Hares", "Spiders", "Octopuses", "Chickens", \
+                            "Cows", "Black Soldier Flies", "Carp", "Salmon", "Silkworms", "Pigs"]
+
+d_prob_map = {'very probably yes': {'lower': 0.9, 'upper': 1.0}, 
+                           'probably yes': {'lower': 0.65, 'upper': 0.9},
+                           'possibly yes': {'lower': 0.5, 'upper': 0.65},
+                           'possibly no': {'lower': 0.35, 'upper': 0.5},
+                           'probably no': {'lower': 0.1, 'upper': 0.35},
+                           'very probably no': {'lower': 0.0, 'upper': 0.1}}
+
+d_judgments = {'bees': 'probably yes', 'cockroaches': 'possibly yes', 'fruit_flies': 'probably yes', 
+                'ants': 'possibly yes', 'c_elegans': 'probably no', 'crayfish': 'probably yes', 'crabs': 'probably yes',
+                'earthworms': 'probably no', 'sea_hares': 'possibly no', 'spiders': 'possibly yes', 
+                'octopuses': 'very probably yes', 'chickens': 'very probably yes', 'cows': 'very probably yes', 
+                # this row was made up using similar results from like animals
+                'bsf': 'probably yes', 'carp': 'probably yes', 'salmon': 'probably yes', 'silkworms': 'probably no', 'pigs': 'very probably yes'}
+
+daniela_priors = {}
+for species in species_lst:
+        daniela_priors[species] = {'dist_type': 'normal', 'lower': d_prob_map[d_judgments[species]]['lower'], 
+                                        'upper': d_prob_map[d_judgments[species]]['upper'], 'lclip': 0, 'rclip': 1}
+
+marcus_priors = {'bees': {'dist_type': 'lognormal', 'lower': 0.02, 
+                'upper': 0.6, 'lclip': 0, 'rclip': 1}, 
+        'cockroaches': {'dist_type': 'lognormal', 'lower': 0.01, 
+                'upper': 0.4, 'lclip': 0, 'rclip': 1}, 
+        'fruit_flies': {'dist_type': 'lognormal', 'lower': 0.04, 
+                'upper': 0.55, 'lclip': 0, 'rclip': 1}, 
+        'ants': {'dist_type': 'lognormal', 'lower': 0.02, 
+                'upper': 0.6, 'lclip': 0, 'rclip': 1},
+        'c_elegans': {'dist_type': 'lognormal', 'lower': 0.001, 
+                'upper': 0.01, 'lclip': 0, 'rclip': 0.01}, 
+        'crabs': {'dist_type': 'lognormal', 'lower': 0.05, 
+                'upper': 0.6, 'lclip': 0, 'rclip': 1}, 
+        'crayfish': {'dist_type': 'lognormal', 'lower': 0.05, 
+                'upper': 0.6, 'lclip': 0, 'rclip': 1}, 
+        'earthworms': {'dist_type': 'lognormal', 'lower': 0.001, 
+                'upper': 0.2, 'lclip': 0, 'rclip': 1},
+        'sea_hares': {'dist_type': 'lognormal', 'lower': 0.001, 
+                'upper': 0.04, 'lclip': 0, 'rclip': 1}, 
+        'spiders': {'dist_type': 'lognormal', 'lower': 0.01, 
+                'upper': 0.4, 'lclip': 0, 'rclip': 1},
+        'octopuses': {'dist_type': 'normal', 'lower': 0.3, 
+                'upper': 0.9, 'lclip': 0, 'rclip': 1},
+        'chickens': {'dist_type': 'normal', 'lower': 0.5, 
+                'upper': 0.9, 'lclip': 0, 'rclip': 1},
+        'cows': {'dist_type': 'normal', 'lower': 0.6, 
+                'upper': 0.9, 'lclip': 0, 'rclip': 1},
+        # put this as as same as fruit flies
+        'bsf': {'dist_type': 'normal', 'lower': 0.04, 
+                'upper': 0.55, 'lclip': 0, 'rclip': 1},
+        # put this as same as crabs
+        'carp': {'dist_type': 'lognormal', 'lower': 0.05, 
+                'upper': 0.6, 'lclip': 0, 'rclip': 1},
+        'salmon': {'dist_type': 'lognormal', 'lower': 0.05, 
+                'upper': 0.6, 'lclip': 0, 'rclip': 1},
+        # put this as same as earthworms
+        'silkworms': {'dist_type': 'lognormal', 'lower': 0.001, 
+                'upper': 0.2, 'lclip': 0, 'rclip': 1},
+        # put this as same as cows
+        'pigs': {'dist_type': 'normal', 'lower': 0.6, 
+                'upper': 0.9, 'lclip': 0, 'rclip': 1},
+        
+        }
+
+peter_priors = {'bees': {'dist_type': 'normal', 'lower': 0.36, 'upper': 0.44, 'lclip': 0, 'rclip': 1}, 
+        'cockroaches': {'dist_type': 'normal', 'lower': 0.18, 'upper': 0.22, 'lclip': 0, 'rclip': 1}, 
+        'fruit_flies': {'dist_type': 'normal', 'lower': 0.27, 'upper': 0.33, 'lclip': 0, 'rclip': 1}, 
+        'ants': {'dist_type': 'normal', 'lower': 0.225, 'upper': 0.275, 'lclip': 0, 'rclip': 1},
+        'c_elegans': {'dist_type': 'lognormal', 'lower': 0.0001, 'upper': 0.02, 'lclip': 0.0001, 'rclip': 1}, 
+        'crabs': {'dist_type': 'normal', 'lower': 0.27, 'upper': 0.33, 'lclip': 0, 'rclip': 1}, 
+        'crayfish': {'dist_type': 'normal', 'lower': 0.27, 'upper': 0.33, 'lclip': 0, 'rclip': 1}, 
+        'earthworms': {'dist_type': 'normal', 'lower': 0.045, 'upper': 0.055, 'lclip': 0, 'rclip': 1},
+        'sea_hares': {'dist_type': 'normal', 'lower': 0.045, 'upper': 0.055, 'lclip': 0, 'rclip': 1}, 
+        'spiders': {'dist_type': 'normal', 'lower': 0.225, 'upper': 0.275, 'lclip': 0, 'rclip': 1},
+        'octopuses': {'dist_type': 'normal', 'lower': 0.63, 'upper': 0.77, 'lclip': 0, 'rclip': 1},
+        'chickens': {'dist_type': 'normal', 'lower': 0.72, 'upper': 0.88, 'lclip': 0, 'rclip': 1},
+        'cows': {'dist_type': 'normal', 'lower': 0.765, 'upper': 0.935, 'lclip': 0, 'rclip': 1},
+        # same as fruit flies
+        'bsf': {'dist_type': 'normal', 'lower': 0.27, 'upper': 0.33, 'lclip': 0, 'rclip': 1},
+        # same as crabs
+        'carp': {'dist_type': 'normal', 'lower': 0.27, 'upper': 0.33, 'lclip': 0, 'rclip': 1},
+        'salmon': {'dist_type': 'normal', 'lower': 0.27, 'upper': 0.33, 'lclip': 0, 'rclip': 1},
+        # same as earthworms
+        'silkworms': {'dist_type': 'normal', 'lower': 0.045, 'upper': 0.055, 'lclip': 0, 'rclip': 1},
+        # same as cows
+        'pigs': {'dist_type': 'normal', 'lower': 0.765, 'upper': 0.935, 'lclip': 0, 'rclip': 1},
+        }
+
+priors_distributions = {'Daniela': daniela_priors, 'Marcus': marcus_priors, 'Peter': peter_priors}
+PEOPLE = ['Daniela', 'Marcus', 'Peter']
+
+
+def prior_mixture(priors_distributions, species):
+    models = []
+    for person in PEOPLE:
+        dist_type = priors_distributions[person][species]['dist_type']
+        lower = priors_distributions[person][species]['lower']
+        upper = priors_distributions[person][species]['upper']
+        lclip = priors_distributions[person][species]['lclip']
+        rclip = priors_distributions[person][species]['rclip']
+        if dist_type == 'lognormal':
+            model = sq.lognorm(x=lower, y=upper, credibility = 90, lclip=lclip, rclip=rclip)
+        elif dist_type == 'normal':
+            model = sq.norm(x=lower, y=upper, credibility = 90, lclip=lclip, rclip=rclip)
+        models.append(model)
+    return sq.mixture(models, [1/3, 1/3, 1/3])
+
+
+# Values of a clipped norm or lognorm at quantiles `u`, clipped the way squigglepy clips samples
+def component_quantiles(dist, u):
+    if isinstance(dist, sq.LognormalDistribution):
+        values = np.exp(dist.norm_mean + dist.norm_sd*sampling.standard_normal(u))
+    else:
+        values = dist.mean + dist.sd*sampling.standard_normal(u)
+    if dist.lclip is not None or dist.rclip is not None:
+        values = np.clip(values, dist.lclip, dist.rclip)
+    return values
+
+
+# Draws exactly what sq.sample(mixture, n_scenarios) draws from squigglepy's generator, but picks
+# between the presampled components with one searchsorted instead of a Python call per sample.
+# Any other sampler takes its (component, quantile) uniforms from `rng` instead.
+def sample_mixture(mixture, n_scenarios, sampler=sampling.RANDOM, rng=None):
+    if sampler != sampling.RANDOM:
+        u = sampling.uniforms(rng, n_scenarios, 2, sampler)
+        picks = sampling.pick_components(mixture.weights, u[:, 0])
+        samples = np.empty(n_scenarios)
+        for k, dist in enumerate(mixture.dists):
+            mask = picks == k
+            samples[mask] = component_quantiles(dist, u[mask, 1])
+        return samples
+    if n_scenarios <= 100:
+        return np.asarray(sq.sample(mixture, n_scenarios))
+    components = np.array([sq.sample(dist, n_scenarios) for dist in mixture.dists])
+    picker = sq.samplers.uniform_sample(0, 1, samples=n_scenarios)
+    index = np.searchsorted(np.cumsum(mixture.weights), picker, side='left')
+    return components[index, np.arange(n_scenarios)]
+
+
+# Priors of scenarios [first_scenario, first_scenario + n_scenarios) of every species in
+# `species_list` ('shrimp' takes the assumed shrimp prior). Each (species, block) is drawn from
+# its own stream of the root `seed`, so every run path (notebook, pipeline, streaming, sweeps)
+# draws the same priors for a SEED and sampler.
+def simulate_priors(priors_distributions, n_scenarios, seed=None, sampler=sampling.RANDOM, \
+        species_list=species_lst, first_scenario=0):
+    priors = {species: [] for species in species_list}
+    for block, start, stop in random_streams.stream_blocks(n_scenarios, first_scenario):
+        for species in priors:
+            rng = None
+            if sampler == sampling.RANDOM:
+                sq.set_seed(random_streams.block_seed(seed, 'priors', species, block))
+            else:
+                rng = np.random.default_rng(random_streams.block_seed(seed, 'priors', species, block))
+            if species == 'shrimp':
+                priors[species].append(sample_shrimp_prior(priors_distributions, stop - start, sampler, rng))
+            else:
+                mixture = prior_mixture(priors_distributions, species)
+                priors[species].append(sample_mixture(mixture, stop - start, sampler, rng))
+    return {species: np.concatenate(chunks) for species, chunks in priors.items()}
+
+
+# Shrimp have no sentience judgments, so their P(sentience) is assumed to be the crabs' prior
+def sample_shrimp_prior(priors_distributions, n_scenarios, sampler=sampling.RANDOM, rng=None):
+    return sample_mixture(prior_mixture(priors_distributions, 'crabs'), n_scenarios, sampler, rng)
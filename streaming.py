@@ -0,0 +1,703 @@
+## Streaming, bounded-memory run of the sentience and welfare range models
+# Scenarios are generated a chunk at a time and pushed straight through the sentience, Birch,
+# welfare range and P(sentience)-adjusted welfare range formulas of the notebooks. Only mergeable
+# accumulators survive a chunk (running moments plus a quantile sketch per species and model),
+# so memory stays flat however many scenarios are run. The Mixture models, which are fitted to
+# the other models' percentiles, are sampled once the run is done (add_mixtures). The summary
+# CSVs are written in the same layout as the notebooks'.
+import os
+import time
+import pickle
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import score_store
+import instrumentation
+import results_store
+import random_streams
+import sampling
+import sentience_priors
+import sent_simulate
+import wr_simulate
+import sent_engine
+import wr_engine
+import pipeline
+
+SCENARIO_RANGES = [1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99]
+
+CHUNK_SIZE = 5 * random_streams.STREAM_BLOCK  # scenarios held in memory at once
+
+# The sketch keeps every distinct value until there are more than SKETCH_MAX_EXACT of them, so
+# discrete distributions give exactly np.percentile's answer. Past that, values are collapsed to
+# log-spaced bins whose representative is within SKETCH_ACCURACY (relative) of every value in it.
+SKETCH_ACCURACY = 1e-4
+SKETCH_MAX_EXACT = 16384
+SKETCH_MIN_VALUE = 1e-12  # smaller magnitudes are counted as 0 once collapsed
+
+ERROR_Z = 1.96  # width, in standard errors, of the percentile intervals behind summary_errors
+
+SHARD_FILE = 'streaming_shard{}of{}.p'
+
+# The Mixture models of wr_models.ipynb, equal-weight mixtures of normals fitted to every model's
+# 5th/95th percentiles: {name: (summary file name, whether the species' neuron count is a component)}
+MIXTURES = {'Mixture': ('Mixture Model', False), 'Mixture Neuron Count': ('Mixture Model Neuron Count', True)}
+
+# Species order of the adjusted welfare range tables
+ADJ_WR_SPECIES = ['pigs', 'chickens', 'carp', 'octopuses', 'bees', 'salmon', 'crayfish', 'shrimp',  'crabs', 'bsf', 'silkworms']
+
+
+class RunningMoments:
+    # Count, mean and sum of squared deviations, merged with Chan et al.'s pairwise update
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def _combine(self, count, mean, m2):
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean = self.mean + delta*count/total
+        self.m2 = self.m2 + m2 + delta**2*self.count*count/total
+        self.count = total
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        mean = values.mean()
+        self._combine(len(values), mean, float(((values - mean)**2).sum()))
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+
+    @property
+    def variance(self):
+        return self.m2/self.count if self.count else float('nan')
+
+
+class _DenseBins:
+    # Counts indexed by integer key, stored densely from the smallest key seen
+    def __init__(self):
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, keys, counts):
+        if len(keys) == 0:
+            return
+        low, high = int(keys.min()), int(keys.max())
+        if len(self.counts) == 0:
+            self.offset = low
+            self.counts = np.zeros(high - low + 1, dtype=np.int64)
+        elif low < self.offset or high >= self.offset + len(self.counts):
+            new_offset = min(low, self.offset)
+            grown = np.zeros(max(high, self.offset + len(self.counts) - 1) - new_offset + 1, dtype=np.int64)
+            grown[self.offset - new_offset:self.offset - new_offset + len(self.counts)] = self.counts
+            self.offset, self.counts = new_offset, grown
+        self.counts += np.bincount(keys - self.offset, weights=counts, minlength=len(self.counts)).astype(np.int64)
+
+    def items(self):
+        keys = np.flatnonzero(self.counts)
+        return keys + self.offset, self.counts[keys]
+
+
+class QuantileSketch:
+    # Mergeable sketch answering np.percentile(values, q) (the default 'linear' method).
+    # Exact while it holds at most `max_exact` distinct values; after that a DDSketch-style
+    # log-binned summary whose answers are within `relative_accuracy` of the exact ones.
+    def __init__(self, relative_accuracy=SKETCH_ACCURACY, max_exact=SKETCH_MAX_EXACT):
+        self.relative_accuracy = relative_accuracy
+        self.max_exact = max_exact
+        self.gamma = (1 + relative_accuracy)/(1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+        self.exact = True
+        self.values = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.positive = _DenseBins()
+        self.negative = _DenseBins()
+        self.zeros = 0
+
+    @property
+    def count(self):
+        if self.exact:
+            return int(self.counts.sum())
+        return int(self.positive.counts.sum() + self.negative.counts.sum()) + self.zeros
+
+    def _keys(self, magnitudes):
+        return np.ceil(np.log(magnitudes)/self.log_gamma).astype(np.int64)
+
+    def _representative(self, keys):
+        return 2*self.gamma**keys/(1 + self.gamma)
+
+    def _add_binned(self, values, counts):
+        magnitudes = np.abs(values)
+        is_zero = magnitudes < SKETCH_MIN_VALUE
+        self.zeros += int(counts[is_zero].sum())
+        is_positive = ~is_zero & (values > 0)
+        is_negative = ~is_zero & (values < 0)
+        self.positive.add(self._keys(magnitudes[is_positive]), counts[is_positive])
+        self.negative.add(self._keys(magnitudes[is_negative]), counts[is_negative])
+
+    def _add_exact(self, values, counts):
+        idx = np.searchsorted(self.values, values)
+        known = idx < len(self.values)
+        known[known] = self.values[idx[known]] == values[known]
+        if known.all():
+            self.counts += np.bincount(idx, weights=counts, minlength=len(self.values)).astype(np.int64)
+            return
+        merged, inverse = np.unique(np.concatenate([self.values, values]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]), minlength=len(merged)).astype(np.int64)
+        self.values = merged
+        if len(self.values) > self.max_exact:
+            self._collapse()
+
+    def _collapse(self):
+        values, counts = self.values, self.counts
+        self.exact = False
+        self.values = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._add_binned(values, counts)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        if len(values) == 0:
+            return
+        if self.exact:
+            values, counts = np.unique(values, return_counts=True)
+            self._add_exact(values, counts)
+        else:
+            self._add_binned(values, np.ones(len(values), dtype=np.int64))
+
+    def merge(self, other):
+        if other.exact:
+            if self.exact:
+                self._add_exact(other.values, other.counts)
+            else:
+                self._add_binned(other.values, other.counts)
+            return
+        if self.exact:
+            self._collapse()
+        self.zeros += other.zeros
+        for bins, other_bins in [(self.positive, other.positive), (self.negative, other.negative)]:
+            keys, counts = other_bins.items()
+            bins.add(keys, counts)
+
+    # Sorted (value, count) pairs; collapsed bins are represented by their representative value
+    def distribution(self):
+        if self.exact:
+            return self.values, self.counts
+        neg_keys, neg_counts = self.negative.items()
+        pos_keys, pos_counts = self.positive.items()
+        values = np.concatenate([-self._representative(neg_keys[::-1]), [0.0], self._representative(pos_keys)])
+        counts = np.concatenate([neg_counts[::-1], [self.zeros], pos_counts])
+        keep = counts > 0
+        return values[keep], counts[keep]
+
+    def percentile(self, q):
+        values, counts = self.distribution()
+        n = int(counts.sum())
+        if n == 0:
+            raise ValueError('percentile of an empty sketch')
+        # Same index arithmetic and interpolation as numpy's 'linear' method
+        quantiles = np.true_divide(np.asarray(q, dtype=float), 100)
+        scalar = quantiles.ndim == 0
+        quantiles = np.atleast_1d(quantiles)
+        virtual = (n - 1)*quantiles
+        previous = np.floor(virtual)
+        gamma = virtual - previous
+        previous = np.clip(previous, 0, n - 1).astype(np.int64)
+        following = np.clip(previous + 1, 0, n - 1)
+        above = virtual >= n - 1
+        previous[above] = following[above] = n - 1
+        cumulative = np.cumsum(counts)
+        a = values[np.searchsorted(cumulative, previous, side='right')]
+        b = values[np.searchsorted(cumulative, following, side='right')]
+        diff = b - a
+        result = np.where(gamma >= 0.5, b - diff*(1 - gamma), a + diff*gamma)
+        return result[0] if scalar else result
+
+
+class SummaryAccumulator:
+    # Everything one_species_summary_stats needs, accumulated a chunk at a time
+    def __init__(self):
+        self.moments = RunningMoments()
+        self.sketch = QuantileSketch()
+
+    def update(self, values):
+        self.moments.update(values)
+        self.sketch.update(values)
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+
+    @property
+    def count(self):
+        return self.moments.count
+
+    def percentiles(self, q=SCENARIO_RANGES):
+        return self.sketch.percentile(q)
+
+    # (mean, 5th, 50th, 95th percentile), like one_species_summary_stats
+    def summary(self):
+        percentiles = self.percentiles(SCENARIO_RANGES)
+        return (self.moments.mean, percentiles[1], percentiles[6], percentiles[11])
+
+    # Monte Carlo standard errors of summary(): sd/sqrt(n) for the mean, and for a percentile q
+    # the distribution-free one, the width of the values between the q -/+ ERROR_Z*sqrt(q(1-q)/n)
+    # quantiles over 2*ERROR_Z. Both treat the scenarios as independent draws, so they overstate
+    # the error of the stratified samplers.
+    def summary_errors(self):
+        n = self.count
+        q = np.array([SCENARIO_RANGES[1], SCENARIO_RANGES[6], SCENARIO_RANGES[11]])/100
+        spread = ERROR_Z*np.sqrt(q*(1 - q)/n)
+        lower = self.sketch.percentile(100*np.clip(q - spread, 0, 1))
+        upper = self.sketch.percentile(100*np.clip(q + spread, 0, 1))
+        return (np.sqrt(self.moments.variance/n),) + tuple((upper - lower)/(2*ERROR_Z))
+
+
+# Proxy sets of every model, read the way the notebooks read them
+def load_models(input_dir='input_data'):
+    return {'sentience': sent_engine.load_models(input_dir), 'wr': wr_engine.load_models(input_dir)}
+
+
+# Priors of one chunk (sentience_priors.simulate_priors), the assumed shrimp prior included; only
+# those of `species_list` when it is given
+def sample_priors(seed, first_scenario, n_scenarios, sampler=sampling.RANDOM, species_list=None):
+    if species_list is None:
+        species_list = sentience_priors.species_lst + ['shrimp']
+    return sentience_priors.simulate_priors(sentience_priors.priors_distributions, n_scenarios, seed, sampler, \
+        species_list, first_scenario)
+
+
+def _accumulator(accumulators, key):
+    if key not in accumulators:
+        accumulators[key] = SummaryAccumulator()
+    return accumulators[key]
+
+
+# Runs one chunk into `accumulators` and adds the seconds spent per (stage, species) to `timings`
+def _run_chunk(first_scenario, n_scenarios, config, accumulators, timings):
+    s_params, wr_params = config['s_params'], config['wr_params']
+    inputs, models = config['inputs'], config['models']
+
+    def simulate_sentience(species):
+        with instrumentation.timed(timings, ('sentience simulate', species)):
+            simulate = sent_simulate.simulate_packed_species if config.get('packed') else sent_simulate.simulate_species
+            return simulate(inputs['sent_judgments'], species, config['s_unknowns'][species], \
+                s_params['WEIGHT_NOS'], s_params['HC_WEIGHT'], n_scenarios, hc_proxies=inputs['sent_hc_proxies'], \
+                seed=s_params['SEED'], first_scenario=first_scenario, sampler=sampling.sampler_of(s_params))
+
+    with instrumentation.timed(timings, ('priors', '')):
+        priors = sample_priors(s_params['SEED'], first_scenario, n_scenarios, sampling.sampler_of(s_params))
+    for species in sentience_priors.species_lst:
+        _accumulator(accumulators, ('priors', None, species)).update(priors[species])
+
+    so_proxies, so_scores = simulate_sentience(sent_engine.SOMETIMES_OPERATES)
+    so_model_sums, so_birch_sums = sent_engine.sentience_sums(so_scores, so_proxies, models['sentience'])
+    so_birch_overall = sent_engine.birch_overall(so_birch_sums)
+
+    def welfare_ranges(species, psent, sent_scores=None):
+        with instrumentation.timed(timings, ('welfare ranges simulate', species)):
+            simulate = wr_simulate.simulate_packed_species if config.get('packed') else wr_simulate.simulate_species
+            proxies, scores = simulate(inputs['wr_judgments'], species, config['wr_unknowns'][species], \
+                wr_params['WEIGHT_NOS'], wr_params['HC_WEIGHT'], n_scenarios, sent_scores=sent_scores, \
+                hc_proxies=inputs['wr_hc_proxies'], sent_hc_proxies=inputs['sent_hc_proxies'], \
+                overlap_dict=inputs['overlap_dict'], seed=wr_params['SEED'], first_scenario=first_scenario, \
+                sampler=sampling.sampler_of(wr_params))
+        with instrumentation.timed(timings, ('welfare range models', species)):
+            for model_name, welfare_range in wr_engine.welfare_ranges(scores, proxies, models['wr'], wr_params['HC_WEIGHT'], \
+                    wr_engine.WR_FFF[species]).items():
+                _accumulator(accumulators, ('wr', model_name, species)).update(welfare_range)
+                if psent is not None:
+                    adj_wr = np.maximum(psent*welfare_range, 0)
+                    _accumulator(accumulators, ('adjusted', model_name, species)).update(adj_wr)
+
+    # Each species' welfare ranges are evaluated as soon as its sentience scores exist, so only
+    # one species' scores are ever held
+    for species in config['sent_species']:
+        if species == sent_engine.SOMETIMES_OPERATES:
+            continue
+        proxies, scores = simulate_sentience(species)
+        psent = None
+        if species in priors:
+            with instrumentation.timed(timings, ('sentience models', species)):
+                model_sums, birch_sums = sent_engine.sentience_sums(scores, proxies, models['sentience'])
+                for model_name, species_sum in model_sums.items():
+                    p_sentience = sent_engine.posterior(priors[species], species_sum, so_model_sums[model_name])
+                    _accumulator(accumulators, ('sentience', model_name, species)).update(p_sentience)
+                    if model_name == sent_engine.HV1_MODEL:
+                        psent = p_sentience
+                birch_overall = sent_engine.posterior(priors[species], sent_engine.birch_overall(birch_sums), so_birch_overall)
+                _accumulator(accumulators, ('birch', 'overall', species)).update(birch_overall)
+                for criterion, criterion_sum in birch_sums.items():
+                    _accumulator(accumulators, ('birch', criterion, species)).update(criterion_sum)
+        if species in config['wr_species']:
+            welfare_ranges(species, psent, scores if config.get('packed') else score_store.ScoreStore(scores, proxies))
+
+    for species in config['wr_species']:
+        if species not in config['sent_species']:
+            welfare_ranges(species, priors['shrimp'] if species == 'shrimp' else None)
+
+
+def _run_chunks(chunks, config, progress=None):
+    accumulators, timings = {}, {}
+    for first_scenario, n_scenarios in chunks:
+        _run_chunk(first_scenario, n_scenarios, config, accumulators, timings)
+        if progress is not None:
+            progress(first_scenario + n_scenarios)
+    return accumulators, timings, instrumentation.peak_rss_mb()
+
+
+def merge_accumulators(accumulators, others):
+    for key, accumulator in others.items():
+        if key in accumulators:
+            accumulators[key].merge(accumulator)
+        else:
+            accumulators[key] = accumulator
+    return accumulators
+
+
+# '#1_high value proxies' P(sentience) of every species in `species_list` over one chunk, with
+# only that model's proxies simulated (every proxy has its own streams, so these are the draws
+# of the full run); shrimp get their assumed P(sentience), the shrimp prior
+def _hv1_p_sentience(first_scenario, n_scenarios, s_params, s_unknowns, species_list, inputs, models):
+    sampler = sampling.sampler_of(s_params)
+    hv1_models = {'models': {sent_engine.HV1_MODEL: models['models'][sent_engine.HV1_MODEL]}, 'birch': {}}
+    hv1_proxies = [proxy for proxy in inputs['sent_judgments'].proxies if proxy in hv1_models['models'][sent_engine.HV1_MODEL]]
+
+    def hv1_sum(species):
+        proxies, scores = sent_simulate.simulate_species(inputs['sent_judgments'], species, s_unknowns[species], \
+            s_params['WEIGHT_NOS'], s_params['HC_WEIGHT'], n_scenarios, hc_proxies=inputs['sent_hc_proxies'], \
+            seed=s_params['SEED'], first_scenario=first_scenario, proxy_subset=hv1_proxies, sampler=sampler)
+        return sent_engine.sentience_sums(scores, proxies, hv1_models)[0][sent_engine.HV1_MODEL]
+
+    priors = sample_priors(s_params['SEED'], first_scenario, n_scenarios, sampler, species_list)
+    so_sum = hv1_sum(sent_engine.SOMETIMES_OPERATES)
+    return {species: priors[species] if species == 'shrimp' else \
+        sent_engine.posterior(priors[species], hv1_sum(species), so_sum) for species in species_list}
+
+
+# Adds the Mixture models (MIXTURES) of a finished run to its accumulators, as wr_models.ipynb
+# computes them: each mixture is fitted to the run's 5th/95th percentiles of every model and
+# sampled once per scenario from the notebook's generator, then adjusted scenario by scenario by
+# the '#1_high value proxies' P(sentience), which is simulated again chunk by chunk. One species'
+# mixture draws (one value per scenario) are held at a time.
+def add_mixtures(accumulators, s_params, wr_params, s_unknowns, chunk_size=CHUNK_SIZE, inputs=None, models=None):
+    if inputs is None:
+        inputs = pipeline.load_inputs()
+    if models is None:
+        models = load_models()
+    wr_species = [species for species in pipeline.WR_SPECIES \
+        if all(('wr', model_name, species) in accumulators for model_name in wr_engine.WR_MODELS)]
+    if not wr_species:
+        return accumulators
+    model_stats = {model_name: summary_frame(accumulators, 'wr', model_name, wr_species, sort=False) \
+        for model_name in wr_engine.WR_MODELS}
+    lowers, uppers = wr_engine.mixture_bounds(model_stats, wr_engine.WR_MODELS, wr_species)
+    rngs = {mixture_name: random_streams.stage_generator(wr_params['SEED'], 'mixture', mixture_name) for mixture_name in MIXTURES}
+
+    # The mixtures draw species by species from one generator each, as the notebook does for all at once
+    for ii, species in enumerate(wr_species):
+        n_scenarios = accumulators[('wr', wr_engine.WR_MODELS[0], species)].count
+        samples = {}
+        for mixture_name, (file_name, neuron_count) in MIXTURES.items():
+            n_components = len(wr_engine.WR_MODELS) + neuron_count
+            constants = [wr_engine.NEURON_COUNTS[species]] if neuron_count else None
+            samples[mixture_name] = wr_engine.sample_fitted_mixture(lowers[ii:ii + 1], uppers[ii:ii + 1], wr_engine.WR_MODELS, \
+                [1/n_components]*n_components, n_scenarios, rngs[mixture_name], constants, \
+                sampler=sampling.sampler_of(wr_params))[0]
+            _accumulator(accumulators, ('wr', mixture_name, species)).update(samples[mixture_name])
+
+        if ('adjusted', wr_engine.WR_MODELS[0], species) not in accumulators:
+            continue
+        for first_scenario in range(0, n_scenarios, chunk_size):
+            n_chunk = min(chunk_size, n_scenarios - first_scenario)
+            psent = _hv1_p_sentience(first_scenario, n_chunk, s_params, s_unknowns, [species], inputs, \
+                models['sentience'])[species]
+            for mixture_name, mixture_samples in samples.items():
+                _accumulator(accumulators, ('adjusted', mixture_name, species)).update( \
+                    wr_engine.adjusted_welfare_ranges(mixture_samples[first_scenario:first_scenario + n_chunk], psent))
+    return accumulators
+
+
+# Runs `n_scenarios` scenarios through every model and returns the {(stage, model, species):
+# SummaryAccumulator} of the run. With workers > 1 the chunks are split between processes and
+# their accumulators merged; the draws are the seeded per-block streams either way. Progress
+# and the seconds spent per stage and species go to `metrics` (printed when `verbose` by default).
+# With shards > 1 only the scenarios of shard `shard` (random_streams.shard_range) are run; the
+# shards need the parameters' seeds so their accumulators can be merged (merge_shard_files).
+# With `packed` the scores are held as presence bits and the model sums are read from per-byte
+# lookup tables (packed_scores.py), which draws the same scenarios with far less memory per
+# scenario at somewhat slower welfare range sums.
+# With `mixtures`, an unsharded run also gets the Mixture models (add_mixtures); a sharded one
+# gets them when its shards are merged.
+def run_streaming(s_params, wr_params, s_unknowns, wr_unknowns, n_scenarios=None, sent_species=pipeline.SENT_SPECIES, \
+        wr_species=pipeline.WR_SPECIES, chunk_size=CHUNK_SIZE, workers=1, inputs=None, models=None, verbose=True, \
+        metrics=None, shard=0, shards=1, packed=False, mixtures=True):
+    if metrics is None:
+        metrics = instrumentation.default_metrics(verbose)
+    if chunk_size % random_streams.STREAM_BLOCK != 0:
+        raise ValueError('chunk_size must be a multiple of {}'.format(random_streams.STREAM_BLOCK))
+    if n_scenarios is None:
+        n_scenarios = s_params['N_SCENARIOS']
+    missing = [species for species in wr_species if species in wr_simulate.SENT_SPECIES and species not in sent_species]
+    if missing:
+        raise ValueError('welfare ranges of {} need their sentience scores in the same run'.format(missing))
+    s_params, wr_params = dict(s_params), dict(wr_params)
+    for params in [s_params, wr_params]:
+        if params.get('SEED') is None:
+            if shards > 1:
+                raise ValueError('A sharded run needs the SEED of both stages, so every shard draws from the same streams')
+            params['SEED'] = random_streams.new_root_seed()
+
+    config = {'s_params': s_params, 'wr_params': wr_params, 's_unknowns': s_unknowns, 'wr_unknowns': wr_unknowns, \
+        'sent_species': sent_species, 'wr_species': wr_species, 'packed': packed, \
+        'inputs': inputs if inputs is not None else pipeline.load_inputs(), \
+        'models': models if models is not None else load_models()}
+
+    first_scenario, n_shard = random_streams.shard_range(n_scenarios, shard, shards)
+    chunks = [(first_scenario + start, min(chunk_size, n_shard - start)) for start in range(0, n_shard, chunk_size)]
+    start_time = time.time()
+
+    def progress(done):
+        seconds = time.time() - start_time
+        done = done - first_scenario
+        metrics.progress('streaming', done, n_shard, '... Completed {}/{} scenarios ({:.1f}s)'.format(done, n_shard, \
+            seconds), seconds=seconds)
+
+    if workers <= 1 or len(chunks) <= 1:
+        accumulators, timings, peak_rss = _run_chunks(chunks, config, progress)
+    else:
+        groups = [chunks[ii::workers] for ii in range(workers)]
+        accumulators, timings, peak_rss = {}, {}, None
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for result, worker_timings, worker_rss in pool.map(_run_chunks, [group for group in groups if group], \
+                    [config]*workers):
+                merge_accumulators(accumulators, result)
+                for key, seconds in worker_timings.items():
+                    timings[key] = timings.get(key, 0) + seconds
+                if worker_rss is not None:
+                    peak_rss = max(peak_rss or 0, worker_rss)
+        progress(first_scenario + n_shard)
+
+    if mixtures and shards == 1:
+        with instrumentation.timed(timings, ('mixtures', '')):
+            add_mixtures(accumulators, s_params, wr_params, s_unknowns, chunk_size, config['inputs'], \
+                config['models'])
+
+    # Stage seconds are summed over workers, so with workers > 1 they are CPU-side, not wall, time
+    for (stage, species), seconds in sorted(timings.items()):
+        metrics.stage_done(stage, seconds, n_shard, species=species, peak_rss_mb=peak_rss)
+    metrics.stage_done('streaming', time.time() - start_time, n_shard, workers=workers, shard=shard, shards=shards, \
+        peak_rss_mb=max(peak_rss or 0, instrumentation.peak_rss_mb() or 0))
+    return accumulators
+
+
+# Writes the accumulators of one shard with what merge_shard_files checks them against: the
+# shard, the scenarios it covers and the seeds it drew from
+def write_shard(accumulators, path, shard, shards, n_scenarios, s_params, wr_params):
+    first_scenario, n_shard = random_streams.shard_range(n_scenarios, shard, shards)
+    partial = {'shard': shard, 'shards': shards, 'first_scenario': first_scenario, 'n_scenarios': n_shard, \
+        'total_scenarios': n_scenarios, 'seeds': [s_params['SEED'], wr_params['SEED']], \
+        'samplers': [sampling.sampler_of(s_params), sampling.sampler_of(wr_params)], 'accumulators': accumulators}
+    with open(path, 'wb') as f:
+        pickle.dump(partial, f)
+    return path
+
+
+# The merged accumulators of the shard files at `paths`, which have to be every shard of one
+# run. They are merged in shard order, whatever order the paths are given in.
+def merge_shard_files(paths):
+    partials = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            partials.append(pickle.load(f))
+    partials.sort(key=lambda partial: partial['shard'])
+
+    first = partials[0]
+    if [partial['shard'] for partial in partials] != list(range(first['shards'])):
+        raise ValueError('Expected shards 0 to {}, got {}'.format(first['shards'] - 1, \
+            [partial['shard'] for partial in partials]))
+    next_scenario = 0
+    for partial in partials:
+        for key in ['shards', 'total_scenarios', 'seeds', 'samplers']:
+            if partial.get(key) != first.get(key):
+                raise ValueError('Shards 0 and {} differ in {}: {!r} and {!r}'.format(partial['shard'], key, first.get(key), \
+                    partial.get(key)))
+        if partial['first_scenario'] != next_scenario:
+            raise ValueError('Shard {} starts at scenario {}, expected {}'.format(partial['shard'], \
+                partial['first_scenario'], next_scenario))
+        next_scenario += partial['n_scenarios']
+    if next_scenario != first['total_scenarios']:
+        raise ValueError('The shards cover {} of {} scenarios'.format(next_scenario, first['total_scenarios']))
+
+    accumulators = {}
+    for partial in partials:
+        merge_accumulators(accumulators, partial['accumulators'])
+    return accumulators
+
+
+# Copies of the parameters with the seeds and samplers the shard file at `path` drew from
+def shard_params(path, s_params, wr_params):
+    with open(path, 'rb') as f:
+        partial = pickle.load(f)
+    return [dict(params, SEED=seed, SAMPLER=sampler) for params, seed, sampler in \
+        zip([s_params, wr_params], partial['seeds'], partial['samplers'])]
+
+
+# With `errors`, every statistic is followed by its Monte Carlo standard error ("<column> SE")
+# and the last column is the number of scenarios behind the row
+def summary_frame(accumulators, stage, model_name, species_list, sort=True, errors=False):
+    means, fifth_percentiles, medians, ninty_fifth_percentiles = [], [], [], []
+    for species in species_list:
+        species_stats = accumulators[(stage, model_name, species)].summary()
+        means.append(round(species_stats[0],3))
+        fifth_percentiles.append(round(species_stats[1],3))
+        medians.append(round(species_stats[2],3))
+        ninty_fifth_percentiles.append(round(species_stats[3],3))
+
+    cols = ["Mean", "5th-pct", "50th-pct", "95th-pct"]
+    stats_df = pd.DataFrame(list(zip(means, fifth_percentiles, medians, ninty_fifth_percentiles)), \
+        columns=cols, index=species_list)
+    if errors:
+        species_errors = np.array([accumulators[(stage, model_name, species)].summary_errors() \
+            for species in species_list]).reshape(len(species_list), len(cols))
+        for jj, col in reversed(list(enumerate(cols))):
+            stats_df.insert(jj + 1, col + ' SE', species_errors[:, jj].round(4))
+        stats_df['Scenarios'] = [accumulators[(stage, model_name, species)].count for species in species_list]
+    if sort:
+        stats_df = stats_df.sort_values("50th-pct", ascending=False)
+    return stats_df
+
+
+# Writes the summary CSVs of the notebooks from the accumulators of a run (with `errors`, with
+# the standard error columns of summary_frame)
+def write_summaries(accumulators, output_root='', errors=False):
+    sent_dir = os.path.join(output_root, 'sentience_estimates')
+    birch_dir = os.path.join(output_root, 'birch_estimates')
+    wr_dir = os.path.join(output_root, 'welfare_range_estimates')
+    for path in [sent_dir, birch_dir, wr_dir]:
+        os.makedirs(path, exist_ok=True)
+    paths = []
+
+    def write(stats_df, path):
+        stats_df.to_csv(path, index_label="Species")
+        paths.append(path)
+
+    sent_species = [species for species in sentience_priors.species_lst if ('priors', None, species) in accumulators]
+    write(summary_frame(accumulators, 'priors', None, sent_species, errors=errors), \
+        os.path.join(sent_dir, "Priors Sentience Summary Statistics.csv"))
+    for model_name in sent_engine.SENT_MODELS:
+        write(summary_frame(accumulators, 'sentience', model_name, sent_species, errors=errors), \
+            os.path.join(sent_dir, "Sent {} Summary Statistics.csv".format(model_name)))
+
+    birch_species = [species for species in sent_species if ('birch', 'overall', species) in accumulators]
+    criteria = ['overall'] + [criterion for (stage, criterion, species) in accumulators \
+        if stage == 'birch' and species == birch_species[0] and criterion != 'overall']
+    for species in birch_species:
+        birch_df = pd.concat([summary_frame(accumulators, 'birch', criterion, [species], sort=False, errors=errors) \
+            for criterion in criteria])
+        birch_df.index = criteria
+        write(birch_df, os.path.join(birch_dir, "{}_birch_estimates.csv".format(species)))
+    write(summary_frame(accumulators, 'birch', 'overall', birch_species, errors=errors), \
+        os.path.join(sent_dir, "Sent {} Summary Statistics.csv".format("Birch Model")))
+
+    wr_species = [species for species in pipeline.WR_SPECIES if ('wr', wr_engine.WR_MODELS[0], species) in accumulators]
+    adj_species = [species for species in ADJ_WR_SPECIES if ('adjusted', wr_engine.WR_MODELS[0], species) in accumulators]
+    for model_name in wr_engine.WR_MODELS:
+        if model_name in wr_engine.WR_SIMPLE_MODELS:
+            path = os.path.join(wr_dir, "WR {} Summary Statistics.csv".format(model_name))
+        else:
+            path = os.path.join(wr_dir, "WR {} - Summary Statistics.csv".format(model_name))
+        write(summary_frame(accumulators, 'wr', model_name, wr_species, errors=errors), path)
+        write(summary_frame(accumulators, 'adjusted', model_name, adj_species, errors=errors), \
+            os.path.join(wr_dir, "Adjusted {} Welfare Ranges - Summary Statistics.csv".format(model_name)))
+    for mixture_name, (file_name, neuron_count) in MIXTURES.items():
+        mixture_species = [species for species in wr_species if ('wr', mixture_name, species) in accumulators]
+        if mixture_species:
+            write(summary_frame(accumulators, 'wr', mixture_name, mixture_species, errors=errors), \
+                os.path.join(wr_dir, "WR {} - Summary Statistics.csv".format(file_name)))
+        mixture_species = [species for species in adj_species if ('adjusted', mixture_name, species) in accumulators]
+        if mixture_species:
+            write(summary_frame(accumulators, 'adjusted', mixture_name, mixture_species, errors=errors), \
+                os.path.join(wr_dir, "Adjusted {} Welfare Ranges - Summary Statistics.csv".format(mixture_name)))
+    return paths
+
+
+# Writes every accumulator's mean, standard deviation and SCENARIO_RANGES percentiles to the
+# results file at `path`; with `errors`, also the standard errors of summary_errors and the
+# number of scenarios (results_store.ERROR_STATISTICS)
+def write_results(accumulators, path, errors=False):
+    with results_store.ResultsFile(path) as results:
+        for (stage, model_name, species), accumulator in accumulators.items():
+            statistics = [accumulator.moments.mean, np.sqrt(accumulator.moments.variance)] + \
+                list(accumulator.percentiles(results_store.SCENARIO_RANGES))
+            results.add(stage, model_name, species, statistics)
+            if errors:
+                results.add(stage, model_name, species, list(accumulator.summary_errors()) + [accumulator.count], \
+                    names=results_store.ERROR_STATISTICS)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stream scenarios through every model and write the summary statistics')
+    parser.add_argument('--scenarios', type=int, help='How many Monte Carlo simulations to run? Defaults to the stored number', default=None)
+    parser.add_argument('--chunk_size', type=int, help='How many scenarios to hold in memory at once?', default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, help='How many worker processes to use?', default=1)
+    parser.add_argument('--output_root', type=str, help='Directory to write the results file and *_estimates folders into', default='')
+    parser.add_argument('--no_csv', action='store_true', help='Only write the results file, not the per-model summary CSVs')
+    parser.add_argument('--metrics', type=str, help='JSON lines file for progress and timing events; defaults to metrics.jsonl in the output root', default=None)
+    parser.add_argument('--shard', type=int, help='Which shard (from 0) of the scenarios to run', default=0)
+    parser.add_argument('--shards', type=int, help='Split the scenarios into this many shards; a shard only writes its partial accumulators', default=1)
+    parser.add_argument('--merge', type=str, nargs='+', help='Merge these shard files and write the summaries instead of running', default=None)
+    parser.add_argument('--sampler', type=str, choices=sampling.SAMPLERS, help='Override the stored sampler (SAMPLER) of the uniforms behind every draw', default=None)
+    parser.add_argument('--packed', action='store_true', help='Hold the scores as presence bits to save memory; the welfare range model sums are slower')
+    args = parser.parse_args()
+
+    s_params = pickle.load(open(os.path.join('input_data', 'Sentience Parameters.p'), 'rb'))
+    wr_params = pickle.load(open(os.path.join('input_data', 'Welfare Range Parameters.p'), 'rb'))
+    s_unknowns = pickle.load(open(os.path.join('input_data', 'Sentience Unknown Probabilities.p'), 'rb'))
+    wr_unknowns = pickle.load(open(os.path.join('input_data', 'Welfare Range Unknown Probabilities.p'), 'rb'))
+    if args.sampler is not None:
+        s_params['SAMPLER'] = args.sampler
+        wr_params['SAMPLER'] = args.sampler
+
+    if args.output_root:
+        os.makedirs(args.output_root, exist_ok=True)
+    metrics_path = args.metrics if args.metrics is not None else os.path.join(args.output_root, instrumentation.METRICS_FILE)
+    with instrumentation.default_metrics(path=metrics_path) as metrics:
+        if args.merge is not None:
+            with metrics.stage('merge'):
+                accumulators = merge_shard_files(args.merge)
+            with metrics.stage('mixtures'):
+                s_params, wr_params = shard_params(args.merge[0], s_params, wr_params)
+                add_mixtures(accumulators, s_params, wr_params, s_unknowns, args.chunk_size)
+        else:
+            accumulators = run_streaming(s_params, wr_params, s_unknowns, wr_unknowns, n_scenarios=args.scenarios, \
+                chunk_size=args.chunk_size, workers=args.workers, metrics=metrics, shard=args.shard, shards=args.shards, \
+                packed=args.packed)
+        if args.shards > 1 and args.merge is None:
+            with metrics.stage('write') as extra:
+                n_scenarios = args.scenarios if args.scenarios is not None else s_params['N_SCENARIOS']
+                path = write_shard(accumulators, os.path.join(args.output_root, SHARD_FILE.format(args.shard, args.shards)), \
+                    args.shard, args.shards, n_scenarios, s_params, wr_params)
+                print('... Wrote {}'.format(path))
+                extra['bytes_written'] = instrumentation.bytes_written([path])
+            return
+        with metrics.stage('write') as extra:
+            paths = [write_results(accumulators, os.path.join(args.output_root, results_store.RESULTS_FILE))]
+            print('... Wrote {}'.format(paths[0]))
+            if not args.no_csv:
+                summary_paths = write_summaries(accumulators, args.output_root)
+                print('... Wrote {} summary files'.format(len(summary_paths)))
+                paths += summary_paths
+            extra['bytes_written'] = instrumentation.bytes_written(paths)
+
+if __name__ == '__main__':
+    main()
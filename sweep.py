@@ -0,0 +1,246 @@
+## Sensitivity sweeps over the model assumptions with common random numbers
+# Every simulated score is a function of two uniforms per (scenario, proxy) and the user inputs:
+# the unknown probability and WEIGHT_NO only move the presence bounds, and HC_WEIGHT only
+# rescales the high-confidence proxies. A sweep draws the uniforms once from the run's seeded
+# streams and evaluates every parameter point against them. Presence is computed once per
+# distinct (WEIGHT_NO, unknown probability), and each masked sum is split into its unweighted
+# and high-confidence parts, so an HC_WEIGHT point only costs sums = s0 + hc_weight*s1.
+import os
+import time
+import pickle
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+import random_streams
+import sampling
+import sent_simulate
+import wr_simulate
+import sent_engine
+import wr_engine
+import streaming
+import pipeline
+
+SUMMARY_COLUMNS = ["Mean", "5th-pct", "50th-pct", "95th-pct"]
+POINT_COLUMNS = ['point', 'HC_WEIGHT', 'WEIGHT_NOS', 'UNKNOWN_PROB']
+SWEEP_COLUMNS = POINT_COLUMNS + ['stage', 'model', 'species'] + SUMMARY_COLUMNS
+
+
+# Every combination of the given settings. An entry of `unknown_probs` is either one
+# probability for all species or a {species: probability} dict (missing species get 0).
+def sweep_grid(hc_weights, weight_nos=('Yes',), unknown_probs=(0,)):
+    points = []
+    for hc_weight, weight_no, unknown_prob in itertools.product(hc_weights, weight_nos, unknown_probs):
+        points.append({'HC_WEIGHT': float(hc_weight), 'WEIGHT_NOS': weight_no, 'UNKNOWNS': unknown_prob})
+    return points
+
+
+def unknown_prob(point, species):
+    if isinstance(point['UNKNOWNS'], dict):
+        return point['UNKNOWNS'].get(species, 0)
+    return point['UNKNOWNS']
+
+
+def presence_key(point, species):
+    return (point['WEIGHT_NOS'], unknown_prob(point, species))
+
+
+# Rows of [mean, 5th, 50th, 95th percentile] for a (distributions, scenarios) array, in one pass
+def summaries(values):
+    return wr_engine.summary_stats(values)
+
+
+# The uniforms behind one species' presence draws, taken from the same per-block streams as a run
+def stage_uniforms(seed, stage, species, n_scenarios, proxies, sampler=sampling.RANDOM):
+    u_prob = np.empty((n_scenarios, len(proxies)), order='F')
+    u_draw = np.empty((n_scenarios, len(proxies)), order='F')
+    for block, start, stop in random_streams.stream_blocks(n_scenarios):
+        u_prob[start:stop], u_draw[start:stop] = sent_simulate.proxy_uniforms(seed, stage, species, proxies, block, \
+            stop - start, sampler)
+    return u_prob, u_draw
+
+
+# (unweighted, high-confidence) parts of the masked sums of a presence matrix
+def split_hc_sums(presence, masks, is_hc):
+    presence = np.asarray(presence, dtype=float)
+    return presence @ (masks*(1 - is_hc)[:, None]), presence @ (masks*is_hc[:, None])
+
+
+# Per-key cache of one species' presence and split sums, filled as parameter points need them
+class SpeciesDraws:
+    def __init__(self, judgments, species, prob_map, uniforms, masks, is_hc, overlap=None):
+        self.judgments, self.species, self.prob_map = judgments, species, prob_map
+        self.uniforms, self.masks, self.is_hc = uniforms, masks, is_hc
+        self.overlap = overlap
+        self.presence, self.sums = {}, {}
+
+    def get_presence(self, key):
+        if key not in self.presence:
+            weight_no, unknown = key
+            lower, upper = sent_simulate.judgment_bounds(self.judgments, self.prob_map(weight_no, unknown))
+            presence = sent_simulate.presence_from_uniforms(lower, upper, *self.uniforms)
+            if self.overlap is not None:
+                presence = self.overlap(presence, key)
+            self.presence[key] = presence
+        return self.presence[key]
+
+    def get_sums(self, key, hc_weight):
+        if key not in self.sums:
+            self.sums[key] = split_hc_sums(self.get_presence(key), self.masks, self.is_hc)
+        unweighted, hc_part = self.sums[key]
+        return unweighted + hc_weight*hc_part
+
+
+def _sentience_draws(inputs, models, species, seed, n_scenarios, sampler=sampling.RANDOM):
+    judgments = inputs['sent_judgments']
+    proxies = judgments.proxies
+    terms, masks = sent_engine.model_terms(proxies, models['sentience'])
+    is_hc = sent_engine.proxy_mask(proxies, inputs['sent_hc_proxies'])
+    uniforms = stage_uniforms(seed, 'sentience', species, n_scenarios, proxies, sampler)
+    return terms, proxies, SpeciesDraws(judgments.species_codes(species), species, sent_simulate.get_judgment_prob_map, \
+        uniforms, masks, is_hc)
+
+
+# An overlap proxy's welfare range score is hc_weight (if it is high-confidence) times the mean
+# presence of its linked sentience proxies, whichever of them are high-confidence
+def _wr_draws(inputs, models, species, seed, n_scenarios, sent_draws=None, sampler=sampling.RANDOM):
+    judgments = inputs['wr_judgments']
+    proxies = judgments.proxies
+    if sent_draws is not None:
+        is_overlap = np.array([proxy in inputs['overlap_dict'] for proxy in proxies])
+    else:
+        is_overlap = np.zeros(len(proxies), dtype=bool)
+    drawn_idx = np.flatnonzero(~is_overlap)
+    overlap_idx = np.flatnonzero(is_overlap)
+
+    terms, masks, human_sums, divisors = wr_engine.model_terms(proxies, models['wr'], 1)
+    is_hc = wr_engine.proxy_mask(proxies, inputs['wr_hc_proxies'])
+    uniforms = stage_uniforms(seed, 'welfare ranges', species, n_scenarios, [proxies[ii] for ii in drawn_idx], \
+        sampler)
+
+    overlap = None
+    if len(overlap_idx) > 0:
+        overlap_proxies = [proxies[ii] for ii in overlap_idx]
+        sent_proxies, overlap_weights = wr_simulate.overlap_weight_matrix(overlap_proxies, inputs['overlap_dict'], \
+            inputs['wr_hc_proxies'], inputs['sent_hc_proxies'], 1)
+        sent_columns = inputs['sent_judgments'].proxies
+        sent_idx = [sent_columns.index(sent_proxy) for sent_proxy in sent_proxies]
+
+        def overlap(drawn_presence, key):
+            presence = np.empty((n_scenarios, len(proxies)))
+            presence[:, drawn_idx] = drawn_presence
+            sent_presence = np.asarray(sent_draws.get_presence(key)[:, sent_idx], dtype=float)
+            presence[:, overlap_idx] = overlap_weights.dot(sent_presence.T).T
+            return presence
+
+    draws = SpeciesDraws(judgments.species_codes(species)[drawn_idx], species, wr_simulate.get_judgment_prob_map, \
+        uniforms, masks, is_hc, overlap)
+    return terms, proxies, draws
+
+
+# Evaluates every parameter point on the same draws and returns the tidy
+# (point x stage x model x species) table of summary statistics. The seeds and samplers, and with
+# them the draws, are those of `s_params` and `wr_params`; the points replace their other settings.
+def run_sweep(points, s_params, wr_params, n_scenarios=None, sent_species=pipeline.SENT_SPECIES, \
+        wr_species=pipeline.WR_SPECIES, inputs=None, models=None, verbose=True):
+    if n_scenarios is None:
+        n_scenarios = s_params['N_SCENARIOS']
+    missing = [species for species in wr_species if species in wr_simulate.SENT_SPECIES and species not in sent_species]
+    if missing:
+        raise ValueError('welfare ranges of {} need their sentience scores in the same sweep'.format(missing))
+    if inputs is None:
+        inputs = pipeline.load_inputs()
+    if models is None:
+        models = streaming.load_models()
+    s_seed = s_params.get('SEED')
+    wr_seed = wr_params.get('SEED')
+    if s_seed is None or wr_seed is None:
+        raise ValueError('a sweep needs seeded parameters (SEED) so that every point sees the same draws')
+    s_sampler, wr_sampler = sampling.sampler_of(s_params), sampling.sampler_of(wr_params)
+
+    start_time = time.time()
+    rows = []
+
+    # entries are (stage, model, values) of one species at one point
+    def record(ii, point, species, entries):
+        stats = summaries(np.stack([values for stage, model_name, values in entries]))
+        for (stage, model_name, values), species_stats in zip(entries, stats):
+            rows.append([ii, point['HC_WEIGHT'], point['WEIGHT_NOS'], unknown_prob(point, species), \
+                stage, model_name, species] + species_stats.tolist())
+
+    priors = streaming.sample_priors(s_seed, 0, n_scenarios, s_sampler)
+    sent_terms, sent_proxies, so_draws = _sentience_draws(inputs, models, sent_engine.SOMETIMES_OPERATES, s_seed, n_scenarios, \
+        s_sampler)
+
+    def welfare_ranges(species, psents, sent_draws=None):
+        terms, proxies, draws = _wr_draws(inputs, models, species, wr_seed, n_scenarios, sent_draws, wr_sampler)
+        for ii, point in enumerate(points):
+            terms, masks, human_sums, divisors = wr_engine.model_terms(proxies, models['wr'], point['HC_WEIGHT'])
+            sums = draws.get_sums(presence_key(point, species), point['HC_WEIGHT'])
+            results = wr_engine.term_welfare_ranges(sums, terms, human_sums, divisors, models['wr'], \
+                wr_engine.WR_FFF[species])
+            entries = [('wr', model_name, welfare_range) for model_name, welfare_range in results.items()]
+            if psents is not None:
+                entries += [('adjusted', model_name, np.maximum(psents[ii]*welfare_range, 0)) \
+                    for model_name, welfare_range in results.items()]
+            record(ii, point, species, entries)
+
+    for species in sent_species:
+        if species == sent_engine.SOMETIMES_OPERATES:
+            continue
+        terms, proxies, draws = _sentience_draws(inputs, models, species, s_seed, n_scenarios, s_sampler)
+        psents = None
+        if species in priors:
+            psents = []
+            for ii, point in enumerate(points):
+                so_model_sums, so_birch_sums = sent_engine.split_sums(sent_terms, \
+                    so_draws.get_sums(presence_key(point, sent_engine.SOMETIMES_OPERATES), point['HC_WEIGHT']))
+                model_sums, birch_sums = sent_engine.split_sums(terms, draws.get_sums(presence_key(point, species), \
+                    point['HC_WEIGHT']))
+                p_sentience = {model_name: sent_engine.posterior(priors[species], species_sum, so_model_sums[model_name]) \
+                    for model_name, species_sum in model_sums.items()}
+                birch_overall = sent_engine.posterior(priors[species], sent_engine.birch_overall(birch_sums), \
+                    sent_engine.birch_overall(so_birch_sums))
+                psents.append(p_sentience[sent_engine.HV1_MODEL])
+                entries = [('sentience', model_name, values) for model_name, values in p_sentience.items()]
+                entries.append(('birch', sent_engine.BIRCH_OVERALL, birch_overall))
+                record(ii, point, species, entries)
+        if species in wr_species:
+            welfare_ranges(species, psents, draws)
+        if verbose:
+            print('... {} done ({:.1f}s)'.format(species, time.time() - start_time))
+
+    for species in wr_species:
+        if species not in sent_species:
+            welfare_ranges(species, [priors['shrimp']]*len(points) if species == 'shrimp' else None)
+            if verbose:
+                print('... {} done ({:.1f}s)'.format(species, time.time() - start_time))
+
+    return pd.DataFrame(rows, columns=SWEEP_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate a grid of model assumptions on one set of random draws')
+    parser.add_argument('--hc_weights', type=float, nargs='+', help='HC_WEIGHT values to sweep', default=[5.0])
+    parser.add_argument('--weight_nos', type=str, nargs='+', help="WEIGHT_NOS values to sweep (Yes/No)", default=['Yes'])
+    parser.add_argument('--unknown_probs', type=float, nargs='+', help='Unknown probabilities to sweep, applied to every species', default=[0.0])
+    parser.add_argument('--scenarios', type=int, help='How many Monte Carlo simulations to run? Defaults to the stored number', default=None)
+    parser.add_argument('--output', type=str, help='Where to write the sweep table', default='Sensitivity Sweep.csv')
+    args = parser.parse_args()
+
+    s_params = pickle.load(open(os.path.join('input_data', 'Sentience Parameters.p'), 'rb'))
+    wr_params = pickle.load(open(os.path.join('input_data', 'Welfare Range Parameters.p'), 'rb'))
+    for params in [s_params, wr_params]:
+        if params.get('SEED') is None:
+            params['SEED'] = random_streams.new_root_seed()
+
+    points = sweep_grid(args.hc_weights, args.weight_nos, args.unknown_probs)
+    sweep_df = run_sweep(points, s_params, wr_params, n_scenarios=args.scenarios)
+    sweep_df.to_csv(args.output, index=False)
+    print('... Wrote {} rows for {} parameter points to {}'.format(len(sweep_df), len(points), args.output))
+
+
+if __name__ == '__main__':
+    main()
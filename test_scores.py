@@ -0,0 +1,166 @@
+## tests for the packed scores, the exact welfare range sums, the incremental score stores and
+## the judgment index cache
+# Run with pytest from any directory; the tests that need input_data read it from the repository.
+import os
+import csv
+import shutil
+import itertools
+
+import numpy as np
+import pytest
+
+import exact
+import incremental
+import judgment_index
+import packed_scores
+import pipeline
+import score_store
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+
+
+# Packed sums equal those of the dense score matrix: weighted drawn proxies over two 64-bit words
+# (75 bits, not a multiple of 8) plus a shared part whose coefficients average other bits, as
+# the overlap proxies do
+def test_packed_matmul_equals_dense():
+    rng = np.random.default_rng(1)
+    n_scenarios, n_drawn, n_sent, n_overlap = 1000, 75, 13, 4
+    proxies = ['proxy {}'.format(ii) for ii in range(n_drawn + n_overlap)]
+    drawn = rng.random((n_scenarios, n_drawn)) < 0.4
+    sent = rng.random((n_scenarios + 200, n_sent)) < 0.6
+    weights = np.where(rng.random(n_drawn) < 0.3, 5.0, 1.0)
+
+    drawn_coefficients = np.zeros((n_drawn, len(proxies)))
+    drawn_coefficients[:, :n_drawn] = np.diag(weights)
+    sent_coefficients = np.zeros((n_sent, len(proxies)))
+    sent_coefficients[:, n_drawn:] = rng.random((n_sent, n_overlap))*(rng.random((n_sent, n_overlap)) < 0.5)
+    sent_bits = packed_scores.pack_rows(sent)[:n_scenarios]
+    packed = packed_scores.PackedScores([(packed_scores.pack_rows(drawn), drawn_coefficients), \
+        (sent_bits, sent_coefficients)], proxies, n_scenarios)
+    dense = drawn @ drawn_coefficients + sent[:n_scenarios] @ sent_coefficients
+
+    assert packed.shape == dense.shape
+    np.testing.assert_allclose(packed.unpack(), dense, rtol=1e-12)
+    masks = (rng.random((len(proxies), 6)) < 0.5)*rng.choice([1.0, 0.5, 2.0], (len(proxies), 6))
+    np.testing.assert_allclose(packed @ masks, dense @ masks, rtol=1e-12)
+    np.testing.assert_allclose(packed @ masks[:, 0], dense @ masks[:, 0], rtol=1e-12)
+    np.testing.assert_allclose(packed[proxies[77]], dense[:, 77], rtol=1e-12)
+    assert proxies[0] in packed and 'other' not in packed
+
+
+def test_packed_from_presence():
+    rng = np.random.default_rng(2)
+    presence = rng.random((500, 70)) < 0.5
+    weights = np.where(rng.random(70) < 0.2, 5.0, 1.0)
+    packed = packed_scores.PackedScores.from_presence(presence, range(70), weights)
+    np.testing.assert_array_equal(packed_scores.unpack_rows(packed_scores.pack_rows(presence), 70), presence)
+    masks = (rng.random((70, 3)) < 0.5).astype(float)
+    np.testing.assert_allclose(packed @ masks, (presence*weights) @ masks, rtol=1e-12)
+
+
+# The exact distribution of a weighted Bernoulli sum is the one found by enumerating every outcome,
+# with zero coefficients, certain and impossible Bernoullis and repeated sums among them
+def test_weighted_bernoulli_sum_matches_enumeration():
+    coefficients = np.array([1.0, 5.0, 1.0, 0.5, 0.0, 2.5, 1.0, 5.0, 0.1, 0.2])
+    probabilities = np.array([0.3, 0.8, 0.5, 1.0, 0.6, 0.0, 0.25, 0.45, 0.7, 0.35])
+    expected = {}
+    for outcome in itertools.product([0, 1], repeat=len(coefficients)):
+        outcome = np.array(outcome)
+        probability = np.prod(np.where(outcome, probabilities, 1 - probabilities))
+        if probability > 0:
+            value = round(float(outcome @ coefficients), exact.DECIMALS)
+            expected[value] = expected.get(value, 0) + probability
+
+    values, probs = exact.weighted_bernoulli_sum(coefficients, probabilities)
+    assert np.all(np.diff(values) > 0)
+    np.testing.assert_allclose(values, sorted(expected), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(probs, [expected[value] for value in sorted(expected)], rtol=1e-12, atol=1e-15)
+
+
+# update_store simulates only the columns whose fingerprint changed and copies the others; an
+# up-to-date store is left alone, and a store of another length reuses nothing
+def test_update_store_reuses_matching_columns(tmp_path):
+    prefix = str(tmp_path / 'wr_pigs_')
+    proxies = ['a', 'b', 'c']
+    n_scenarios = 50
+    calls = []
+
+    # every call fills its columns with 10*call + column position
+    def simulate(stale):
+        calls.append(list(stale))
+        return stale, np.column_stack([np.full(n_scenarios, 10*len(calls) + proxies.index(proxy)) for proxy in stale])
+
+    fingerprints = {'a': '1', 'b': '2', 'c': '3'}
+    assert incremental.update_store(prefix, proxies, fingerprints, n_scenarios, simulate) == proxies
+    assert incremental.update_store(prefix, proxies, fingerprints, n_scenarios, simulate) == []
+    assert len(calls) == 1
+
+    fingerprints = dict(fingerprints, b='changed', c=None)
+    assert incremental.update_store(prefix, proxies, fingerprints, n_scenarios, simulate) == ['b', 'c']
+    store = score_store.load_scores(prefix)
+    assert store.header['fingerprints'] == fingerprints
+    for proxy, value in zip(proxies, [10, 21, 22]):
+        np.testing.assert_array_equal(store[proxy], value)
+    del store
+
+    n_scenarios = 60
+    assert incremental.update_store(prefix, proxies, {'a': '1', 'b': '2', 'c': '3'}, n_scenarios, simulate) == proxies
+
+
+# Changing one sentience column's fingerprint changes exactly the welfare range overlap columns
+# that average it
+def test_sentience_change_invalidates_overlap_columns():
+    inputs = pipeline.load_inputs()
+    wr_judgments, overlap_dict = inputs['wr_judgments'], inputs['overlap_dict']
+    sent_fingerprints = incremental.sentience_fingerprints(inputs['sent_judgments'], 'pigs', 0, 'Yes', 5.0, 100, \
+        inputs['sent_hc_proxies'], 1)
+
+    def wr_fingerprints(sent_fingerprints):
+        return incremental.wr_fingerprints(wr_judgments, 'pigs', 0, 'Yes', 5.0, 100, inputs['wr_hc_proxies'], \
+            inputs['sent_hc_proxies'], overlap_dict, 1, sent_fingerprints, has_sent_scores=True)
+
+    sent_proxy = overlap_dict[next(proxy for proxy in wr_judgments.proxies if proxy in overlap_dict)][0]
+    before = wr_fingerprints(sent_fingerprints)
+    after = wr_fingerprints(dict(sent_fingerprints, **{sent_proxy: 'changed'}))
+    assert {proxy for proxy in before if before[proxy] != after[proxy]} == \
+        {proxy for proxy in wr_judgments.proxies if sent_proxy in overlap_dict.get(proxy, [])}
+    assert wr_fingerprints(sent_fingerprints) == before
+
+
+# The compiled index is reused while its sources are unchanged (in the process and, through the
+# file, in a new one) and rebuilt when one of them changes
+def test_judgment_index_rebuilds_on_changed_source(tmp_path, monkeypatch):
+    for name in judgment_index.SOURCES:
+        shutil.copy(os.path.join(REPO_DIR, 'input_data', name), str(tmp_path))
+    input_dir = str(tmp_path)
+    monkeypatch.setattr(judgment_index, '_LOADED', {})
+
+    index = judgment_index.load_index(input_dir)
+    assert os.path.exists(os.path.join(input_dir, judgment_index.INDEX_FILE))
+    assert judgment_index.load_index(input_dir) is index
+
+    def compile_index(input_dir):
+        raise AssertionError('an up-to-date index was compiled again')
+
+    compile = judgment_index.compile_index
+    monkeypatch.setattr(judgment_index, '_LOADED', {})
+    monkeypatch.setattr(judgment_index, 'compile_index', compile_index)
+    reloaded = judgment_index.load_index(input_dir)
+    assert reloaded is not index
+    assert reloaded.wr.member_set(judgment_index.HC) == index.wr.member_set(judgment_index.HC)
+    np.testing.assert_array_equal(reloaded.wr.codes, index.wr.codes)
+    monkeypatch.setattr(judgment_index, 'compile_index', compile)
+
+    hc_path = os.path.join(input_dir, 'WR High-Confidence Proxies.csv')
+    with open(hc_path, newline='') as f:
+        rows = list(csv.reader(f))
+    with open(hc_path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows[:-1])
+    rebuilt = judgment_index.load_index(input_dir)
+    assert rebuilt.wr.member_set(judgment_index.HC) == index.wr.member_set(judgment_index.HC) - {rows[-1][0]}
+    assert judgment_index.load_index(input_dir) is rebuilt
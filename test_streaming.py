@@ -0,0 +1,183 @@
+## tests for the streaming summaries, their merges and the sensitivity sweep
+# Run with pytest from any directory; the model runs read input_data from the repository.
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+import random_streams
+import sent_engine
+import streaming
+import sweep
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+QUANTILES = [0, 1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99, 100]
+
+KEY = ('wr', 'Cubic', 'pigs')
+
+# A small run: the sometimes_operates reference, one species with both stages and shrimp, whose
+# P(sentience) is the assumed prior
+SENT_SPECIES = [sent_engine.SOMETIMES_OPERATES, 'pigs']
+WR_SPECIES = ['pigs', 'shrimp']
+
+SEED = 2023
+
+
+@pytest.fixture(autouse=True)
+def repo_dir(monkeypatch):
+    monkeypatch.chdir(REPO_DIR)
+
+
+# The stored parameters and unknown probabilities, with a fixed seed
+def stored_run():
+    def load(name):
+        with open(os.path.join('input_data', name), 'rb') as f:
+            return pickle.load(f)
+    return dict(load('Sentience Parameters.p'), SEED=SEED), dict(load('Welfare Range Parameters.p'), SEED=SEED), \
+        load('Sentience Unknown Probabilities.p'), load('Welfare Range Unknown Probabilities.p')
+
+
+def run_small(n_scenarios, **kwargs):
+    s_params, wr_params, s_unknowns, wr_unknowns = stored_run()
+    return streaming.run_streaming(s_params, wr_params, s_unknowns, wr_unknowns, n_scenarios=n_scenarios, \
+        sent_species=SENT_SPECIES, wr_species=WR_SPECIES, verbose=False, mixtures=False, **kwargs)
+
+
+# Continuous values of both signs with a run of exact zeros, so every value is distinct but 0
+def continuous_values(seed, n):
+    rng = np.random.default_rng(seed)
+    values = rng.lognormal(0, 2, n)*rng.choice([-1, 1], n, p=[0.2, 0.8])
+    values[rng.random(n) < 0.05] = 0
+    return values
+
+
+def discrete_values(seed, n):
+    return np.random.default_rng(seed).integers(-20, 50, n)/7
+
+
+def accumulate(chunks):
+    accumulator = streaming.SummaryAccumulator()
+    for chunk in chunks:
+        accumulator.update(chunk)
+    return accumulator
+
+
+def assert_same_accumulators(accumulator, expected):
+    assert accumulator.count == expected.count
+    np.testing.assert_allclose([accumulator.moments.mean, accumulator.moments.variance], \
+        [expected.moments.mean, expected.moments.variance], rtol=1e-12)
+    assert accumulator.sketch.exact == expected.sketch.exact
+    for values, expected_values in zip(accumulator.sketch.distribution(), expected.sketch.distribution()):
+        np.testing.assert_array_equal(values, expected_values)
+
+
+# While it holds at most max_exact distinct values the sketch answers what np.percentile does
+def test_sketch_exact_percentiles():
+    values = discrete_values(1, 5000)
+    sketch = streaming.QuantileSketch()
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+    assert sketch.exact
+    assert sketch.count == len(values)
+    np.testing.assert_allclose(sketch.percentile(QUANTILES), np.percentile(values, QUANTILES), rtol=1e-15, atol=0)
+    assert sketch.percentile(50) == np.percentile(values, 50)
+
+
+# Once collapsed, every percentile is within SKETCH_ACCURACY of the order statistics np.percentile
+# interpolates between. The middle magnitudes come first, then the smaller and the larger ones, so
+# the bins grow at both ends.
+def test_sketch_collapsed_accuracy():
+    values = continuous_values(2, 20000)
+    magnitudes = np.abs(values)
+    sketch = streaming.QuantileSketch(max_exact=1000)
+    for chunk in [values[(magnitudes >= 0.5) & (magnitudes <= 2)], values[magnitudes < 0.5], values[magnitudes > 2]]:
+        sketch.update(chunk)
+    assert not sketch.exact
+    assert sketch.count == len(values)
+
+    lower = np.abs(np.percentile(values, QUANTILES, method='lower'))
+    higher = np.abs(np.percentile(values, QUANTILES, method='higher'))
+    error = np.abs(sketch.percentile(QUANTILES) - np.percentile(values, QUANTILES))
+    assert np.all(error <= streaming.SKETCH_ACCURACY*(1 + 1e-9)*np.maximum(lower, higher) + streaming.SKETCH_MIN_VALUE)
+
+
+# Chan's pairwise update gives the mean and variance of the values however they are split
+def test_running_moments_merge():
+    values = continuous_values(3, 10001)
+    moments = streaming.RunningMoments()
+    for chunk in np.array_split(values, 9):
+        part = streaming.RunningMoments()
+        part.update(chunk)
+        moments.merge(part)
+    moments.merge(streaming.RunningMoments())
+    assert moments.count == len(values)
+    np.testing.assert_allclose([moments.mean, moments.variance], [values.mean(), values.var()], rtol=1e-12)
+
+
+# Accumulators merged chunk by chunk, in any order, hold what one pass over the values holds:
+# exact sketches, collapsed sketches, and exact chunks that collapse once merged
+@pytest.mark.parametrize('values, n_chunks', [(discrete_values(4, 20000), 5), \
+    (continuous_values(5, 60000), 3), (continuous_values(6, 60000), 12)])
+def test_merged_accumulators_equal_single_pass(values, n_chunks):
+    chunks = np.array_split(values, n_chunks)
+    merged = {}
+    for ii in np.random.default_rng(7).permutation(n_chunks):
+        streaming.merge_accumulators(merged, {KEY: accumulate([chunks[ii]])})
+    assert_same_accumulators(merged[KEY], accumulate(chunks))
+    np.testing.assert_allclose([merged[KEY].moments.mean, merged[KEY].moments.variance], [values.mean(), values.var()], \
+        rtol=1e-12)
+
+
+# Shard files merge into the accumulators of the whole run, in whatever order they are given;
+# a missing shard or a shard of another run is refused
+def test_merge_shard_files(tmp_path):
+    n_scenarios, shards = 3*random_streams.STREAM_BLOCK, 3
+    values = continuous_values(8, n_scenarios)
+    s_params, wr_params = {'SEED': 1}, {'SEED': 2}
+
+    def write(shard, s_params):
+        first_scenario, n_shard = random_streams.shard_range(n_scenarios, shard, shards)
+        accumulators = {KEY: accumulate([values[first_scenario:first_scenario + n_shard]])}
+        path = str(tmp_path / 'shard{}_seed{}.p'.format(shard, s_params['SEED']))
+        return streaming.write_shard(accumulators, path, shard, shards, n_scenarios, s_params, wr_params)
+
+    paths = [write(shard, s_params) for shard in range(shards)]
+    assert_same_accumulators(streaming.merge_shard_files(paths[::-1])[KEY], accumulate([values]))
+    with pytest.raises(ValueError):
+        streaming.merge_shard_files(paths[:2])
+    with pytest.raises(ValueError):
+        streaming.merge_shard_files(paths[:2] + [write(2, {'SEED': 3})])
+
+
+# The shards of a run draw exactly the scenarios of the unsharded run
+def test_sharded_run_equals_unsharded(tmp_path):
+    n_scenarios, shards = 2*random_streams.STREAM_BLOCK, 2
+    s_params, wr_params = stored_run()[:2]
+    whole = run_small(n_scenarios)
+    paths = [streaming.write_shard(run_small(n_scenarios, shard=shard, shards=shards), \
+        str(tmp_path / 'shard{}.p'.format(shard)), shard, shards, n_scenarios, s_params, wr_params) for shard in range(shards)]
+    merged = streaming.merge_shard_files(paths)
+    assert sorted(merged, key=str) == sorted(whole, key=str)
+    for key, accumulator in whole.items():
+        assert_same_accumulators(merged[key], accumulator)
+
+
+# A sweep at the run's own parameters gives the statistics run_streaming gives on the same seed
+def test_sweep_at_stored_point_equals_streaming():
+    s_params, wr_params, s_unknowns, wr_unknowns = stored_run()
+    assert (s_params['HC_WEIGHT'], s_params['WEIGHT_NOS']) == (wr_params['HC_WEIGHT'], wr_params['WEIGHT_NOS'])
+    assert set(s_unknowns.values()) | set(wr_unknowns.values()) == {0}
+    n_scenarios = random_streams.STREAM_BLOCK
+    accumulators = run_small(n_scenarios)
+    points = sweep.sweep_grid([s_params['HC_WEIGHT']], [s_params['WEIGHT_NOS']], [0])
+    table = sweep.run_sweep(points, s_params, wr_params, n_scenarios=n_scenarios, sent_species=SENT_SPECIES, \
+        wr_species=WR_SPECIES, verbose=False)
+
+    keys = list(zip(table['stage'], table['model'], table['species']))
+    assert {key for key in accumulators if key[0] in ['sentience', 'wr', 'adjusted']} <= set(keys)
+    for key, row in zip(keys, table[sweep.SUMMARY_COLUMNS].to_numpy()):
+        accumulator = accumulators[key]
+        expected = [accumulator.moments.mean] + list(accumulator.percentiles([5, 50, 95]))
+        np.testing.assert_allclose(row, expected, rtol=1e-9, atol=1e-12, err_msg=str(key))
@@ -0,0 +1,204 @@
+## Validation of the simulated sentience and welfare range scores
+# Every check runs on whole score matrices, a block of scenarios at a time: proxies with a fixed
+# probability must hold exactly that score in every scenario, overlap-linked welfare range
+# proxies must equal their sentience sources under the simulation's overlap weights, and the
+# mean score of every uncertain proxy is tested against its 95% CI, with a binomial test on how
+# many proxies fall outside. validate_* return a report (see new_report); print_report prints it.
+import scipy.stats
+import numpy as np
+import score_store
+import judgment_index
+import wr_simulate
+
+WEIGHT_NOS = "Yes"
+
+NORMAL_95_RANGE = 1.96
+
+CHUNK = 100000  # scenarios checked at once, so memory does not grow with N_SCENARIOS
+
+
+def get_judgments_map(weight_nos):
+    if weight_nos == "Yes":
+        judgments_map = {'likely no': {'lower': 0, 'upper': 0.25},
+                    'lean no': {'lower': 0.25, 'upper': 0.50},
+                    'lean yes': {'lower': 0.50, 'upper': 0.75},
+                    'likely yes': {'lower': 0.75, 'upper': 1.00},
+                    'unknown': 0, 'yes': 1, 'na': 0} # unknown 0 by default but this changes by species
+    else:
+        judgments_map = {'likely no': {'lower': 0, 'upper': 0},
+                    'lean no': {'lower': 0, 'upper': 0},
+                    'lean yes': {'lower': 0.50, 'upper': 0.75},
+                    'likely yes': {'lower': 0.75, 'upper': 1.00},
+                    'unknown': 0, 'yes': 1, 'na': 0}
+    return judgments_map
+
+
+# passed: every check passed
+# exact_failures: [{species, proxy, judgment, expected, mismatches, mean}] fixed-probability proxies
+#   with `mismatches` scenarios off their expected score
+# overlap_failures: [{species, proxy, mismatches, scenario, expected, simulated}] overlap proxies,
+#   with the first diverging scenario
+# uncertain_proxies: how many proxies the CI test covers
+# outside_ci: [{species, proxy, judgment, mean, lower, upper}] proxies whose mean is outside its CI
+# p_value: probability of at least that many proxies outside their CI
+def new_report():
+    return {'passed': True, 'exact_failures': [], 'overlap_failures': [], 'uncertain_proxies': 0, \
+        'outside_ci': [], 'p_value': 1.0}
+
+
+# float scenario blocks of the `proxies` columns of a ScoreStore or {proxy: scores} dict
+def score_blocks(species_scores, proxies, chunk=CHUNK):
+    if isinstance(species_scores, score_store.ScoreStore):
+        matrix = species_scores.matrix
+        idx = [species_scores.columns[proxy] for proxy in proxies]
+    else:
+        matrix = np.column_stack([np.asarray(species_scores[proxy]) for proxy in proxies])
+        idx = slice(None)
+    for start in range(0, matrix.shape[0], chunk):
+        yield start, np.asarray(matrix[start:start + chunk][:, idx], dtype=float)
+
+
+# Adds the exact and CI checks of one species' proxies to `report`. With an unknown probability
+# of 0, 'unknown' proxies are fixed at 0; otherwise they are tested like the ranged judgments.
+def check_judgments(report, species, species_scores, proxies, judgments, unknown_prob, hc_proxies, hc_weight, \
+        judgments_map):
+    if not proxies:
+        return
+    fixed_judgments = {"yes", "na"} if unknown_prob != 0 else {"unknown", "yes", "na"}
+    is_fixed = np.array([judgment in fixed_judgments for judgment in judgments])
+    expected = np.empty(len(proxies))
+    for ii, judgment in enumerate(judgments):
+        if is_fixed[ii]:
+            expected[ii] = judgments_map[judgment]
+        elif judgment == "unknown":
+            expected[ii] = unknown_prob
+        else:
+            expected[ii] = (judgments_map[judgment]['lower'] + judgments_map[judgment]['upper'])/2
+    weights = np.array([hc_weight if proxy in hc_proxies else 1 for proxy in proxies], dtype=float)
+
+    n_scenarios = 0
+    sums = np.zeros(len(proxies))
+    mismatches = np.zeros(len(proxies), dtype=int)
+    for start, block in score_blocks(species_scores, proxies):
+        n_scenarios += block.shape[0]
+        sums += block.sum(axis=0)
+        mismatches += (block != expected*weights).sum(axis=0)
+    means = sums/n_scenarios/weights
+
+    for ii in np.flatnonzero(is_fixed & (mismatches > 0)):
+        report['exact_failures'].append({'species': species, 'proxy': proxies[ii], 'judgment': judgments[ii], \
+            'expected': float(expected[ii]), 'mismatches': int(mismatches[ii]), 'mean': float(means[ii])})
+
+    s = np.sqrt((1 - expected)*expected/n_scenarios)
+    lower, upper = expected - NORMAL_95_RANGE*s, expected + NORMAL_95_RANGE*s
+    report['uncertain_proxies'] += int(np.sum(~is_fixed))
+    for ii in np.flatnonzero(~is_fixed & ((means < lower) | (means > upper))):
+        report['outside_ci'].append({'species': species, 'proxy': proxies[ii], 'judgment': judgments[ii], \
+            'mean': float(means[ii]), 'lower': float(lower[ii]), 'upper': float(upper[ii])})
+
+
+# Adds the overlap check of one species to `report`: the scores of `overlap_proxies` must be the
+# average of their sentience sources, rescaled by the same weights the simulation uses
+def check_overlap(report, species, wr_scores, sent_scores, overlap_proxies, overlap_dict, wr_hc_proxies, \
+        sent_hc_proxies, wr_hc_weight):
+    if not overlap_proxies:
+        return
+    sent_proxies, overlap_weights = wr_simulate.overlap_weight_matrix(overlap_proxies, overlap_dict, wr_hc_proxies, \
+        sent_hc_proxies, wr_hc_weight)
+    mismatches = np.zeros(len(overlap_proxies), dtype=int)
+    first = {}
+    for (start, block), (sent_start, sent_block) in zip(score_blocks(wr_scores, overlap_proxies), \
+            score_blocks(sent_scores, sent_proxies)):
+        expected = overlap_weights.dot(sent_block.T).T
+        diverged = block != expected
+        mismatches += diverged.sum(axis=0)
+        for ii in np.flatnonzero(diverged.any(axis=0)):
+            if ii not in first:
+                s = np.argmax(diverged[:, ii])
+                first[ii] = (start + s, expected[s, ii], block[s, ii])
+
+    for ii in np.flatnonzero(mismatches > 0):
+        scenario, expected_score, simulated_score = first[ii]
+        report['overlap_failures'].append({'species': species, 'proxy': overlap_proxies[ii], \
+            'mismatches': int(mismatches[ii]), 'scenario': int(scenario), 'expected': float(expected_score), \
+            'simulated': float(simulated_score)})
+
+
+def finish_report(report):
+    report['p_value'] = float(1 - scipy.stats.binom.cdf(len(report['outside_ci']), report['uncertain_proxies'], 0.05))
+    report['passed'] = not report['exact_failures'] and not report['overlap_failures'] and report['p_value'] >= 0.05
+    return report
+
+
+def validate_sentience_scores(data, HC_WEIGHT, SPECIES, weight_nos=WEIGHT_NOS):
+    judgments = judgment_index.load_index().sentience
+    hc_proxies = judgments.member_set(judgment_index.HC)
+    judgments_map = get_judgments_map(weight_nos)
+    proxies = judgments.proxies
+
+    report = new_report()
+    for species in SPECIES:
+        check_judgments(report, species, data[species]["Scores"], proxies, judgments.species_judgments(species), \
+            data[species]["Unknown Prob"], hc_proxies, HC_WEIGHT, judgments_map)
+    return finish_report(report)
+
+
+# `sent_data` maps species to their sentience scores; by default they are read from output_data.
+# Species without sentience scores (shrimp) have no overlap proxies: all their proxies are drawn.
+def validate_wr_scores(data, overlap_dict, WR_HC_WEIGHT, SENT_HC_WEIGHT, SPECIES, weight_nos=WEIGHT_NOS, \
+        sent_data=None):
+    index = judgment_index.load_index()
+    judgments = index.wr
+    wr_hc_proxies = judgments.member_set(judgment_index.HC)
+    sent_hc_proxies = index.sentience.member_set(judgment_index.HC)
+    judgments_map = get_judgments_map(weight_nos)
+    proxies = judgments.proxies
+
+    report = new_report()
+    for species in SPECIES:
+        wr_scores = data[species]["Scores"]
+        sent_scores = None
+        if sent_data is not None:
+            sent_scores = sent_data.get(species)
+        elif species in wr_simulate.SENT_SPECIES:
+            sent_scores = score_store.load_simulated_scores(wr_simulate.sent_scores_prefix(species))
+
+        is_overlap = [sent_scores is not None and proxy in overlap_dict for proxy in proxies]
+        drawn = [ii for ii, overlap in enumerate(is_overlap) if not overlap]
+        check_overlap(report, species, wr_scores, sent_scores, [proxy for proxy, overlap in zip(proxies, is_overlap) \
+            if overlap], overlap_dict, wr_hc_proxies, sent_hc_proxies, WR_HC_WEIGHT)
+        species_judgments = judgments.species_judgments(species)
+        check_judgments(report, species, wr_scores, [proxies[ii] for ii in drawn], \
+            [species_judgments[ii] for ii in drawn], data[species]["Unknown Prob"], wr_hc_proxies, \
+            WR_HC_WEIGHT, judgments_map)
+    return finish_report(report)
+
+
+def print_report(report):
+    for failure in report['exact_failures']:
+        print("Species: {}".format(failure['species']))
+        print("Expected prob: {}".format(failure['expected']))
+        print("Broke at proxy {} for species {} ({} scenarios differ)".format(failure['proxy'], failure['species'], \
+            failure['mismatches']))
+    for failure in report['overlap_failures']:
+        print("Species: {}".format(failure['species']))
+        print("Test broke at proxy {} because its simulated values diverged from its sentience proxies in {} scenarios".format(\
+            failure['proxy'], failure['mismatches']))
+        print("First at scenario {}: avg score {}, simulated score {}".format(failure['scenario'], failure['expected'], \
+            failure['simulated']))
+    if not report['exact_failures'] and not report['overlap_failures']:
+        print("All proxies with zero/one probabilities have scores equal to their expected values")
+    outside_int, count_uncertain_proxies = len(report['outside_ci']), report['uncertain_proxies']
+    print("Number proxies whose proportion was outside 95% CI: {}".format(outside_int))
+    print("Proportion of total proxies whose mean score was outside of the 95% CI: {}".format(\
+        round(outside_int/max(count_uncertain_proxies, 1), 3)))
+    print("Probability of getting > {}/{} proxies outside of their 95% CI: {}".format(outside_int, count_uncertain_proxies, \
+        round(report['p_value'], 3)))
+    if not report['passed']:
+        for failure in report['outside_ci']:
+            print("Species: {}".format(failure['species']))
+            print("Outside int for proxy: {}".format(failure['proxy']))
+            print("Judgment: {}".format(failure['judgment']))
+            print("Avg. score was {}".format(failure['mean']))
+            print("Expected to be between {} and {}".format(failure['lower'], failure['upper']))
+    print("Pass Test: ")
@@ -0,0 +1,133 @@
+## Long-lived simulation worker
+# Loads the libraries and input tables once, then runs simulation jobs sent as JSON lines, so a
+# run of many small simulations pays the start-up cost once instead of once per species. Jobs
+# come on stdin (answers on stdout), or with --port on a local socket, one connection at a time
+# with any number of jobs per connection.
+#
+# Job: {"id": 1, "stage": "sentience" or "welfare ranges", "species": "pigs", "unknown_prob": 0,
+#       "weight_no": "Yes", "hc_weight": 5, "scenarios": 10000, "seed": 123,
+#       "path": "output_data/sent_pigs_", "sent_path": "output_data/sent_pigs_"}
+# "id", "unknown_prob" (0), "seed" (a new root seed), "sampler" ("random"), "path" and
+# "sent_path" are optional.
+# "sent_path" is where a welfare range job reads the species' sentience scores from for its
+# overlap proxies (by default output_data, like wr_simulate.py).
+#
+# Answer: {"id", "status": "ok", "seed", "seconds", "path", "bytes_written"} when the job has a
+# "path" (the scores are written to that score store), {"id", "status": "ok", "seed", "seconds",
+# "proxies", "scores"} (scenarios x proxies) otherwise, or {"id", "status": "failed", "error"}.
+# {"command": "reload"} re-reads the input tables and {"command": "quit"} stops the worker.
+import sys
+import json
+import time
+import socket
+import argparse
+import traceback
+
+import score_store
+import instrumentation
+import random_streams
+import sampling
+import sent_simulate
+import wr_simulate
+import pipeline
+
+REQUIRED = ['species', 'weight_no', 'hc_weight', 'scenarios']
+
+
+def run_job(job, inputs):
+    missing = [key for key in REQUIRED if key not in job]
+    if missing:
+        raise ValueError('Job is missing {}'.format(missing))
+    stage = job.get('stage', pipeline.SENTIENCE)
+    species = job['species']
+    seed = job.get('seed')
+    if seed is None:
+        seed = random_streams.new_root_seed()
+    sampler = sampling.sampler_of({'SAMPLER': job.get('sampler')})
+    start = time.time()
+
+    if stage == pipeline.SENTIENCE:
+        proxies, scores = sent_simulate.simulate_species(inputs['sent_judgments'], species, job.get('unknown_prob', 0), \
+            job['weight_no'], job['hc_weight'], job['scenarios'], hc_proxies=inputs['sent_hc_proxies'], seed=seed, \
+            sampler=sampler)
+    elif stage == pipeline.WELFARE_RANGES:
+        sent_scores = None
+        if job.get('sent_path') is not None:
+            sent_scores = score_store.load_simulated_scores(job['sent_path'])
+        proxies, scores = wr_simulate.simulate_species(inputs['wr_judgments'], species, job.get('unknown_prob', 0), \
+            job['weight_no'], job['hc_weight'], job['scenarios'], sent_scores=sent_scores, \
+            hc_proxies=inputs['wr_hc_proxies'], sent_hc_proxies=inputs['sent_hc_proxies'], \
+            overlap_dict=inputs['overlap_dict'], seed=seed, sampler=sampler)
+    else:
+        raise ValueError('stage must be "{}" or "{}", got {!r}'.format(pipeline.SENTIENCE, pipeline.WELFARE_RANGES, stage))
+
+    answer = {'id': job.get('id'), 'status': 'ok', 'seed': seed}
+    if job.get('path') is not None:
+        metadata = {} if sampler == sampling.RANDOM else {'sampler': sampler}
+        path = score_store.write_scores(job['path'], proxies, scores, stage=stage, species=species, **metadata)
+        answer.update({'path': path, 'bytes_written': instrumentation.bytes_written([path, score_store.header_file(job['path'])])})
+    else:
+        answer.update({'proxies': proxies, 'scores': scores.tolist()})
+    answer['seconds'] = time.time() - start
+    return answer
+
+
+class Worker:
+    def __init__(self):
+        self.inputs = pipeline.load_inputs()
+
+    # The answer to one line of input, or None to stop
+    def handle(self, line):
+        try:
+            job = json.loads(line)
+        except ValueError:
+            job = None
+        if not isinstance(job, dict):
+            return {'id': None, 'status': 'failed', 'error': 'Not a JSON job: {!r}'.format(line[:200])}
+        command = job.get('command')
+        if command == 'quit':
+            return None
+        if command == 'reload':
+            self.inputs = pipeline.load_inputs()
+            return {'id': job.get('id'), 'status': 'ok'}
+        try:
+            return run_job(job, self.inputs)
+        except Exception:
+            return {'id': job.get('id'), 'status': 'failed', 'error': traceback.format_exc()}
+
+    # Answers every job of `reader` on `writer`; returns False once told to quit
+    def serve(self, reader, writer):
+        for line in reader:
+            if not line.strip():
+                continue
+            answer = self.handle(line)
+            if answer is None:
+                return False
+            writer.write(json.dumps(answer) + '\n')
+            writer.flush()
+        return True
+
+    def serve_socket(self, port, host='127.0.0.1'):
+        with socket.create_server((host, port)) as server:
+            print('... Listening on {}:{}'.format(host, server.getsockname()[1]), file=sys.stderr, flush=True)
+            while True:
+                connection, address = server.accept()
+                with connection, connection.makefile('r') as reader, connection.makefile('w') as writer:
+                    if not self.serve(reader, writer):
+                        return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run simulation jobs sent as JSON lines without restarting Python')
+    parser.add_argument('--port', type=int, help='Listen on this local port instead of reading stdin', default=None)
+    args = parser.parse_args()
+
+    worker = Worker()
+    if args.port is None:
+        worker.serve(sys.stdin, sys.stdout)
+    else:
+        worker.serve_socket(args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+## Vectorized welfare range models
+# The eight models of wr_models.ipynb as array operations: every proxy set becomes a column mask
+# over a scenarios x proxies score matrix, so a model is one matrix product plus its transform,
+# and all models for all species come out of a single (species, scenarios, proxies) product.
+import statistics
+
+import numpy as np
+
+import judgment_index
+import sampling
+from score_store import score_matrix
+
+# {model name: (column of WR Model Proxies.csv, exponent)}; a None column is the high-confidence set
+WR_SIMPLE_MODELS = {'Qualitative': ('qualitative', 1),
+            'High-Confidence (Simple Scoring)': (None, 1),
+            'Cubic': ('cubic', 3),
+            'High-Confidence (Cubic)': (None, 3),
+            'Qualitative Minus Social': ('qualitative minus social', 1),
+            'Pleasure-and-pain-centric': ('pleasure-and-pain-centric', 1)}
+
+# {model name: (cognitive column, hedonic column)}
+WR_TWO_TERM_MODELS = {'Higher-Lower Pleasures': ('higher/lower pleasures - cognitive', 'higher/lower pleasures - hedonic'),
+            'Undiluted Experience': ('undiluted experience - cognitive', 'undiluted experience - hedonic')}
+
+WR_MODELS = list(WR_SIMPLE_MODELS) + list(WR_TWO_TERM_MODELS)
+
+# Models whose scores are divided back by HC_WEIGHT and whose human sum counts every proxy once
+HC_MODELS = {model_name for model_name, (column, exponent) in WR_SIMPLE_MODELS.items() if column is None}
+
+WR_FFF = {'pigs': 75, 'chickens': 50, 'carp': 72, 'salmon': 72, 'octopuses': 45, 'shrimp': 80, \
+            'crabs': 14, 'crayfish': 55, 'bees': 110, 'bsf': None, 'silkworms': None}
+
+
+# The Mixture model fits a normal to each model's 5th/95th percentiles, except for Undiluted
+# Experience which gets a lognormal; every component is clipped at 0
+MIXTURE_LOGNORMAL = {'Undiluted Experience'}
+
+NEURON_COUNT = 'Neuron Count'
+NEURON_COUNTS = {'pigs': 0.005350, 'chickens': 0.002439, 'carp': 0.000160, 'salmon': 0.000160, \
+            'octopuses': 0.005407, 'shrimp': 0.000001, 'crabs': 0.000001, 'crayfish': 0.000001, \
+            'bees': 0.000013, 'bsf': 0.000004, 'silkworms': 0.00001}
+
+_Z_90 = statistics.NormalDist().inv_cdf(0.95)  # half-width of a 90% interval in standard deviations
+
+
+# Proxy sets of every model, from the compiled judgment index
+def load_models(input_dir='input_data'):
+    index = judgment_index.load_index(input_dir).wr
+    hc_proxies = index.member_set(judgment_index.HC)
+
+    simple = {}
+    for model_name, (column, exponent) in WR_SIMPLE_MODELS.items():
+        simple[model_name] = hc_proxies if column is None else index.member_set(judgment_index.model_term(column))
+    two_term = {model_name: (index.member_set(judgment_index.model_term(cog)), index.member_set(judgment_index.model_term(hed))) \
+        for model_name, (cog, hed) in WR_TWO_TERM_MODELS.items()}
+    return {'hc_proxies': hc_proxies, 'simple': simple, 'two_term': two_term}
+
+
+def proxy_mask(proxies, model_proxies):
+    return np.array([proxy in model_proxies for proxy in proxies], dtype=float)
+
+
+def human_sum(model_name, model_proxies, hc_proxies, hc_weight):
+    if model_name in HC_MODELS:
+        return len(model_proxies)
+    return sum(hc_weight if proxy in hc_proxies else 1 for proxy in model_proxies)
+
+
+def higher_lower_pleasures(cog_ratio, hed_ratio):
+    return cog_ratio*hed_ratio
+
+
+def undiluted_experience(cog_ratio, hed_ratio):
+    return hed_ratio/np.where(cog_ratio > 0, cog_ratio, 0.01)
+
+
+TWO_TERM_FUNCTIONS = {'Higher-Lower Pleasures': higher_lower_pleasures, 'Undiluted Experience': undiluted_experience}
+
+
+# Adjusts for the species' critical flicker-fusion frequency; None (or NaN in an array of
+# frequencies) leaves the welfare range unadjusted
+def fff_adjust(welfare_range, fff):
+    if fff is None:
+        return welfare_range
+    fff = np.asarray(fff, dtype=float)
+    adjusted = 0.28*welfare_range*fff/60 + 0.72*welfare_range
+    return np.where(np.isnan(fff), welfare_range, adjusted)
+
+
+def simple_welfare_range(f, welfare_sum, human_sum, fff):
+    return np.maximum(fff_adjust(f(welfare_sum)/f(human_sum), fff), 0)
+
+
+def two_term_welfare_range(f, cog_ratio, hed_ratio, fff):
+    return np.maximum(fff_adjust(f(cog_ratio, hed_ratio), fff), 0)
+
+
+# Every proxy-sum term of every model as one proxies x terms mask, with the matching human sums
+# and the divisor applied to the species' sum (HC_WEIGHT for the high-confidence models)
+def model_terms(proxies, models, hc_weight):
+    hc_proxies = models['hc_proxies']
+    terms, masks, human_sums, divisors = [], [], [], []
+
+    def add(term, model_name, model_proxies):
+        terms.append(term)
+        masks.append(proxy_mask(proxies, model_proxies))
+        human_sums.append(human_sum(model_name, model_proxies, hc_proxies, hc_weight))
+        divisors.append(hc_weight if model_name in HC_MODELS else 1)
+
+    for model_name, model_proxies in models['simple'].items():
+        add(model_name, model_name, model_proxies)
+    for model_name, (cog_proxies, hed_proxies) in models['two_term'].items():
+        add((model_name, 'cognitive'), model_name, cog_proxies)
+        add((model_name, 'hedonic'), model_name, hed_proxies)
+    return terms, np.column_stack(masks), np.array(human_sums, dtype=float), np.array(divisors, dtype=float)
+
+
+# {model: welfare ranges} for a (..., scenarios, proxies) score array. `fff` is a scalar or an
+# array matching the leading dimensions (NaN for species without a frequency).
+def welfare_ranges(scores, proxies, models, hc_weight, fff=None):
+    terms, masks, human_sums, divisors = model_terms(proxies, models, hc_weight)
+    return term_welfare_ranges(scores @ masks, terms, human_sums, divisors, models, fff)
+
+
+# Same as welfare_ranges, from the (..., scenarios, terms) masked sums of model_terms
+def term_welfare_ranges(sums, terms, human_sums, divisors, models, fff=None):
+    sums = sums/divisors
+    if fff is not None:
+        fff = np.expand_dims(np.asarray(fff, dtype=float), -1)
+    term_sums = {term: sums[..., ii] for ii, term in enumerate(terms)}
+    term_humans = dict(zip(terms, human_sums))
+
+    results = {}
+    for model_name, (column, exponent) in WR_SIMPLE_MODELS.items():
+        if model_name not in models['simple']:
+            continue
+        results[model_name] = simple_welfare_range(lambda x: x**exponent, term_sums[model_name], \
+            term_humans[model_name], fff)
+    for model_name in models['two_term']:
+        cog_ratio = term_sums[(model_name, 'cognitive')]/term_humans[(model_name, 'cognitive')]
+        hed_ratio = term_sums[(model_name, 'hedonic')]/term_humans[(model_name, 'hedonic')]
+        results[model_name] = two_term_welfare_range(TWO_TERM_FUNCTIONS[model_name], cog_ratio, hed_ratio, fff)
+    return results
+
+
+# (models, species, scenarios) P(sentience)-adjusted welfare ranges: the (species, scenarios)
+# P(sentience) samples broadcast against every model's welfare ranges
+def adjusted_welfare_ranges(welfare_ranges, p_sentience):
+    return np.maximum(np.asarray(p_sentience, dtype=float)*np.asarray(welfare_ranges, dtype=float), 0)
+
+
+# (..., 4) [mean, 5th, 50th, 95th percentile] over the last (scenarios) axis, in one pass
+def summary_stats(values):
+    percentiles = np.percentile(values, [5, 50, 95], axis=-1)
+    return np.concatenate([np.mean(values, axis=-1)[..., None], np.moveaxis(percentiles, 0, -1)], axis=-1)
+
+
+# {model: {species: welfare ranges}} for every species at once, over the first `n_scenarios`
+# scenarios (all those every species has when it is None)
+def all_species_welfare_ranges(species_scores, models, hc_weight, species_list, fffs=WR_FFF, n_scenarios=None):
+    proxies = None
+    matrices = []
+    for species in species_list:
+        proxies, matrix = score_matrix(species_scores[species], proxies)
+        matrices.append(matrix)
+    if n_scenarios is None:
+        n_scenarios = min(len(matrix) for matrix in matrices)
+    scores = np.stack([matrix[:n_scenarios] for matrix in matrices])
+    fff = [np.nan if fffs.get(species) is None else fffs[species] for species in species_list]
+
+    results = welfare_ranges(scores, proxies, models, hc_weight, fff)
+    return {model_name: {species: results[model_name][k] for k, species in enumerate(species_list)} \
+        for model_name in results}
+
+
+# (location, scale, lognormal) of the clipped normals/lognormals sq.norm and sq.lognorm fit to
+# (species, models) arrays of 5th and 95th percentiles
+def fit_mixture_components(lowers, uppers, model_names):
+    lognormal = np.array([model_name in MIXTURE_LOGNORMAL for model_name in model_names])
+    lowers, uppers = np.asarray(lowers, dtype=float), np.asarray(uppers, dtype=float)
+    if np.any(lowers[:, lognormal] <= 0):
+        raise ValueError("lognormal distribution must have values > 0")
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lowers = np.where(lognormal, np.log(lowers), lowers)
+        uppers = np.where(lognormal, np.log(uppers), uppers)
+    locations = (lowers + uppers)/2
+    return locations, (uppers - locations)/_Z_90, lognormal
+
+
+# (species, n_samples) draws of the Mixture model for every species. `lowers` and `uppers` are
+# (species, models) 5th/95th percentiles of `model_names`; `constants` (e.g. the species' neuron
+# counts) adds a point-mass component in front of the models, so `weights` then has one more
+# entry. Each sample takes one uniform to pick its component and one standard normal, instead of
+# squigglepy sampling every component in full. With another sampler than 'random' both come
+# from that sampler's (pick, quantile) uniforms.
+def sample_fitted_mixture(lowers, uppers, model_names, weights, n_samples, rng, constants=None, sampler=sampling.RANDOM):
+    locations, scales, lognormal = fit_mixture_components(lowers, uppers, model_names)
+    if constants is not None:
+        locations = np.column_stack([np.asarray(constants, dtype=float), locations])
+        scales = np.column_stack([np.zeros(len(locations)), scales])
+        lognormal = np.concatenate([[False], lognormal])
+
+    samples = np.empty((len(locations), n_samples))
+    for ii, row in enumerate(samples):
+        if sampler == sampling.RANDOM:
+            picks = sampling.pick_components(weights, rng.random(n_samples))
+            rng.standard_normal(out=row)
+        else:
+            u = sampling.uniforms(rng, n_samples, 2, sampler)
+            picks = sampling.pick_components(weights, u[:, 0])
+            row[:] = sampling.standard_normal(u[:, 1])
+        row *= scales[ii][picks]
+        row += locations[ii][picks]
+        np.exp(row, out=row, where=lognormal[picks])
+        np.maximum(row, 0, out=row)
+    return samples
+
+
+# Same as sample_fitted_mixture, but every component is resampled from the model's own
+# (species, scenarios) welfare range samples in `model_samples` instead of a fitted distribution
+def sample_empirical_mixture(model_samples, weights, n_samples, rng, constants=None):
+    model_samples = [np.asarray(samples, dtype=float) for samples in model_samples]
+    if constants is not None:
+        model_samples = [np.asarray(constants, dtype=float)[:, None]] + model_samples
+
+    samples = np.empty((len(model_samples[-1]), n_samples))
+    for ii, row in enumerate(samples):
+        picks = sampling.pick_components(weights, rng.random(n_samples))
+        for k, component in enumerate(model_samples):
+            mask = picks == k
+            row[mask] = component[ii][rng.integers(0, component.shape[1], size=np.count_nonzero(mask))]
+    return samples
+
+
+# (5th percentiles, 95th percentiles) of `model_names` from their (species x stats) summary
+# DataFrames, as the (species, models) arrays sample_fitted_mixture takes
+def mixture_bounds(model_stats, model_names, species_list):
+    lowers = np.column_stack([model_stats[model_name].reindex(species_list)['5th-pct'].to_numpy() for model_name in model_names])
+    uppers = np.column_stack([model_stats[model_name].reindex(species_list)['95th-pct'].to_numpy() for model_name in model_names])
+    return lowers, uppers
@@ -1,44 +1,19 @@
 ## Monte-Carlo Simulations
 import os
-import pickle
-import random
 import argparse
 import csv
 
 import numpy as np
-import pandas as pd
-import squigglepy as sq
-
-from datetime import date
-from email.policy import default
-from scipy import stats
-from pprint import pprint
-from functools import partial
-from collections import defaultdict
-
-parser = argparse.ArgumentParser(description='Generate welfare ranges')
-parser.add_argument('--species', type=str, help="What species do you want to simulate the welfare range of?")
-parser.add_argument('--unknown_prob', type=float, help="What probability do you assign Unknown judgements for this species?", default=0)
-parser.add_argument('--weight_no', type=str, help="Do you want to give non-zero probability to lean no and likely no?")
-parser.add_argument('--hc_weight', type=float, help="What weight do high-confidence proxies get relative to other proxies?")
-parser.add_argument('--scenarios', type=int, help='How many Monte Carlo simulations to run?', default=10000)
-parser.add_argument('--csv', type=str, help='Define the relative path to the CSV with the species scores information')
-parser.add_argument('--path', type=str, help='Define a custom path for the saved model outputs', default='')
-parser.add_argument('--save', type=bool, help='Set to False to not save (overwrite) model outputs', default=True)
-parser.add_argument('--update_every', type=int, help='How many steps to run before updating?', default=1000)
-parser.add_argument('--verbose', type=bool, help='Set to True to get scenario-specific output', default=False)
-args = parser.parse_args()
-
-SPECIES = args.species
-UNKNOWN_PROB = args.unknown_prob
-WEIGHT_NO = args.weight_no
-HC_WEIGHT = args.hc_weight
-N_SCENARIOS = args.scenarios
-VERBOSE = args.verbose
-CSV = args.csv
-SAVE = args.save
-PATH = args.path
-update_every = args.update_every
+
+import score_store
+import instrumentation
+import random_streams
+import judgment_index
+import sampling
+import packed_scores
+from sent_simulate import judgment_bounds, proxy_weights, draw_presence, select_proxies
+
+WR_SPECIES = ['pigs', 'chickens', 'carp', 'salmon', 'octopuses', 'shrimp', 'crabs', 'crayfish', 'bees', 'bsf', 'silkworms']
 
 SENT_SPECIES = ['bees', 'cockroaches', 'fruit_flies', 'ants', \
             'c_elegans', 'crabs', 'crayfish', 'earthworms', \
@@ -49,134 +24,244 @@ SENT_SPECIES = ['bees', 'cockroaches', 'fruit_flies', 'ants', \
 
 SCENARIO_RANGES = [1, 5, 10, 20, 30, 40, 50, 60, 70, 80, 90, 95, 99]  # Generate printed output for these percentiles
 
-judgements = pd.read_csv(os.path.join('input_data', 'WR Judgments.csv'))
-
-hc_csv = os.path.join('input_data', 'WR High-Confidence Proxies.csv')
-hc_proxies = set()
-with open(hc_csv, newline='') as f:
-    reader = csv.reader(f)
-    hc_proxies_lists = list(reader)
-for item in hc_proxies_lists:
-    hc_proxies.add(item[0])
-
-sent_hc_csv = os.path.join('input_data', 'Sentience High-Confidence Proxies.csv')
-sent_hc_proxies = set()
-with open(sent_hc_csv, newline='') as f:
-    reader = csv.reader(f)
-    sent_hc_proxies_lists = list(reader)
-for item in sent_hc_proxies_lists:
-    sent_hc_proxies.add(item[0])
-
-overlap_csv = os.path.join('input_data', 'Proxy Overlap.csv')
-
-overlap_dict = {}
-with open(overlap_csv) as f:
-    reader = csv.reader(f, delimiter=',')
-    for idx, rec in enumerate(reader):
-        if idx == 0:
-            continue
-        else:
-            sent_proxy = rec[0].strip()
-            in_both = rec[1].strip()
-            corr_proxy = rec[2].strip()
-            if in_both == "y":
-                if corr_proxy not in overlap_dict:
-                    overlap_dict[corr_proxy] = []
-                overlap_dict[corr_proxy].append(sent_proxy)
-
-if WEIGHT_NO == "Yes":
-    judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0.25},
-                    'lean no': {'lower': 0.25, 'upper': 0.50},
-                    'lean yes': {'lower': 0.50, 'upper': 0.75},
-                    'likely yes': {'lower': 0.75, 'upper': 1.00},
-                    'unknown': UNKNOWN_PROB}
-else:
-    judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0},
-                    'lean no': {'lower': 0, 'upper': 0},
-                    'lean yes': {'lower': 0.50, 'upper': 0.75},
-                    'likely yes': {'lower': 0.75, 'upper': 1.00},
-                    'unknown': UNKNOWN_PROB}
-
-species_scores = judgements[["proxies", SPECIES]]
-
-simulated_probs = {}
-simulated_scores = {}
-
-if SPECIES in SENT_SPECIES:
-    sent_scores = pickle.load(open('{}_simulated_scores.p'.format(os.path.join('output_data', "sent_{}".format(SPECIES))), 'rb'))
-
-for proxy in species_scores["proxies"].to_list():
-    simulated_probs[proxy] = []
-    simulated_scores[proxy] = []
-
-for s in range(N_SCENARIOS):
-    if s % update_every == 0:
-        if VERBOSE:
-            print('-')
-            print('### SCENARIO {} ###'.format(s + 1))
-        else:
-            print('... Completed {}/{}'.format(s + 1, N_SCENARIOS))
-
-    #Set up for iteration over proxies
-    num_proxies = len(species_scores)
-    bern_probs = []
-    proxies_arr = []
-    judgements = species_scores[SPECIES]    
-    
-    #Iterate over proxies
-    for ii in range(0,num_proxies):
-        proxy = species_scores.proxies[ii]
-
-        if SPECIES in SENT_SPECIES and proxy in overlap_dict.keys():
-            sent_proxies = overlap_dict[proxy]
-            a = 0
-            count = 0
-            for sent_proxy in sent_proxies:
-                count += 1
-                score = sent_scores[sent_proxy][s]     
-                if proxy in hc_proxies:
-                    if sent_proxy in sent_hc_proxies:
-                        a += score
-                    else:
-                        a += score*HC_WEIGHT
+
+def get_judgment_prob_map(weight_no, unknown_prob):
+    if weight_no == "Yes":
+        judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0.25},
+                        'lean no': {'lower': 0.25, 'upper': 0.50},
+                        'lean yes': {'lower': 0.50, 'upper': 0.75},
+                        'likely yes': {'lower': 0.75, 'upper': 1.00},
+                        'unknown': unknown_prob}
+    else:
+        judgment_prob_map = {'likely no': {'lower': 0, 'upper': 0},
+                        'lean no': {'lower': 0, 'upper': 0},
+                        'lean yes': {'lower': 0.50, 'upper': 0.75},
+                        'likely yes': {'lower': 0.75, 'upper': 1.00},
+                        'unknown': unknown_prob}
+    return judgment_prob_map
+
+
+# The compiled welfare range judgments (a judgment_index.StageIndex)
+def load_judgments():
+    return judgment_index.load_index().wr
+
+
+def load_overlap_dict(overlap_csv=os.path.join('input_data', 'Proxy Overlap.csv')):
+    overlap_dict = {}
+    with open(overlap_csv) as f:
+        reader = csv.reader(f, delimiter=',')
+        for idx, rec in enumerate(reader):
+            if idx == 0:
+                continue
+            else:
+                sent_proxy = rec[0].strip()
+                in_both = rec[1].strip()
+                corr_proxy = rec[2].strip()
+                if in_both == "y":
+                    if corr_proxy not in overlap_dict:
+                        overlap_dict[corr_proxy] = []
+                    overlap_dict[corr_proxy].append(sent_proxy)
+    return overlap_dict
+
+
+def sent_scores_prefix(species, output_dir='output_data'):
+    return '{}_'.format(os.path.join(output_dir, "sent_{}".format(species)))
+
+
+# Compiles the overlap rules into a sparse (overlap WR proxies x sentience proxies) matrix.
+# Each WR proxy's score is the average of its linked sentience scores, each rescaled from the
+# sentience HC weighting to the WR one: x HC_WEIGHT when only the WR proxy is high-confidence,
+# / HC_WEIGHT when only the sentience proxy is.
+def overlap_weight_matrix(overlap_proxies, overlap_dict, hc_proxies, sent_hc_proxies, hc_weight):
+    from scipy import sparse
+    sent_proxies = []
+    for proxy in overlap_proxies:
+        for sent_proxy in overlap_dict[proxy]:
+            if sent_proxy not in sent_proxies:
+                sent_proxies.append(sent_proxy)
+
+    rows, cols, vals = [], [], []
+    for ii, proxy in enumerate(overlap_proxies):
+        count = len(overlap_dict[proxy])
+        for sent_proxy in overlap_dict[proxy]:
+            if proxy in hc_proxies:
+                if sent_proxy in sent_hc_proxies:
+                    weight = 1
                 else:
-                    if sent_proxy in sent_hc_proxies:
-                        a += score/HC_WEIGHT
-                    else:
-                        a += score
-            avg_score = a/count
-            simulated_scores[proxy].append(avg_score)
-        else:
-            judgement = judgements[ii]
-
-            if judgement == 'unknown':
-                proxy_prob = judgment_prob_map[judgement]
+                    weight = hc_weight
             else:
-                lower_prob = judgment_prob_map[judgement]['lower']
-                upper_prob = judgment_prob_map[judgement]['upper']
-                proxy_prob = random.uniform(lower_prob, upper_prob)
-            bern_probs.append(proxy_prob)
-            proxies_arr.append(proxy)
-    
-    #Obtain bernoulli draws 
-    num_non_sent_proxies = len(bern_probs)
-    draws = stats.bernoulli.rvs(bern_probs,size=num_non_sent_proxies)
-    
-    #Store bernoulli draw results
-    for ii in range(0,num_non_sent_proxies):
-
-        proxy = proxies_arr[ii]  
-        has_proxy = draws[ii]
-        if proxy in hc_proxies:
-            score = HC_WEIGHT*has_proxy
-        else:
-            score = has_proxy
-        simulated_probs[proxy].append(proxy_prob)
-        simulated_scores[proxy].append(score)
-
-
-if SAVE:
-    print('... Saving 1/1')
-    pickle.dump(simulated_scores, open('{}simulated_scores.p'.format(PATH), 'wb'))
-
-    
\ No newline at end of file
+                if sent_proxy in sent_hc_proxies:
+                    weight = 1/hc_weight
+                else:
+                    weight = 1
+            rows.append(ii)
+            cols.append(sent_proxies.index(sent_proxy))
+            vals.append(weight/count)
+
+    weights = sparse.csr_matrix((vals, (rows, cols)), shape=(len(overlap_proxies), len(sent_proxies)))
+    return sent_proxies, weights
+
+
+# Draws come from the (species, proxy, block) streams of `seed`; `proxy_subset` simulates only
+# those proxies' columns, with the same values they have in a full run
+def simulate_species(judgments, species, unknown_prob, weight_no, hc_weight, n_scenarios, sent_scores=None, \
+        hc_proxies=None, sent_hc_proxies=None, overlap_dict=None, seed=None, first_scenario=0, progress=None, \
+        proxy_subset=None, sampler=sampling.RANDOM):
+    index = judgment_index.load_index()
+    if hc_proxies is None:
+        hc_proxies = index.wr.member_set(judgment_index.HC)
+    if sent_hc_proxies is None:
+        sent_hc_proxies = index.sentience.member_set(judgment_index.HC)
+    if overlap_dict is None:
+        overlap_dict = index.overlap_dict
+    if seed is None:
+        seed = random_streams.new_root_seed()
+    if sent_scores is None and species in SENT_SPECIES:
+        sent_scores = score_store.load_simulated_scores(sent_scores_prefix(species))
+
+    all_proxies = judgments.proxies
+    proxies = select_proxies(all_proxies, proxy_subset)
+    if sent_scores is not None:
+        is_overlap = np.array([proxy in overlap_dict for proxy in proxies])
+    else:
+        is_overlap = np.zeros(len(proxies), dtype=bool)
+    drawn_idx = np.flatnonzero(~is_overlap)
+    overlap_idx = np.flatnonzero(is_overlap)
+
+    judgment_prob_map = get_judgment_prob_map(weight_no, unknown_prob)
+    drawn_proxies = [proxies[ii] for ii in drawn_idx]
+    lower, upper = judgment_bounds(judgments.species_codes(species)[[all_proxies.index(proxy) for proxy in drawn_proxies]], \
+        judgment_prob_map)
+    weights = proxy_weights(drawn_proxies, hc_proxies, hc_weight)
+
+    scores = np.empty((n_scenarios, len(proxies)))
+    for block, start, stop in random_streams.stream_blocks(n_scenarios, first_scenario):
+        if progress is not None:
+            progress(start, n_scenarios)
+        scores[start:stop, drawn_idx] = draw_presence(lower, upper, drawn_proxies, stop - start, seed, \
+            'welfare ranges', species, block, sampler) * weights
+
+    if len(overlap_idx) > 0:
+        overlap_proxies = [proxies[ii] for ii in overlap_idx]
+        sent_proxies, overlap_weights = overlap_weight_matrix(overlap_proxies, overlap_dict, hc_proxies, \
+            sent_hc_proxies, hc_weight)
+        sent_matrix = np.column_stack([np.asarray(sent_scores[sent_proxy], dtype=float)[:n_scenarios] \
+            for sent_proxy in sent_proxies])
+        scores[:, overlap_idx] = overlap_weights.dot(sent_matrix.T).T
+
+    return proxies, scores
+
+
+# The draws of simulate_species with the scores kept as presence bits (a PackedScores). The
+# overlap proxies are not materialised: they are a part over the bits of `sent_scores`, the
+# species' packed sentience scores, with the overlap averages as its coefficients.
+def simulate_packed_species(judgments, species, unknown_prob, weight_no, hc_weight, n_scenarios, sent_scores=None, \
+        hc_proxies=None, sent_hc_proxies=None, overlap_dict=None, seed=None, first_scenario=0, progress=None, \
+        sampler=sampling.RANDOM):
+    index = judgment_index.load_index()
+    if hc_proxies is None:
+        hc_proxies = index.wr.member_set(judgment_index.HC)
+    if sent_hc_proxies is None:
+        sent_hc_proxies = index.sentience.member_set(judgment_index.HC)
+    if overlap_dict is None:
+        overlap_dict = index.overlap_dict
+    if seed is None:
+        seed = random_streams.new_root_seed()
+    if sent_scores is None and species in SENT_SPECIES:
+        raise ValueError('Packed welfare ranges of {} need the species\' packed sentience scores'.format(species))
+
+    proxies = judgments.proxies
+    if sent_scores is not None:
+        is_overlap = np.array([proxy in overlap_dict for proxy in proxies])
+    else:
+        is_overlap = np.zeros(len(proxies), dtype=bool)
+    drawn_idx = np.flatnonzero(~is_overlap)
+    overlap_idx = np.flatnonzero(is_overlap)
+
+    drawn_proxies = [proxies[ii] for ii in drawn_idx]
+    lower, upper = judgment_bounds(judgments.species_codes(species)[drawn_idx], get_judgment_prob_map(weight_no, unknown_prob))
+    bits = np.empty((n_scenarios, packed_scores.n_words(len(drawn_proxies))), dtype=np.uint64)
+    for block, start, stop in random_streams.stream_blocks(n_scenarios, first_scenario):
+        if progress is not None:
+            progress(start, n_scenarios)
+        bits[start:stop] = packed_scores.pack_rows(draw_presence(lower, upper, drawn_proxies, stop - start, seed, \
+            'welfare ranges', species, block, sampler))
+    coefficients = np.zeros((len(drawn_proxies), len(proxies)))
+    coefficients[np.arange(len(drawn_proxies)), drawn_idx] = proxy_weights(drawn_proxies, hc_proxies, hc_weight)
+    parts = [(bits, coefficients)]
+
+    if len(overlap_idx) > 0:
+        overlap_proxies = [proxies[ii] for ii in overlap_idx]
+        sent_proxies, overlap_weights = overlap_weight_matrix(overlap_proxies, overlap_dict, hc_proxies, \
+            sent_hc_proxies, hc_weight)
+        sent_idx = [sent_scores.columns[sent_proxy] for sent_proxy in sent_proxies]
+        for sent_bits, sent_coefficients in sent_scores.parts:
+            coefficients = np.zeros((len(sent_coefficients), len(proxies)))
+            coefficients[:, overlap_idx] = overlap_weights.dot(sent_coefficients[:, sent_idx].T).T
+            parts.append((sent_bits[:n_scenarios], coefficients))
+    return proxies, packed_scores.PackedScores(parts, proxies, n_scenarios)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate welfare ranges')
+    parser.add_argument('--species', type=str, help="What species do you want to simulate the welfare range of?")
+    parser.add_argument('--unknown_prob', type=float, help="What probability do you assign Unknown judgements for this species?", default=0)
+    parser.add_argument('--weight_no', type=str, help="Do you want to give non-zero probability to lean no and likely no?")
+    parser.add_argument('--hc_weight', type=float, help="What weight do high-confidence proxies get relative to other proxies?")
+    parser.add_argument('--scenarios', type=int, help='How many Monte Carlo simulations to run?', default=10000)
+    parser.add_argument('--csv', type=str, help='Define the relative path to the CSV with the species scores information')
+    parser.add_argument('--path', type=str, help='Define a custom path for the saved model outputs', default='')
+    parser.add_argument('--save', type=bool, help='Set to False to not save (overwrite) model outputs', default=True)
+    parser.add_argument('--update_every', type=int, help='How many steps to run before updating? Progress is reported at most once per random stream block', default=1000)
+    parser.add_argument('--seed', type=int, help='Root seed of the random streams; a fresh one is drawn if not set', default=None)
+    parser.add_argument('--verbose', type=bool, help='Set to True to get scenario-specific output', default=False)
+    parser.add_argument('--metrics', type=str, help='JSON lines file to write progress and timing events to', default=None)
+    parser.add_argument('--shard', type=int, help='Which shard (from 0) of the scenarios to simulate', default=0)
+    parser.add_argument('--shards', type=int, help='Split the scenarios into this many shards, each saved as a partial store', default=1)
+    parser.add_argument('--merge', action='store_true', help='Merge the partial stores of --shards shards at --path instead of simulating')
+    parser.add_argument('--sampler', type=str, choices=sampling.SAMPLERS, help='How to draw the uniforms behind every judgment', default=sampling.RANDOM)
+    args = parser.parse_args()
+
+    SPECIES = args.species
+    N_SCENARIOS = args.scenarios
+    VERBOSE = args.verbose
+    SAVE = args.save
+    PATH = args.path
+
+    if VERBOSE:
+        message = '-\n### SCENARIO {done} ###'
+    else:
+        message = '... Completed {done}/{total}'
+
+    if args.merge:
+        path = score_store.merge_shards(PATH, args.shards)
+        print('... Merged {} shards into {}'.format(args.shards, path))
+        return
+    if args.shards > 1 and args.seed is None:
+        parser.error('--shards needs --seed, so every shard draws from the same random streams')
+    first_scenario, n_shard = random_streams.shard_range(N_SCENARIOS, args.shard, args.shards)
+
+    with instrumentation.default_metrics(path=args.metrics) as metrics:
+        # A shard's overlap proxies come from the same scenarios of the sentience scores
+        sent_scores = None
+        if args.shards > 1 and SPECIES in SENT_SPECIES:
+            sent_scores = score_store.load_shard_scores(sent_scores_prefix(SPECIES), args.shard, args.shards, \
+                first_scenario, n_shard)
+        with metrics.stage('welfare ranges simulate', n_shard, species=SPECIES):
+            proxies, scores = simulate_species(load_judgments(), SPECIES, args.unknown_prob, args.weight_no, args.hc_weight, \
+                n_shard, sent_scores=sent_scores, seed=args.seed, first_scenario=first_scenario, sampler=args.sampler, \
+                progress=metrics.progress_callback('welfare ranges simulate', message, species=SPECIES))
+
+        if SAVE:
+            metadata = {} if args.sampler == sampling.RANDOM else {'sampler': args.sampler}
+            if args.shards > 1:
+                PATH = score_store.shard_prefix(PATH, args.shard, args.shards)
+                metadata.update(score_store.shard_metadata(args.shard, args.shards, first_scenario, N_SCENARIOS, args.seed))
+            metrics.progress('welfare ranges save', 0, 1, '... Saving 1/1', species=SPECIES)
+            with metrics.stage('welfare ranges save', n_shard, species=SPECIES) as extra:
+                path = score_store.write_scores(PATH, proxies, scores, stage='welfare ranges', species=SPECIES, **metadata)
+                extra['bytes_written'] = instrumentation.bytes_written([path, score_store.header_file(PATH)])
+
+
+if __name__ == '__main__':
+    main()